@@ -0,0 +1,58 @@
+"""Checks that importing gcms stays cheap.
+
+Runs 'python -X importtime -c "import <module>"' in fresh interpreters, takes the fastest of
+several repeats and fails if the cumulative import time exceeds the budget or if a heavy
+dependency was imported eagerly.
+
+Usage:
+    python benchmarks/import_time.py [--module gcms] [--budget-ms 100] [--repeat 5]
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+HEAVY_MODULES = ("pyopenms", "matplotlib", "seaborn", "lmfit", "icecream")
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str) -> tuple[float, set[str]]:
+    """Returns the cumulative import time of module in ms and the names of all imported modules"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    cumulative_us = None
+    imported = set()
+    for match in LINE.finditer(out):
+        _, cumulative, indent, name = match.groups()
+        imported.add(name)
+        if name == module and len(indent) == 1:
+            cumulative_us = int(cumulative)
+    if cumulative_us is None:
+        raise RuntimeError(f"No import time reported for '{module}':\n{out}")
+    return cumulative_us / 1000, imported
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="gcms")
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = [measure(args.module) for _ in range(args.repeat)]
+    best_ms = min(ms for ms, _ in results)
+    heavy = sorted({name.split(".")[0] for name in results[0][1]} & set(HEAVY_MODULES))
+
+    print(f"import {args.module}: {best_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    if heavy:
+        print(f"eagerly imported heavy modules: {', '.join(heavy)}")
+    return 0 if best_ms <= args.budget_ms and not heavy else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Measures memory and accuracy of compact precision (see gcms.Precision) against double precision.
+
+Runs the pipeline on synthetic runs (Gaussian peaks on a drifting baseline with noise) in both precisions and reports
+the chromatogram memory per run and the largest deviations of the peak tables. Peaks are compared where both
+precisions found a peak at the same data point. Use --rt-start to check rt_offset on runs that do not start at 0.
+
+Usage:
+    python benchmarks/precision.py [--runs 20] [--points 200000] [--peaks 150] [--min-snr 3] [--rt-start 0]
+"""
+
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+from gcms import Batch, Precision
+
+
+def synthetic_run(
+    seed: int, n_points: int, n_peaks: int, rt_range: tuple[float, float]
+) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    rt = np.linspace(*rt_range, n_points)
+    intensity = 2000.0 * (1 + 0.2 * (rt - rt[0]) / (rt[-1] - rt[0]))
+    intensity += rng.normal(0, 300, n_points)
+    centers = rng.uniform(rt_range[0] + 30, rt_range[1] - 30, n_peaks)
+    heights = 10 ** rng.uniform(3.5, 6.5, n_peaks)
+    sigmas = rng.uniform(1.0, 4.0, n_peaks)
+    for c, h, s in zip(centers, heights, sigmas):
+        window = np.abs(rt - c) < 8 * s
+        intensity[window] += h * np.exp(-0.5 * ((rt[window] - c) / s) ** 2)
+    return pd.DataFrame(
+        {"index": np.arange(n_points), "retention_time": rt, "intensity": intensity}
+    )
+
+
+def relative(a: pd.Series, b: pd.Series) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel = (a - b).abs().to_numpy() / b.abs().to_numpy()
+    return rel[np.isfinite(rel)]
+
+
+def matched(double: pd.DataFrame, compact: pd.DataFrame) -> pd.DataFrame:
+    """Peaks of both tables at the same data point, columns suffixed '_d' and '_c'"""
+
+    # two picks can be moved to the same apex: pair them by their order
+    def keyed(peaks: pd.DataFrame) -> pd.DataFrame:
+        return peaks.assign(occurrence=peaks.groupby("index").cumcount())
+
+    return keyed(double).merge(
+        keyed(compact), on=["index", "occurrence"], suffixes=("_d", "_c")
+    )
+
+
+def report(double: list[pd.DataFrame], compact: list[pd.DataFrame]) -> None:
+    m = pd.concat([matched(d, c) for d, c in zip(double, compact)])
+    n_double = sum(map(len, double))
+    same_borders = (m["left_border_d"] == m["left_border_c"]) & (
+        m["right_border_d"] == m["right_border_c"]
+    )
+    area = relative(m["area_c"], m["area_d"])
+    rt = (m["retention_time_d"] - m["retention_time_c"]).abs().to_numpy()
+    lines = {
+        "peaks (double)": n_double,
+        "unmatched peaks": n_double + sum(map(len, compact)) - 2 * len(m),
+        "peaks with other borders": int((~same_borders).sum()),
+        "retention time, max abs [s]": f"{rt.max(initial=0.0):.2g}",
+        "area, median rel": f"{np.percentile(area, 50):.2g}",
+        "area, p99.9 rel": f"{np.percentile(area, 99.9):.2g}",
+        "area, max rel": f"{area.max(initial=0.0):.2g}",
+        "area, max rel same borders": f"{relative(m['area_c'][same_borders], m['area_d'][same_borders]).max(initial=0.0):.2g}",
+        "peaks with area rel > 1e-3": int(np.count_nonzero(area > 1e-3)),
+    }
+    for name, value in lines.items():
+        print(f"{name:<30}{value}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--points", type=int, default=200_000)
+    parser.add_argument("--peaks", type=int, default=150)
+    parser.add_argument("--min-snr", type=float, default=3.0)
+    parser.add_argument("--rt-start", type=float, default=0.0)
+    parser.add_argument("--jobs", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    traces = [
+        synthetic_run(
+            seed, args.points, args.peaks, (args.rt_start, args.rt_start + 3600.0)
+        )
+        for seed in range(args.runs)
+    ]
+    print(
+        f"chromatogram memory per run: double {Precision.memory_usage(traces[0]) / 1e6:.1f} MB, "
+        f"compact {Precision.memory_usage(Precision.compact_chromatogram(traces[0])) / 1e6:.1f} MB"
+    )
+
+    results = {}
+    for precision, rt_offset in (
+        ("double", False),
+        ("compact", False),
+        ("compact", True),
+    ):
+        config = Batch.PipelineConfig(
+            min_snr=args.min_snr, precision=precision, rt_offset=rt_offset
+        )
+        start = time.perf_counter()
+        results[precision, rt_offset] = Batch.process_traces(traces, config, args.jobs)
+        print(
+            f"{precision}{' rt_offset' if rt_offset else ''}: {time.perf_counter() - start:.2f} s"
+        )
+
+    for key in (("compact", False), ("compact", True)):
+        print(f"\ncompact{' rt_offset' if key[1] else ''} against double:")
+        report(results["double", False], results[key])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,6 @@ from src.gcms.pyopenms_client import PyOpenMsClient as omsc
 from src.gcms.plotting import ChromPlotting as cp
 import numpy as np
 import scipy
-from scipy.optimize import curve_fit
 
 data = {
     "rt": [
@@ -122,8 +121,8 @@ def demo():
     df = Processor.get_sample(p.df)
     popt = Processor.fit_model(df["retention_time"], df["intensity"])
 
-    # para_df, _ = curve_fit(func_three, df["retention_time"], df["intensity"])
-    # para_test, _ = curve_fit(func_three, data["rt"], data["intensity"])
+    # para_df = Processor.fit_model(df["retention_time"], df["intensity"], order=3)
+    # para_test = Processor.fit_model(data["rt"], data["intensity"], order=3)
     # ic(para_df)
     # ic(para_test)
 
@@ -145,23 +144,7 @@ def add_indices():
     return
 
 
-def func(x, a, b, c, d, e):
-    return a * x**4 + b * x**3 + c * x**2 + d * x + e
-
-
-def func_three(x, a, b, c, d):
-    return a * x**3 + b * x**2 + c * x + d
-
-
-def func_quad(x, a, b, c):
-    return a * x**2 + b * x + c
-
-
-def func_five(x, a1, a2, a3, a4, a5, a6):
-    return a1 * x**5 + a2 * x**4 + a3 * x**3 + a4 * x**2 + a5 * x + a6
-
-
-def calc_poly():
+def calc_poly(order: int = 4):
     data = {
         "rt": [
             463,
@@ -203,7 +186,8 @@ def calc_poly():
         ],
     }
 
-    popt, pcov = curve_fit(func, data["rt"], data["intensity"])
+    popt = Processor.fit_model(data["rt"], data["intensity"], order=order)
+    return popt
 
 
 if __name__ == "__main__":
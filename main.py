@@ -1,6 +1,7 @@
-def main():
-    print("Hello from gcms!")
+import sys
+
+from gcms.cli import main
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
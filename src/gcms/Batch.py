@@ -0,0 +1,927 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, fields, replace
+import json
+import logging
+import os
+import pathlib
+import time
+import tomllib
+import pandas as pd
+from . import (
+    DataReader,
+    PeakFinder,
+    Integrator,
+    Deconvolver,
+    Export,
+    Incremental,
+    LibrarySearch,
+    Noise,
+    Precision,
+    Processor,
+    Profiling,
+    QC,
+    RetentionIndex,
+    Transport,
+)
+
+OUTPUT_FORMATS = ("csv", "parquet")
+# file in the output directory of a ResultStore that records the input root its outputs are named relative to
+INPUT_ROOT_FILE = "input_root.json"
+INTEGRATORS = ("trapezoid", "gaussian", "emg", "skewed_gaussian")
+DECONVOLVERS = ("none", "valley_drop", "tangent_skim")
+NOISE_ESTIMATORS = ("none", "mad", "percentile")
+PEAK_FINDERS = ("pyopenms", "cwt")
+
+
+@dataclass
+class PipelineConfig:
+    """Parameters of the processing pipeline: read, filter, find peaks, find borders, deconvolve, integrate, normalize.
+
+    Can be loaded from a TOML or JSON file with load_config(). Unknown keys are rejected.
+    With chunk_size set, files are processed out of core in chunks of that many data points (see Chunked).
+    """
+
+    savgol_window: int = 5
+    savgol_polyorder: int = 2
+    peak_finder: str = "pyopenms"
+    signal_to_noise: float = 0.8
+    cwt_max_points: int | None = 20000
+    cwt_ridge_snr: float = 3.0
+    noise: str = "mad"
+    noise_window: int = 501
+    min_snr: float | None = None
+    deconvolver: str = "none"
+    skim_ratio: float = 0.1
+    integrator: str = "trapezoid"
+    normalize: str = "max"
+    reference_rt: float | None = None
+    rt_tolerance: float | None = None
+    library: str | None = None
+    ri_window: float = 30.0
+    min_match_score: float = 0.0
+    ri_ladder: str | None = None
+    ri_first_carbon: int = 8
+    ri_mode: str = "linear"
+    ri_cache_dir: str | None = None
+    instrument: str = "default"
+    method: str = "default"
+    qc_saturation: float | None = None
+    qc_window: int = 50
+    qc_min_runs: int = 5
+    qc_z_limit: float = 4.0
+    qc_rel_spread: float = 0.05
+    qc_skip_outliers: bool = True
+    precision: str = "double"
+    rt_offset: bool = False
+    chunk_size: int | None = None
+    chunk_overlap: int | None = None
+    chunk_jobs: int = 1
+    chunk_dir: str | None = None
+
+    def __post_init__(self) -> None:
+        if self.chunk_size is not None and self.chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, got {self.chunk_size}")
+        if self.chunk_jobs < 1:
+            raise ValueError(f"chunk_jobs must be at least 1, got {self.chunk_jobs}")
+        if self.precision not in Precision.PRECISIONS:
+            raise ValueError(
+                f"Unknown precision '{self.precision}', expected one of {Precision.PRECISIONS}"
+            )
+        if self.peak_finder not in PEAK_FINDERS:
+            raise ValueError(
+                f"Unknown peak finder '{self.peak_finder}', expected one of {PEAK_FINDERS}"
+            )
+        if self.ri_mode not in RetentionIndex.RI_MODES:
+            raise ValueError(
+                f"Unknown retention index mode '{self.ri_mode}', expected one of {RetentionIndex.RI_MODES}"
+            )
+        if self.integrator not in INTEGRATORS:
+            raise ValueError(
+                f"Unknown integrator '{self.integrator}', expected one of {INTEGRATORS}"
+            )
+        if self.noise not in NOISE_ESTIMATORS:
+            raise ValueError(
+                f"Unknown noise estimator '{self.noise}', expected one of {NOISE_ESTIMATORS}"
+            )
+        if self.deconvolver not in DECONVOLVERS:
+            raise ValueError(
+                f"Unknown deconvolver '{self.deconvolver}', expected one of {DECONVOLVERS}"
+            )
+        if self.normalize not in Integrator.NORM_MODES:
+            raise ValueError(
+                f"Unknown normalization '{self.normalize}', expected one of {Integrator.NORM_MODES}"
+            )
+
+
+def load_config(file_path: str | pathlib.Path) -> PipelineConfig:
+    """Reads a PipelineConfig from a .toml or .json file
+
+    Raises:
+        ValueError: If the file type is not supported or the file contains unknown keys.
+    """
+    path = pathlib.Path(file_path)
+    if path.suffix.lower() == ".toml":
+        with open(path, "rb") as f:
+            values = tomllib.load(f)
+    elif path.suffix.lower() == ".json":
+        with open(path) as f:
+            values = json.load(f)
+    else:
+        raise ValueError(
+            f"Config file '{path}' must be a .toml or .json file, got '{path.suffix}'"
+        )
+    known = {f.name for f in fields(PipelineConfig)}
+    unknown = set(values) - known
+    if unknown:
+        raise ValueError(
+            f"Unknown keys in config file '{path}': {sorted(unknown)}. Known keys: {sorted(known)}"
+        )
+    return PipelineConfig(**values)
+
+
+def available_readers() -> list[DataReader.ChromDataReader]:
+    return [DataReader.PyomenmsReader(), DataReader.CsvReader()]
+
+
+def find_reader(file_path: str | pathlib.Path) -> DataReader.ChromDataReader | None:
+    """Returns the first reader that is compatible with the file, None if there is none"""
+    for reader in available_readers():
+        if reader.is_compatible(file_path):
+            return reader
+    return None
+
+
+def collect_inputs(paths: list[str | pathlib.Path]) -> list[pathlib.Path]:
+    """Expands directories to all files that can be read by one of the available readers. Files are returned as given.
+
+    Raises:
+        FileNotFoundError: If a path does not exist.
+    """
+    inputs = []
+    for p in map(pathlib.Path, paths):
+        if p.is_dir():
+            inputs.extend(
+                sorted(f for f in p.rglob("*") if f.is_file() and find_reader(f))
+            )
+        elif p.is_file():
+            inputs.append(p)
+        else:
+            raise FileNotFoundError(f"Input '{p}' does not exist")
+    return inputs
+
+
+def input_root(paths: list[str | pathlib.Path]) -> pathlib.Path | None:
+    """Deepest directory that contains all given inputs: a directory itself, the parent of a file. None if there are none"""
+    if not paths:
+        return None
+    dirs = [
+        os.path.abspath(p if pathlib.Path(p).is_dir() else pathlib.Path(p).parent)
+        for p in paths
+    ]
+    return pathlib.Path(os.path.commonpath(dirs))
+
+
+def run_name(
+    input_path: str | pathlib.Path, root: str | pathlib.Path | None = None
+) -> str:
+    """Name of the outputs of an input file: its path relative to root without suffix, directories joined by '__'.
+
+    E.g. 'night1/run01.csv' in root is 'night1__run01', 'run01.csv' in root is 'run01'. Files outside root, or all
+    files if root is None, are named by their stem.
+    """
+    path = pathlib.Path(os.path.abspath(input_path))
+    if root is None or not path.is_relative_to(os.path.abspath(root)):
+        return path.stem
+    relative = path.relative_to(os.path.abspath(root))
+    return "__".join([*relative.parent.parts, relative.stem])
+
+
+def build_processor(
+    config: PipelineConfig, file_path: str | pathlib.Path | None = None
+) -> Processor.ChromatogramProcessor:
+    """Creates a ChromatogramProcessor with all dependencies set according to config. The reader is only set if file_path is given"""
+    p = Processor.ChromatogramProcessor()
+    if file_path is not None:
+        reader = find_reader(file_path)
+        if reader is None:
+            raise ValueError(f"No reader available for file '{file_path}'")
+        p.set_reader(reader)
+    noise = None
+    if config.noise == "mad":
+        noise = Noise.RollingMadNoise(config.noise_window)
+    elif config.noise == "percentile":
+        noise = Noise.PercentileNoise(config.noise_window)
+    if config.peak_finder == "cwt":
+        p.set_peak_finder(
+            PeakFinder.CwtChromPeakFinder(
+                ridge_snr=config.cwt_ridge_snr,
+                max_points=config.cwt_max_points,
+                noise=noise,
+                min_snr=config.min_snr,
+            )
+        )
+    else:
+        p.set_peak_finder(
+            PeakFinder.PyopenmsChromPeakFinder(
+                config.signal_to_noise, noise, config.min_snr
+            )
+        )
+    if config.integrator == "trapezoid":
+        p.set_integrator(Integrator.ChromTrapezoidIntegrator())
+    else:
+        p.set_integrator(Integrator.ChromPeakModelIntegrator(config.integrator))
+    if config.deconvolver == "valley_drop":
+        p.set_deconvolver(Deconvolver.ValleyDropDeconvolver())
+    elif config.deconvolver == "tangent_skim":
+        p.set_deconvolver(Deconvolver.TangentSkimDeconvolver(config.skim_ratio))
+    if config.ri_ladder is not None:
+        p.set_ri_calibration(load_calibration(config))
+    return p
+
+
+def process_file(
+    file_path: str | pathlib.Path,
+    config: PipelineConfig,
+    reference: QC.BatchReference | None = None,
+    profiler: Profiling.StageProfiler | None = None,
+) -> Processor.ChromatogramProcessor:
+    """Runs the full pipeline on one file and returns the processor holding all results in processor.df
+
+    If a QC reference is given, runs flagged as outliers (df.qc_flags) skip the library search when config.qc_skip_outliers is set.
+    With a profiler, every step runs as a stage of it; chunks processed out of core are one stage 'chunked'.
+    """
+    if config.chunk_size is not None:
+        # Chunked builds on this module, so it is imported when needed
+        from . import Chunked
+
+        with Profiling.stage(profiler, "chunked"):
+            p = Chunked.process_file(file_path, config)
+        p.set_profiler(profiler)
+    else:
+        p = build_processor(config, file_path)
+        p.set_profiler(profiler)
+        p.read_to_df(file_path)
+        if config.precision == "compact":
+            p.df.compact(config.rt_offset)
+        run_pipeline(p, config)
+    if reference is not None and p.df.qc:
+        p.df.qc_flags = reference.check(p.df.qc)
+    skip = bool(p.df.qc_flags) and config.qc_skip_outliers
+    if config.library is not None and p.df.peaks is not None and not skip:
+        with Profiling.stage(profiler, "library_search"):
+            p.df.peaks = LibrarySearch.identify(
+                p.df.peaks,
+                LibrarySearch.SpectrumSet.read(file_path),
+                _open_library(config.library),
+                p.df.chromatogram,
+                subtract_background=True,
+                ri_window=config.ri_window,
+                min_score=config.min_match_score,
+            )
+    return p
+
+
+_libraries: dict[str, LibrarySearch.SpectralLibrary] = {}
+
+
+def _open_library(msp_path: str) -> LibrarySearch.SpectralLibrary:
+    """Opens a library index once per process"""
+    if msp_path not in _libraries:
+        _libraries[msp_path] = LibrarySearch.load_library(msp_path)
+    return _libraries[msp_path]
+
+
+_calibrations: dict[tuple, RetentionIndex.RiCalibration] = {}
+
+
+def _calibration_key(config: PipelineConfig) -> tuple:
+    origin = RetentionIndex.ladder_origin(
+        config.ri_ladder, config.ri_mode, config.ri_first_carbon
+    )
+    return (config.instrument, config.method, *origin.values())
+
+
+def load_calibration(config: PipelineConfig) -> RetentionIndex.RiCalibration:
+    """Returns the retention index calibration of config.instrument and config.method, computed once per batch.
+
+    Calibrations are kept per process and, if config.ri_cache_dir is set, saved there and reused by later batches as
+    long as the ladder file (path, size, modification time), config.ri_mode and config.ri_first_carbon are unchanged
+    (see RetentionIndex.ladder_origin). config.ri_ladder is a saved calibration (.json), an alkane
+    table (.csv with columns 'carbon', 'retention_time') or a run of the alkane ladder, whose peaks are found with
+    the pipeline of config (see RetentionIndex.detect_ladder).
+
+    Raises:
+        ValueError: If config.ri_ladder is not set or no ladder can be detected.
+        FileNotFoundError: If config.ri_ladder does not exist.
+    """
+    if config.ri_ladder is None:
+        raise ValueError(
+            "Error loading retention index calibration: ri_ladder is not set"
+        )
+    key = _calibration_key(config)
+    if key in _calibrations:
+        return _calibrations[key]
+
+    origin = RetentionIndex.ladder_origin(
+        config.ri_ladder, config.ri_mode, config.ri_first_carbon
+    )
+    cache = RetentionIndex.CalibrationCache(config.ri_cache_dir)
+    calibration = cache.get(config.instrument, config.method)
+    if calibration is None or calibration.origin != origin:
+        calibration = replace(_calibrate(config), origin=origin)
+        cache.put(calibration)
+    _calibrations[key] = calibration
+    return calibration
+
+
+def _calibrate(config: PipelineConfig) -> RetentionIndex.RiCalibration:
+    labels = {"instrument": config.instrument, "method": config.method}
+    ladder = config.ri_ladder
+    if RetentionIndex.is_ladder_file(ladder):
+        calibration = RetentionIndex.read_ladder_file(ladder, mode=config.ri_mode)
+        # a saved calibration is relabeled, so it is cached for the configured instrument and method
+        return replace(calibration, source=ladder, **labels)
+    p = build_processor(replace(config, ri_ladder=None), ladder)
+    p.read_to_df(ladder)
+    run_pipeline(p, config)
+    peaks = p.df.peaks
+    if peaks is None:
+        raise ValueError(f"Error detecting alkane ladder: no peaks found in '{ladder}'")
+    if config.library is not None:
+        peaks = LibrarySearch.identify(
+            peaks,
+            LibrarySearch.SpectrumSet.read(ladder),
+            _open_library(config.library),
+            p.df.chromatogram,
+            subtract_background=True,
+            min_score=config.min_match_score,
+        )
+    logging.info(f"Detecting alkane ladder in '{ladder}'")
+    return RetentionIndex.detect_ladder(
+        peaks, config.ri_first_carbon, mode=config.ri_mode, source=ladder, **labels
+    )
+
+
+def _seed_calibration(key: tuple, calibration: RetentionIndex.RiCalibration) -> None:
+    _calibrations[key] = calibration
+
+
+def worker_pool(config: PipelineConfig, jobs: int) -> ProcessPoolExecutor:
+    """Process pool whose workers start with the retention index calibration of config, instead of each computing it"""
+    if config.ri_ladder is None:
+        return ProcessPoolExecutor(max_workers=jobs)
+    return ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_seed_calibration,
+        initargs=(_calibration_key(config), load_calibration(config)),
+    )
+
+
+def run_pipeline(p: Processor.ChromatogramProcessor, config: PipelineConfig) -> None:
+    """Runs all steps after reading on the chromatogram in p.df"""
+    detect_and_integrate(p, config)
+    finalize_peaks(p, config)
+
+
+def detect_and_integrate(
+    p: Processor.ChromatogramProcessor, config: PipelineConfig
+) -> None:
+    """Steps that only read the trace around each peak: filter, find peaks, find borders, deconvolve, integrate"""
+    p.filter_savgol(config.savgol_window, config.savgol_polyorder)
+    p.find_peaks(p.df.chromatogram)
+    p.find_peak_borders()
+    if p.deconvolver is not None:
+        p.deconvolve_peaks()
+    p.integrate_peak_area()
+
+
+def finalize_peaks(p: Processor.ChromatogramProcessor, config: PipelineConfig) -> None:
+    """Steps that need the peak table of the whole run: normalize, retention indices, QC metrics"""
+    p.normalize_integral(config.normalize, config.reference_rt, config.rt_tolerance)
+    if p.ri_calibration is not None:
+        p.calc_retention_index()
+    p.calc_qc(config.qc_saturation, config.reference_rt, config.rt_tolerance)
+    if p.df.precision == "compact" and p.df.peaks is not None:
+        p.df.peaks = Precision.compact_peaks(p.df.peaks)
+
+
+def _find_peaks(chrom: pd.DataFrame, config: PipelineConfig) -> pd.DataFrame:
+    p = build_processor(config)
+    p.df.init_chromatogram(chrom)
+    # traces are converted by process_traces, before they are shared
+    p.df.precision = config.precision
+    run_pipeline(p, config)
+    if p.df.peaks is None:
+        raise ValueError("no peak table was created")
+    return p.df.peaks
+
+
+def _process_shared_trace(
+    handle: Transport.FrameHandle, config: PipelineConfig
+) -> Transport.FrameHandle:
+    with Transport.attach(handle) as chrom:
+        peaks = _find_peaks(chrom, config)
+    return Transport.hand_over(peaks)
+
+
+def process_traces(
+    traces: list[pd.DataFrame], config: PipelineConfig, jobs: int = 1
+) -> list[pd.DataFrame]:
+    """Runs the pipeline on several chromatograms (e.g. the traces of one multi-trace run) in a process pool.
+
+    Traces and peak tables are passed through shared memory (see Transport), only small handles are pickled.
+    With config.precision 'compact', traces are converted (see Precision) before they are shared.
+
+    Args:
+        traces: DataFrames with columns 'index', 'retention_time', 'intensity'
+        config: Pipeline parameters
+        jobs: Number of worker processes
+
+    Returns:
+        One peak table per trace, in the order of traces
+    """
+    if config.precision == "compact":
+        traces = [Precision.compact_chromatogram(t, config.rt_offset) for t in traces]
+    if jobs <= 1 or len(traces) <= 1:
+        return [_find_peaks(chrom, config) for chrom in traces]
+
+    with Transport.SharedFrameStore() as store, worker_pool(config, jobs) as pool:
+        handles = [store.share(chrom) for chrom in traces]
+        futures = [pool.submit(_process_shared_trace, h, config) for h in handles]
+        peaks, error = [], None
+        # collect every handed over result, so no block is left behind if one trace fails
+        for f in futures:
+            try:
+                peaks.append(Transport.collect(f.result()))
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return peaks
+
+
+class ResultStore:
+    """Writes one peak table per input file into a directory.
+
+    The outputs of an input are named by run_name() relative to input_root, so 'night1/run01.csv' and
+    'night2/run01.csv' are stored as 'night1__run01.peaks.<fmt>' and 'night2__run01.peaks.<fmt>'. Keep input_root
+    fixed between batches that share the directory (resume, incremental), otherwise the names change: the first batch
+    records it in the directory ('input_root.json', see record_input_root) and later batches with another root are
+    rejected.
+    Next to each table, an Incremental.RunRecord ('<table>.meta.json') can record the input and pipeline it came from.
+    QC reports per partition of a batch are written to the subdirectory 'partitions', tables of paired comparisons to
+    'comparisons', profiles of a batch to 'profile'.
+
+    Fields:
+        output_dir: Directory of the peak tables
+        fmt: One of OUTPUT_FORMATS
+        mzml: If set, run_file also writes the filtered chromatogram and peaks of every run to '<name>.processed.mzML'
+        input_root: Directory the inputs are named relative to, None names them by their stem
+    """
+
+    def __init__(
+        self,
+        output_dir: str | pathlib.Path,
+        fmt: str = "csv",
+        mzml: Export.MzmlOptions | None = None,
+        input_root: str | pathlib.Path | None = None,
+    ) -> None:
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unknown output format '{fmt}', expected one of {OUTPUT_FORMATS}"
+            )
+        self.output_dir = pathlib.Path(output_dir)
+        self.fmt = fmt
+        self.mzml = mzml
+        self.input_root = None if input_root is None else pathlib.Path(input_root)
+
+    def run_name(self, input_path: str | pathlib.Path) -> str:
+        return run_name(input_path, self.input_root)
+
+    def recorded_input_root(self) -> tuple[bool, pathlib.Path | None]:
+        """Input root recorded in the output directory: (True, root) if there is a record, else (False, None)"""
+        path = self.output_dir / INPUT_ROOT_FILE
+        if not path.is_file():
+            return False, None
+        with open(path) as f:
+            root = json.load(f)["input_root"]
+        return True, None if root is None else pathlib.Path(root)
+
+    def record_input_root(self) -> None:
+        """Records input_root in the output directory, or checks it against the recorded one
+
+        Raises:
+            ValueError: If the directory holds outputs named relative to another input root.
+        """
+        root = None if self.input_root is None else os.path.abspath(self.input_root)
+        recorded, previous = self.recorded_input_root()
+        if recorded:
+            if (None if previous is None else str(previous)) != root:
+                raise ValueError(
+                    f"The outputs in '{self.output_dir}' are named relative to the input root '{previous}', not '{root}'. Pass the same input root or use another output directory"
+                )
+            return
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / INPUT_ROOT_FILE
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"input_root": root}, f)
+        tmp.replace(path)
+
+    def path_for(self, input_path: str | pathlib.Path) -> pathlib.Path:
+        return self.output_dir / f"{self.run_name(input_path)}.peaks.{self.fmt}"
+
+    def exists(self, input_path: str | pathlib.Path) -> bool:
+        return self.path_for(input_path).is_file()
+
+    def read(self, input_path: str | pathlib.Path) -> pd.DataFrame:
+        """Reads the peak table of an input file"""
+        path = self.path_for(input_path)
+        if self.fmt == "csv":
+            return pd.read_csv(path)
+        return pd.read_parquet(path)
+
+    def mzml_path_for(self, input_path: str | pathlib.Path) -> pathlib.Path:
+        return self.output_dir / f"{self.run_name(input_path)}.processed.mzML"
+
+    def write_mzml(
+        self, input_path: str | pathlib.Path, df: Processor.ChromatogramDF
+    ) -> pathlib.Path:
+        """Writes a processed run to mzML with the options in mzml (defaults if None), see Export.write_mzml"""
+        return Export.write_mzml(df, self.mzml_path_for(input_path), self.mzml)
+
+    def record_path_for(self, input_path: str | pathlib.Path) -> pathlib.Path:
+        out = self.path_for(input_path)
+        return out.with_name(f"{out.name}.meta.json")
+
+    def read_record(
+        self, input_path: str | pathlib.Path
+    ) -> Incremental.RunRecord | None:
+        return Incremental.RunRecord.load(self.record_path_for(input_path))
+
+    def write_record(
+        self, input_path: str | pathlib.Path, record: Incremental.RunRecord
+    ) -> None:
+        """Writes the record of a peak table. Write it after the table, so a record never describes an older table"""
+        record.save(self.record_path_for(input_path))
+
+    def partition_path_for(self, partition: str) -> pathlib.Path:
+        name = "_root" if partition in ("", ".") else partition.replace("/", "__")
+        return self.output_dir / "partitions" / f"{name}.qc.csv"
+
+    def partition_runs(self, partition: str) -> set[str]:
+        """Input paths in the QC report of a partition, empty if there is no report"""
+        path = self.partition_path_for(partition)
+        if not path.is_file():
+            return set()
+        return set(pd.read_csv(path, usecols=["input_path"])["input_path"])
+
+    def write_partition_qc(self, partition: str, qc: pd.DataFrame) -> pathlib.Path:
+        """Writes the QC table of the runs of one partition"""
+        out = self.partition_path_for(partition)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".{out.name}.tmp")
+        qc.to_csv(tmp, index=False)
+        tmp.replace(out)
+        return out
+
+    def write_qc(self, qc: pd.DataFrame) -> pathlib.Path:
+        """Writes the QC table of a batch (see BatchSummary.qc_table) to 'batch_qc.csv'"""
+        out = self.output_dir / "batch_qc.csv"
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".{out.name}.tmp")
+        qc.to_csv(tmp, index=False)
+        tmp.replace(out)
+        return out
+
+    @property
+    def profile_dir(self) -> pathlib.Path:
+        """Directory of the profiles of a batch (see Profiling.write_profiles)"""
+        return self.output_dir / "profile"
+
+    def comparison_path_for(
+        self,
+        sample: str | pathlib.Path,
+        reference: str | pathlib.Path,
+        kind: str = "peaks",
+    ) -> pathlib.Path:
+        name = f"{self.run_name(sample)}__vs__{self.run_name(reference)}"
+        return self.output_dir / "comparisons" / f"{name}.{kind}.{self.fmt}"
+
+    def write_comparison(
+        self,
+        sample: str | pathlib.Path,
+        reference: str | pathlib.Path,
+        table: pd.DataFrame,
+        kind: str = "peaks",
+    ) -> pathlib.Path:
+        """Writes a table of a paired comparison (see Comparison.compare) to the subdirectory 'comparisons'"""
+        out = self.comparison_path_for(sample, reference, kind)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".{out.name}.tmp")
+        if self.fmt == "csv":
+            table.to_csv(tmp, index=False)
+        else:
+            table.to_parquet(tmp, index=False)
+        tmp.replace(out)
+        return out
+
+    def write(
+        self, input_path: str | pathlib.Path, peaks: pd.DataFrame
+    ) -> pathlib.Path:
+        """Writes the peak table atomically: readers never see partially written files"""
+        out = self.path_for(input_path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".{out.name}.tmp")
+        if self.fmt == "csv":
+            peaks.to_csv(tmp, index=False)
+        else:
+            peaks.to_parquet(tmp, index=False)
+        tmp.replace(out)
+        return out
+
+
+@dataclass
+class FileResult:
+    """Outcome of processing one input file. status is 'done', 'reused', 'skipped' or 'failed'. qc_flags lists the QC metrics of outlier runs
+
+    'reused' runs were not processed again because their input and pipeline are unchanged (see Incremental); their
+    results are taken from the run record.
+    """
+
+    input_path: pathlib.Path
+    status: str
+    n_peaks: int = 0
+    seconds: float = 0.0
+    error: str | None = None
+    qc: dict[str, float] = field(default_factory=dict)
+    qc_flags: list[str] = field(default_factory=list)
+    partition: str = ""
+    profile: Profiling.FileProfile | None = None
+
+
+@dataclass
+class BatchSummary:
+    results: list[FileResult] = field(default_factory=list)
+
+    def count(self, status: str) -> int:
+        return sum(r.status == status for r in self.results)
+
+    def flagged(self) -> list[FileResult]:
+        return [r for r in self.results if r.qc_flags]
+
+    def profiles(self) -> list[Profiling.FileProfile]:
+        return [r.profile for r in self.results if r.profile is not None]
+
+    def qc_table(self) -> pd.DataFrame:
+        """One row per processed or reused file with its QC metrics and the flagged metrics separated by ';'"""
+        rows = [
+            {
+                "input_path": str(r.input_path),
+                "partition": r.partition,
+                "status": r.status,
+                **{m: r.qc.get(m) for m in QC.QC_METRICS},
+                "qc_flags": ";".join(r.qc_flags),
+            }
+            for r in self.results
+            if r.status != "skipped"
+        ]
+        return pd.DataFrame(
+            rows,
+            columns=["input_path", "partition", "status", *QC.QC_METRICS, "qc_flags"],
+        )
+
+
+def run_file(
+    file_path: pathlib.Path,
+    config: PipelineConfig,
+    store: ResultStore,
+    reference: QC.BatchReference | None = None,
+    pipeline_key: str | None = None,
+    partition: str = "",
+    profile: str = "none",
+) -> FileResult:
+    """Processes one file and writes its peak table. Errors are logged and reported, not raised
+
+    If pipeline_key is given (see Incremental.pipeline_key), a run record is written next to the peak table.
+    With a profile mode other than 'none' (see Profiling.PROFILE_MODES), the result holds the profile of the file.
+    """
+    start = time.perf_counter()
+    profiler = Profiling.build_profiler(profile)
+    try:
+        # fingerprint before reading: if the file changes while it is processed, the next batch processes it again
+        fp = None if pipeline_key is None else Incremental.fingerprint(file_path)
+        p = process_file(file_path, config, reference, profiler)
+        if p.df.peaks is None:
+            raise ValueError("no peak table was created")
+        with Profiling.stage(profiler, "write"):
+            store.write(file_path, p.df.peaks)
+            if store.mzml is not None:
+                store.write_mzml(file_path, p.df)
+        if fp is not None:
+            store.write_record(
+                file_path,
+                Incremental.RunRecord(
+                    str(file_path),
+                    fp,
+                    pipeline_key,
+                    partition,
+                    len(p.df.peaks),
+                    p.df.qc,
+                    p.df.qc_flags,
+                ),
+            )
+    except Exception as e:
+        logging.error(f"Error processing '{file_path}': {e}")
+        seconds = time.perf_counter() - start
+        return FileResult(
+            file_path,
+            "failed",
+            seconds=seconds,
+            error=str(e),
+            partition=partition,
+            profile=_profile(profiler, file_path, seconds),
+        )
+    seconds = time.perf_counter() - start
+    return FileResult(
+        file_path,
+        "done",
+        len(p.df.peaks),
+        seconds,
+        qc=p.df.qc,
+        qc_flags=p.df.qc_flags,
+        partition=partition,
+        profile=_profile(profiler, file_path, seconds),
+    )
+
+
+def _profile(
+    profiler: Profiling.StageProfiler | None, file_path: pathlib.Path, seconds: float
+) -> Profiling.FileProfile | None:
+    return None if profiler is None else profiler.result(str(file_path), seconds)
+
+
+def partitions(inputs: list[pathlib.Path]) -> dict[pathlib.Path, str]:
+    """Partition of every input: its directory relative to the deepest directory that contains all inputs, e.g. the
+    directory of one night or plate. Inputs directly in that directory are in partition '.'
+    """
+    if not inputs:
+        return {}
+    dirs = [os.path.abspath(f.parent) for f in inputs]
+    root = os.path.commonpath(dirs)
+    return {
+        f: pathlib.Path(os.path.relpath(d, root)).as_posix()
+        for f, d in zip(inputs, dirs)
+    }
+
+
+def _reuse(
+    store: ResultStore, input_path: pathlib.Path, pipeline_key: str
+) -> Incremental.RunRecord | None:
+    """Run record of input_path if its peak table can be reused"""
+    record = store.read_record(input_path)
+    if record is None or not store.exists(input_path):
+        return None
+    checked = record.check(input_path, pipeline_key)
+    if checked is not None and checked is not record:
+        # same content, new modification time: save it so the content is not hashed again
+        store.write_record(input_path, checked)
+    return checked
+
+
+def run_batch(
+    inputs: list[pathlib.Path],
+    config: PipelineConfig,
+    store: ResultStore,
+    jobs: int = 1,
+    resume: bool = False,
+    incremental: bool = False,
+    profile: str = "none",
+) -> BatchSummary:
+    """Processes all inputs, in a process pool if jobs > 1.
+
+    Every run is checked against a rolling QC reference of the previous accepted runs (see QC.BatchReference) before
+    its library search. Workers get at most 2 * jobs files ahead, so they check against a recent reference. The QC
+    metrics of all runs are written to the store, for the whole batch and per partition (see partitions()). A partition
+    report is only rewritten if one of its runs was processed or its runs changed.
+
+    With incremental, runs whose input file and pipeline (configuration, referenced files, code) are unchanged since
+    their peak table was written are reused instead of processed (see Incremental). Their QC metrics are taken from
+    the run record and seed the QC reference.
+
+    With a profile mode other than 'none', every processed file is profiled per stage and the profiles of the batch
+    are written to the subdirectory 'profile' of the store (see Profiling.write_profiles).
+
+    Args:
+        inputs: Files to process
+        config: Pipeline parameters
+        store: Where peak tables are written
+        jobs: Number of worker processes
+        resume: Skip inputs whose peak table already exists in the store
+        incremental: Reuse the peak tables of unchanged inputs and write run records for processed inputs
+        profile: One of Profiling.PROFILE_MODES
+
+    Returns:
+        BatchSummary with one FileResult per input
+
+    Raises:
+        ValueError: If the profile mode is unknown, two inputs have the same output name in the store or the store
+            was written with another input root (see ResultStore.record_input_root).
+    """
+    if profile not in Profiling.PROFILE_MODES:
+        raise ValueError(
+            f"Unknown profile mode '{profile}', expected one of {Profiling.PROFILE_MODES}"
+        )
+    store.record_input_root()
+    names: dict[str, pathlib.Path] = {}
+    for f in inputs:
+        other = names.setdefault(store.run_name(f), f)
+        if other != f:
+            raise ValueError(
+                f"Inputs '{other}' and '{f}' would both be written to '{store.path_for(f)}'"
+            )
+    summary = BatchSummary()
+    partition = partitions(inputs)
+    key = None
+    if incremental:
+        key = Incremental.pipeline_key(config, (config.library, config.ri_ladder))
+    todo = []
+    for f in inputs:
+        if resume and store.exists(f):
+            summary.results.append(FileResult(f, "skipped", partition=partition[f]))
+        elif key is not None and (record := _reuse(store, f, key)) is not None:
+            summary.results.append(
+                FileResult(
+                    f,
+                    "reused",
+                    record.n_peaks,
+                    qc=record.qc,
+                    qc_flags=record.qc_flags,
+                    partition=partition[f],
+                )
+            )
+        else:
+            todo.append(f)
+
+    reference = QC.BatchReference(
+        config.qc_window,
+        config.qc_min_runs,
+        config.qc_z_limit,
+        rel_spread=config.qc_rel_spread,
+    )
+    for r in summary.results:
+        if r.status == "reused" and not r.qc_flags:
+            reference.update(r.qc)
+
+    def accept(result: FileResult) -> None:
+        summary.results.append(result)
+        if result.status != "done":
+            return
+        if result.qc_flags:
+            logging.warning(f"QC outlier {result.input_path}: {result.qc_flags}")
+        else:
+            reference.update(result.qc)
+
+    if jobs > 1 and len(todo) > 1:
+        with worker_pool(config, jobs) as pool:
+            queue = iter(todo)
+            running = set()
+            while True:
+                for f in queue:
+                    running.add(
+                        pool.submit(
+                            run_file,
+                            f,
+                            config,
+                            store,
+                            reference,
+                            key,
+                            partition[f],
+                            profile,
+                        )
+                    )
+                    if len(running) >= 2 * jobs:
+                        break
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    accept(future.result())
+    else:
+        for f in todo:
+            accept(run_file(f, config, store, reference, key, partition[f], profile))
+    if any(r.status != "skipped" for r in summary.results):
+        qc = summary.qc_table()
+        store.write_qc(qc)
+        _write_partition_reports(store, qc)
+    if summary.profiles():
+        Profiling.write_profiles(summary.profiles(), store.profile_dir)
+    return summary
+
+
+def _write_partition_reports(store: ResultStore, qc: pd.DataFrame) -> None:
+    """Rewrites the QC reports of the partitions with processed, failed, new or removed runs"""
+    for name, rows in qc.groupby("partition", sort=False):
+        processed = rows["status"].isin(["done", "failed"]).any()
+        if processed or store.partition_runs(name) != set(rows["input_path"]):
+            store.write_partition_qc(name, rows)
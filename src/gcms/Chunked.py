@@ -0,0 +1,278 @@
+"""Out-of-core processing of very long or densely sampled traces.
+
+The raw trace is spilled to memory-mapped files and processed in chunks in a process pool. Every chunk covers
+chunk_size data points (its core) plus an overlap on both sides and runs the trace-local steps of the pipeline
+(Batch.detect_and_integrate): filter, find peaks, find borders, deconvolve, integrate. Of each chunk only the peaks
+with their apex in the core are kept, and the filtered trace of the core is written to a memory-mapped result. The
+stitched peak table then gets the steps that need the whole run (Batch.finalize_peaks). Memory per worker is bounded
+by chunk_size + 2 * overlap data points; the whole trace only exists on disk.
+
+Results equal in-memory processing if the overlap covers every window a peak depends on: the Savitzky-Golay window,
+the border window of PeakFinder.find_peak_borders and the noise blocks, to whose size chunk borders are aligned (see
+required_overlap()). Clusters of overlapping peaks longer than the overlap are split. The pyopenms picker estimates
+its own signal to noise ratio over long retention time windows, so peaks close to its signal_to_noise threshold can
+differ (filter them with min_snr of the noise estimator); the CWT finder scales its decimation and noise window with
+the trace length, so with 'cwt' results are approximate.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import repeat
+import pathlib
+import tempfile
+import numpy as np
+import pandas as pd
+from . import Batch, DataReader, PeakFinder, Processor
+
+# Data points around an apex read by find_peak_borders (wlen=11) and adjust_neighbor
+BORDER_SPAN = 11 + 4
+_DTYPES = {"index": np.int64, "retention_time": np.float64, "intensity": np.float64}
+
+
+@dataclass(frozen=True)
+class TraceFile:
+    """Chromatogram spilled to one binary file per column, opened as memory maps
+
+    Fields:
+        directory: Directory of the column files '<column>.bin'
+        length: Number of data points
+    """
+
+    directory: str
+    length: int
+
+    def open(
+        self, column: str, mode: str = "r", dtype: type | None = None
+    ) -> np.memmap:
+        """Memory map of a column ('index', 'retention_time', 'intensity' or a result column with dtype given)"""
+        return np.memmap(
+            pathlib.Path(self.directory) / f"{column}.bin",
+            dtype=dtype or _DTYPES[column],
+            mode=mode,
+            shape=(self.length,),
+        )
+
+    def frame(self, start: int = 0, stop: int | None = None) -> pd.DataFrame:
+        """Data points start:stop loaded into memory, with columns 'index' (from 0), 'retention_time', 'intensity'"""
+        stop = self.length if stop is None else stop
+        return pd.DataFrame(
+            {
+                "index": np.arange(stop - start),
+                "retention_time": np.array(self.open("retention_time")[start:stop]),
+                "intensity": np.array(self.open("intensity")[start:stop]),
+            }
+        )
+
+    def mapped(self) -> pd.DataFrame:
+        """The whole trace backed by the memory maps, nothing is loaded"""
+        return pd.DataFrame({c: self.open(c) for c in _DTYPES}, copy=False)
+
+
+def spill(
+    file_path: str | pathlib.Path,
+    reader: DataReader.ChromDataReader,
+    directory: str | pathlib.Path,
+    rows: int = 1 << 20,
+) -> TraceFile:
+    """Writes the trace of an input file to directory.
+
+    CSV files are read in pieces of 'rows' lines; other formats are read whole by the reader once and released.
+
+    Raises:
+        ValueError: If the trace is empty or columns are missing.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if isinstance(reader, DataReader.CsvReader):
+        pieces = pd.read_csv(
+            file_path, usecols=["retention_time", "intensity"], chunksize=rows
+        )
+    else:
+        pieces = [reader.read_data(file_path)]
+    files = {c: open(directory / f"{c}.bin", "wb") for c in _DTYPES}
+    n = 0
+    try:
+        for piece in pieces:
+            files["index"].write(np.arange(n, n + len(piece), dtype=np.int64).data)
+            for c in ("retention_time", "intensity"):
+                files[c].write(piece[c].to_numpy(dtype=np.float64).data)
+            n += len(piece)
+    finally:
+        for f in files.values():
+            f.close()
+    if n == 0:
+        raise ValueError(f"Error spilling '{file_path}': the trace is empty")
+    return TraceFile(str(directory), n)
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """Data points start:stop of a trace, of which the peaks with apex in core_start:core_stop are kept"""
+
+    start: int
+    stop: int
+    core_start: int
+    core_stop: int
+
+
+def plan_chunks(
+    length: int, chunk_size: int, overlap: int, align: int = 1
+) -> list[Chunk]:
+    """Chunks whose cores tile the trace, each extended by overlap on both sides.
+
+    chunk_size and overlap are rounded up to multiples of align, so every chunk starts at a multiple of align.
+    """
+    size = -(-chunk_size // align) * align
+    overlap = -(-overlap // align) * align
+    return [
+        Chunk(
+            max(0, core_start - overlap),
+            min(length, core_start + size + overlap),
+            core_start,
+            min(length, core_start + size),
+        )
+        for core_start in range(0, length, size)
+    ]
+
+
+def required_overlap(config: Batch.PipelineConfig) -> tuple[int, int]:
+    """Smallest overlap for results equal to in-memory processing, and the alignment of chunk borders
+
+    Returns:
+        overlap: Twice the filter window and border span, and with a noise estimator at least one noise block and
+            one data point (the point-to-point differences of the block next to the core must be complete; noise is
+            estimated on the unfiltered trace)
+        align: Size of the noise blocks (see Noise.RollingMadNoise), 1 without noise estimator
+    """
+    overlap = 2 * (config.savgol_window + BORDER_SPAN + PeakFinder.APEX_RADIUS)
+    if config.noise == "none":
+        return overlap, 1
+    return max(overlap, config.noise_window + 1), config.noise_window
+
+
+def _process_chunk(
+    trace: TraceFile, chunk: Chunk, config: Batch.PipelineConfig
+) -> pd.DataFrame:
+    """Runs the trace-local steps on one chunk, writes the core of the filtered trace and returns the peaks of the core
+    with positions in the whole trace. 'cluster' becomes the first apex of the cluster and 'skim_parent' the apex of the
+    parent, both are converted back by stitch()
+    """
+    p = Batch.build_processor(replace(config, ri_ladder=None))
+    p.df.init_chromatogram(trace.frame(chunk.start, chunk.stop))
+    if config.precision == "compact":
+        p.df.compact(config.rt_offset)
+    Batch.detect_and_integrate(p, config)
+
+    core = slice(chunk.core_start - chunk.start, chunk.core_stop - chunk.start)
+    out = trace.open("processed", "r+", _processed_dtype(config))
+    processed = p.df.chromatogram["intensity"].to_numpy()
+    out[chunk.core_start : chunk.core_stop] = processed[core]
+    out.flush()
+    del out
+
+    peaks = p.df.peaks
+    apex = peaks["index"].to_numpy(dtype=np.int64)
+    keep = (apex >= core.start) & (apex < core.stop)
+    if "cluster" in peaks.columns:
+        peaks["cluster"] = peaks.groupby("cluster")["index"].transform("min")
+        peaks["cluster"] += chunk.start
+    if "skim_parent" in peaks.columns:
+        parent = peaks["skim_parent"].to_numpy()
+        peaks["skim_parent"] = np.where(parent >= 0, apex[parent] + chunk.start, -1)
+    peaks = peaks[keep].reset_index(drop=True)
+    for c in ("index", "left_border", "right_border"):
+        peaks[c] += chunk.start
+    peaks["chunk_start"] = chunk.start
+    peaks["chunk_stop"] = chunk.stop
+    return peaks
+
+
+def _processed_dtype(config: Batch.PipelineConfig) -> type:
+    return np.float32 if config.precision == "compact" else np.float64
+
+
+def stitch(tables: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates the peaks of all chunks (see _process_chunk) into one peak table.
+
+    A peak next to a core border can be kept by both chunks with apexes up to PeakFinder.APEX_RADIUS apart; of such
+    pairs the peak farther from the end of its chunk is kept. 'cluster' and 'skim_parent' become row labels again.
+    """
+    peaks = pd.concat(tables, ignore_index=True).sort_values(
+        "index", kind="stable", ignore_index=True
+    )
+    apex = peaks["index"].to_numpy()
+    start = peaks.pop("chunk_start").to_numpy()
+    stop = peaks.pop("chunk_stop").to_numpy()
+    margin = np.minimum(apex - start, stop - 1 - apex)
+    pair = np.flatnonzero(
+        (np.diff(apex) <= PeakFinder.APEX_RADIUS) & (np.diff(start) != 0)
+    )
+    drop = np.where(margin[pair] < margin[pair + 1], pair, pair + 1)
+    peaks = peaks.drop(index=np.unique(drop)).reset_index(drop=True)
+
+    if "cluster" in peaks.columns:
+        peaks["cluster"] = pd.factorize(peaks["cluster"], sort=True)[0]
+    if "skim_parent" in peaks.columns:
+        apex = peaks["index"].to_numpy()
+        parent = peaks["skim_parent"].to_numpy()
+        row = np.searchsorted(apex, parent)
+        found = (parent >= 0) & (row < len(apex))
+        found[found] = apex[row[found]] == parent[found]
+        peaks["skim_parent"] = np.where(found, row, -1).astype(np.intp)
+    return peaks
+
+
+def process_file(
+    file_path: str | pathlib.Path, config: Batch.PipelineConfig
+) -> Processor.ChromatogramProcessor:
+    """Runs the pipeline of config on one file out of core (see module docstring) with config.chunk_jobs workers.
+
+    The spilled files are kept in a temporary directory in config.chunk_dir (system default if None) only while
+    processing: the returned processor's chromatogram_og and chromatogram stay memory-mapped, which POSIX systems
+    keep valid after the files are removed.
+
+    Raises:
+        ValueError: If no reader is available or config.chunk_overlap is smaller than required_overlap().
+    """
+    reader = Batch.find_reader(file_path)
+    if reader is None:
+        raise ValueError(f"No reader available for file '{file_path}'")
+    overlap, align = required_overlap(config)
+    if config.chunk_overlap is not None:
+        if config.chunk_overlap < overlap:
+            raise ValueError(
+                f"chunk_overlap must be at least {overlap} for this configuration, got {config.chunk_overlap}"
+            )
+        overlap = config.chunk_overlap
+    chunk_size = config.chunk_size or 1
+
+    with tempfile.TemporaryDirectory(
+        prefix="gcms_chunks_", dir=config.chunk_dir, ignore_cleanup_errors=True
+    ) as work_dir:
+        trace = spill(file_path, reader, work_dir)
+        chunks = plan_chunks(trace.length, chunk_size, overlap, align)
+        trace.open("processed", "w+", _processed_dtype(config)).flush()
+        if config.chunk_jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(config.chunk_jobs) as pool:
+                tables = list(
+                    pool.map(_process_chunk, repeat(trace), chunks, repeat(config))
+                )
+        else:
+            tables = [_process_chunk(trace, c, config) for c in chunks]
+
+        p = Batch.build_processor(config)
+        p.df.init_chromatogram(trace.mapped())
+        p.df.precision = config.precision
+        p.df.derive(
+            "chunked",
+            {
+                "chunk_size": chunk_size,
+                "overlap": overlap,
+                "steps": ["savgol", "adjust_neighbor"],
+            },
+            intensity=trace.open("processed", "r", _processed_dtype(config)),
+        )
+        p.df.count_filter_iterations = 1
+        p.df.peaks = stitch(tables)
+    Batch.finalize_peaks(p, config)
+    return p
@@ -0,0 +1,413 @@
+"""Paired comparison of a sample chromatogram with a blank or reference run.
+
+Both raw traces are interpolated onto a common retention time grid, optionally after shifting the reference onto the
+sample, which gives difference, ratio and rolling correlation traces. The peak tables of both runs, as found by the
+pipeline of ChromatogramProcessor, are matched by retention time to report peaks unique to or enriched in one run.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import logging
+import pathlib
+import numpy as np
+import pandas as pd
+import scipy
+from . import Batch, Precision, Processor
+
+ALIGN_MODES = ("none", "shift")
+PEAK_STATUS = (
+    "unique_sample",
+    "unique_reference",
+    "enriched_sample",
+    "enriched_reference",
+    "common",
+)
+
+
+@dataclass
+class PairComparison:
+    """Result of compare()
+
+    Fields:
+        traces: Common grid with columns 'retention_time', 'sample', 'reference', 'difference' (sample - reference),
+            'ratio' (sample / reference, NaN below the ratio floor) and 'correlation' (rolling Pearson correlation)
+        peaks: Matched peak table, see match_peaks()
+        shift: Retention time shift of the reference against the sample that was removed before comparing
+        correlation: Pearson correlation of the whole traces on the grid
+    """
+
+    traces: pd.DataFrame
+    peaks: pd.DataFrame
+    shift: float
+    correlation: float
+
+    def counts(self) -> dict[str, int]:
+        """Number of peaks per status in PEAK_STATUS"""
+        counts = self.peaks["status"].value_counts()
+        return {s: int(counts.get(s, 0)) for s in PEAK_STATUS}
+
+
+def common_grid(
+    rt_a: np.ndarray, rt_b: np.ndarray, step: float | None = None
+) -> np.ndarray:
+    """Equidistant retention times over the overlap of two runs
+
+    Args:
+        rt_a, rt_b: Ascending retention times of the runs
+        step: Grid spacing, by default the larger median sampling interval of the two runs
+
+    Raises:
+        ValueError: If the runs do not overlap.
+    """
+    start, stop = max(rt_a[0], rt_b[0]), min(rt_a[-1], rt_b[-1])
+    if stop <= start:
+        raise ValueError(
+            f"Error comparing runs: retention times {rt_a[0]}-{rt_a[-1]} and {rt_b[0]}-{rt_b[-1]} do not overlap"
+        )
+    if step is None:
+        step = max(np.median(np.diff(rt_a)), np.median(np.diff(rt_b)))
+    return start + step * np.arange(int(np.floor((stop - start) / step)) + 1)
+
+
+def estimate_shift(
+    grid: np.ndarray, sample: np.ndarray, reference: np.ndarray, max_shift: float
+) -> float:
+    """Retention time shift of reference against sample that maximizes their cross-correlation (FFT), within
+    +-max_shift and refined between grid points by a parabola. Positive if the reference elutes later
+    """
+    step = grid[1] - grid[0]
+    a = sample - sample.mean()
+    b = reference - reference.mean()
+    xc = scipy.signal.correlate(b, a, mode="full", method="fft")
+    lags = scipy.signal.correlation_lags(len(b), len(a), mode="full")
+    keep = np.abs(lags) <= int(max_shift / step)
+    xc, lags = xc[keep], lags[keep]
+    i = int(np.argmax(xc))
+    offset = 0.0
+    if 0 < i < len(xc) - 1:
+        curvature = xc[i - 1] - 2 * xc[i] + xc[i + 1]
+        if curvature < 0:
+            offset = 0.5 * (xc[i - 1] - xc[i + 1]) / curvature
+    return float((lags[i] + offset) * step)
+
+
+def rolling_correlation(a: np.ndarray, b: np.ndarray, window: int) -> np.ndarray:
+    """Pearson correlation of a and b in a centered window around every point, NaN where a window is flat.
+
+    Window sums come from cumulative sums, so the cost does not depend on the window length.
+    """
+    n = len(a)
+    a = a - a.mean()
+    b = b - b.mean()
+    center = np.arange(n)
+    lo = np.clip(center - window // 2, 0, n)
+    hi = np.clip(center + window // 2 + 1, 0, n)
+    m = hi - lo
+
+    def window_sum(x: np.ndarray) -> np.ndarray:
+        c = np.concatenate(([0.0], np.cumsum(x)))
+        return c[hi] - c[lo]
+
+    sa, sb = window_sum(a), window_sum(b)
+    cov = window_sum(a * b) - sa * sb / m
+    var_a = window_sum(a * a) - sa * sa / m
+    var_b = window_sum(b * b) - sb * sb / m
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = cov / np.sqrt(var_a * var_b)
+    r[(var_a <= 0) | (var_b <= 0)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def _nearest(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Position in y of the nearest value to every x and its distance. y must not be empty"""
+    order = np.argsort(y, kind="stable")
+    ys = y[order]
+    i = np.clip(np.searchsorted(ys, x), 1, len(ys) - 1) if len(ys) > 1 else None
+    if i is None:
+        return np.zeros(len(x), dtype=np.intp), np.abs(x - ys[0])
+    before = np.abs(x - ys[i - 1]) <= np.abs(ys[i] - x)
+    j = np.where(before, i - 1, i)
+    return order[j], np.abs(x - ys[j])
+
+
+def match_peaks(
+    sample_peaks: pd.DataFrame,
+    reference_peaks: pd.DataFrame,
+    shift: float = 0.0,
+    rt_tolerance: float = 2.0,
+    min_ratio: float = 2.0,
+    value: str = "area",
+) -> pd.DataFrame:
+    """Pairs the peaks of sample and reference and classifies them.
+
+    Two peaks are paired if each is the nearest peak of the other run and they are at most rt_tolerance apart, after
+    removing shift from the reference retention times.
+
+    Args:
+        sample_peaks, reference_peaks: Peak tables with columns 'index', 'retention_time' and value
+        shift: Retention time shift of the reference, see estimate_shift()
+        rt_tolerance: Maximum distance of paired peaks
+        min_ratio: Paired peaks whose value ratio is at least min_ratio (or at most 1 / min_ratio) are enriched
+        value: Peak column to compare, e.g. 'area' or 'area_norm'
+
+    Returns:
+        One row per pair or unpaired peak, ordered by retention time, with columns 'retention_time' (of the sample
+        peak, else of the shifted reference peak), 'sample_index', 'reference_index' (peak positions in the runs,
+        -1 if unpaired), 'sample_value', 'reference_value', 'log2_ratio' and 'status' (one of PEAK_STATUS)
+
+    Raises:
+        ValueError: If columns are missing.
+    """
+    for peaks in (sample_peaks, reference_peaks):
+        missing = {"index", "retention_time", value} - set(peaks.columns)
+        if missing:
+            raise ValueError(f"Error matching peaks: no columns {missing}")
+    rt_s = sample_peaks["retention_time"].to_numpy(dtype=np.float64)
+    rt_r = reference_peaks["retention_time"].to_numpy(dtype=np.float64) - shift
+    paired_s = np.zeros(len(rt_s), dtype=bool)
+    paired_r = np.zeros(len(rt_r), dtype=bool)
+    s = r = np.empty(0, dtype=np.intp)
+    if len(rt_s) and len(rt_r):
+        nearest_r, distance = _nearest(rt_s, rt_r)
+        nearest_s, _ = _nearest(rt_r, rt_s)
+        mutual = (nearest_s[nearest_r] == np.arange(len(rt_s))) & (
+            distance <= rt_tolerance
+        )
+        s = np.flatnonzero(mutual)
+        r = nearest_r[s]
+        paired_s[s] = True
+        paired_r[r] = True
+    only_s = np.flatnonzero(~paired_s)
+    only_r = np.flatnonzero(~paired_r)
+
+    value_s = sample_peaks[value].to_numpy(dtype=np.float64)
+    value_r = reference_peaks[value].to_numpy(dtype=np.float64)
+    index_s = sample_peaks["index"].to_numpy(dtype=np.int64)
+    index_r = reference_peaks["index"].to_numpy(dtype=np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log2_ratio = np.log2(value_s[s] / value_r[r])
+    limit = np.log2(min_ratio)
+    status = np.where(
+        log2_ratio >= limit,
+        "enriched_sample",
+        np.where(log2_ratio <= -limit, "enriched_reference", "common"),
+    )
+    none = np.full(len(only_s) + len(only_r), -1, dtype=np.int64)
+    table = pd.DataFrame(
+        {
+            "retention_time": np.concatenate((rt_s[s], rt_s[only_s], rt_r[only_r])),
+            "sample_index": np.concatenate(
+                (index_s[s], index_s[only_s], none[len(only_s) :])
+            ),
+            "reference_index": np.concatenate(
+                (index_r[r], none[: len(only_s)], index_r[only_r])
+            ),
+            "sample_value": np.concatenate(
+                (value_s[s], value_s[only_s], np.full(len(only_r), np.nan))
+            ),
+            "reference_value": np.concatenate(
+                (value_r[r], np.full(len(only_s), np.nan), value_r[only_r])
+            ),
+            "log2_ratio": np.concatenate(
+                (
+                    log2_ratio,
+                    np.full(len(only_s), np.inf),
+                    np.full(len(only_r), -np.inf),
+                )
+            ),
+            "status": np.concatenate(
+                (
+                    status,
+                    np.full(len(only_s), "unique_sample"),
+                    np.full(len(only_r), "unique_reference"),
+                )
+            ),
+        }
+    )
+    return table.sort_values("retention_time", kind="stable", ignore_index=True)
+
+
+def compare(
+    sample: Processor.ChromatogramDF,
+    reference: Processor.ChromatogramDF,
+    align: str = "none",
+    max_shift: float = 10.0,
+    step: float | None = None,
+    correlation_window: int = 51,
+    ratio_floor: float | None = None,
+    rt_tolerance: float = 2.0,
+    min_ratio: float = 2.0,
+    value: str = "area",
+) -> PairComparison:
+    """Compares a sample with a blank or reference run. Uses the raw traces and the existing peak tables, nothing is
+    picked again.
+
+    Args:
+        sample, reference: Processed runs (ChromatogramProcessor.df) with chromatogram_og and peaks
+        align: One of ALIGN_MODES: 'none' or 'shift' (shift the reference by the lag of the highest cross-correlation)
+        max_shift: Largest retention time shift considered by 'shift'
+        step: Spacing of the common grid, see common_grid()
+        correlation_window: Window of the rolling correlation in grid points
+        ratio_floor: The ratio trace is NaN where the reference is below this, by default 1% of its maximum
+        rt_tolerance, min_ratio, value: See match_peaks()
+
+    Raises:
+        ValueError: If a run has no chromatogram or peaks, the runs do not overlap or align is unknown.
+    """
+    if align not in ALIGN_MODES:
+        raise ValueError(f"Unknown alignment '{align}', expected one of {ALIGN_MODES}")
+    for name, run in (("sample", sample), ("reference", reference)):
+        if run.chromatogram_og is None or run.peaks is None:
+            raise ValueError(
+                f"Error comparing runs: the {name} run has no chromatogram or peaks"
+            )
+    rt_s = Precision.retention_time(sample.chromatogram_og)
+    rt_r = Precision.retention_time(reference.chromatogram_og)
+    y_s = sample.chromatogram_og["intensity"].to_numpy(dtype=np.float64)
+    y_r = reference.chromatogram_og["intensity"].to_numpy(dtype=np.float64)
+
+    grid = common_grid(rt_s, rt_r, step)
+    a = np.interp(grid, rt_s, y_s)
+    shift = 0.0
+    if align == "shift" and len(grid) > 1:
+        shift = estimate_shift(grid, a, np.interp(grid, rt_r, y_r), max_shift)
+    b = np.interp(grid, rt_r - shift, y_r)
+
+    floor = 0.01 * np.max(b) if ratio_floor is None else ratio_floor
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(b >= floor, a / b, np.nan)
+    traces = pd.DataFrame(
+        {
+            "retention_time": grid,
+            "sample": a,
+            "reference": b,
+            "difference": a - b,
+            "ratio": ratio,
+            "correlation": rolling_correlation(a, b, correlation_window),
+        }
+    )
+    peaks = match_peaks(
+        sample.peaks, reference.peaks, shift, rt_tolerance, min_ratio, value
+    )
+    correlation = float(np.corrcoef(a, b)[0, 1]) if len(grid) > 1 else np.nan
+    return PairComparison(traces, peaks, shift, correlation)
+
+
+def read_pairs(
+    file_path: str | pathlib.Path,
+) -> list[tuple[pathlib.Path, pathlib.Path]]:
+    """Reads a CSV with the columns 'sample' and 'reference'. Relative paths are relative to the CSV file
+
+    Raises:
+        ValueError: If the columns are missing.
+    """
+    path = pathlib.Path(file_path)
+    table = pd.read_csv(path)
+    if not {"sample", "reference"} <= set(table.columns):
+        raise ValueError(
+            f"Pair table '{path}' must have the columns 'sample' and 'reference'"
+        )
+    return [
+        (path.parent / s, path.parent / r)
+        for s, r in zip(table["sample"], table["reference"])
+    ]
+
+
+def _load_run(
+    file_path: pathlib.Path, config: Batch.PipelineConfig, store: Batch.ResultStore
+) -> Processor.ChromatogramDF:
+    """Raw trace of a run and its stored peak table"""
+    reader = Batch.find_reader(file_path)
+    if reader is None:
+        raise ValueError(f"No reader available for file '{file_path}'")
+    run = Processor.ChromatogramDF()
+    run.init_chromatogram(reader.read_data(file_path))
+    if config.precision == "compact":
+        run.compact(config.rt_offset)
+    run.peaks = store.read(file_path)
+    return run
+
+
+def _compare_pair(
+    sample: pathlib.Path,
+    reference: pathlib.Path,
+    config: Batch.PipelineConfig,
+    store: Batch.ResultStore,
+    write_traces: bool,
+    settings: dict,
+) -> dict:
+    row = {"sample": str(sample), "reference": str(reference)}
+    try:
+        result = compare(
+            _load_run(sample, config, store),
+            _load_run(reference, config, store),
+            **settings,
+        )
+        store.write_comparison(sample, reference, result.peaks)
+        if write_traces:
+            store.write_comparison(sample, reference, result.traces, "traces")
+    except Exception as e:
+        logging.error(f"Error comparing '{sample}' with '{reference}': {e}")
+        return {**row, "error": str(e)}
+    return {
+        **row,
+        "shift": result.shift,
+        "correlation": result.correlation,
+        **result.counts(),
+        "error": None,
+    }
+
+
+def compare_pairs(
+    pairs: list[tuple[pathlib.Path, pathlib.Path]],
+    config: Batch.PipelineConfig,
+    store: Batch.ResultStore,
+    jobs: int = 1,
+    write_traces: bool = False,
+    **settings,
+) -> pd.DataFrame:
+    """Compares many sample/reference pairs, in a process pool if jobs > 1.
+
+    First every file is processed once with Batch.run_batch (incremental: files with a current peak table in the store
+    are not processed again, so a blank shared by many pairs is picked once). Then the pairs are compared from the raw
+    traces and the stored peak tables, and each matched peak table (and with write_traces the traces) is written to
+    the store.
+
+    Args:
+        pairs: (sample, reference) file paths
+        config: Pipeline parameters
+        store: Where peak tables and comparisons are written
+        jobs: Number of worker processes
+        write_traces: Also write the traces on the common grid
+        settings: Keyword arguments of compare()
+
+    Returns:
+        One row per pair with 'sample', 'reference', 'shift', 'correlation', the number of peaks per status and
+        'error' (None if the comparison succeeded)
+    """
+    files = list(dict.fromkeys(f for pair in pairs for f in pair))
+    summary = Batch.run_batch(files, config, store, jobs, incremental=True)
+    failed = {r.input_path: r.error for r in summary.results if r.status == "failed"}
+
+    rows: list[dict | None] = []
+    todo = []
+    for sample, reference in pairs:
+        error = failed.get(sample) or failed.get(reference)
+        if error is not None:
+            rows.append(
+                {"sample": str(sample), "reference": str(reference), "error": error}
+            )
+        else:
+            todo.append((len(rows), sample, reference))
+            rows.append(None)
+    args = (config, store, write_traces, settings)
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = [(i, pool.submit(_compare_pair, s, r, *args)) for i, s, r in todo]
+            for i, f in futures:
+                rows[i] = f.result()
+    else:
+        for i, s, r in todo:
+            rows[i] = _compare_pair(s, r, *args)
+    columns = ["sample", "reference", "shift", "correlation", *PEAK_STATUS, "error"]
+    return pd.DataFrame(rows, columns=columns)
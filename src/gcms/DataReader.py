@@ -1,7 +1,6 @@
 from abc import ABC, abstractmethod
 import pandas as pd
 import pathlib
-from .pyopenms_client import PyOpenMsClient as omsc
 
 
 class ChromDataReader(ABC):
@@ -53,6 +52,8 @@ class PyomenmsReader(ChromDataReader):
         return path.suffix.lower() in self.supported_extensions
 
     def read_data(self, file_path: str | pathlib.Path) -> pd.DataFrame:
+        from .pyopenms_client import PyOpenMsClient as omsc
+
         if not self.is_compatible(file_path):
             raise ValueError(
                 f"file '{file_path} is not compatible with reader '{self.__class__}'"
@@ -63,3 +64,30 @@ class PyomenmsReader(ChromDataReader):
     @property
     def supported_extensions(self) -> list[str]:
         return [".mzml"]
+
+
+class CsvReader(ChromDataReader):
+    """Reads data from a CSV file with the columns 'retention_time' and 'intensity' (e.g. exported by instrument software)."""
+
+    def is_compatible(self, file_path: str | pathlib.Path) -> bool:
+        path = pathlib.Path(file_path)
+        return path.suffix.lower() in self.supported_extensions
+
+    def read_data(self, file_path: str | pathlib.Path) -> pd.DataFrame:
+        if not self.is_compatible(file_path):
+            raise ValueError(
+                f"file '{file_path} is not compatible with reader '{self.__class__}'"
+            )
+        df = pd.read_csv(file_path)
+        missing = {"retention_time", "intensity"} - set(df.columns)
+        if missing:
+            raise ValueError(
+                f"file '{file_path}' is missing the columns {sorted(missing)}"
+            )
+        df = df[["retention_time", "intensity"]].astype(float)
+        df.insert(0, "index", range(len(df)))
+        return df
+
+    @property
+    def supported_extensions(self) -> list[str]:
+        return [".csv"]
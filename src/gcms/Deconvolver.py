@@ -0,0 +1,162 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+from . import PeakFinder
+
+
+class ChromDeconvolver(ABC):
+    """Interface for stages that split clusters of co-eluting peaks into non-overlapping integration windows"""
+
+    @abstractmethod
+    def deconvolve(self, chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+        """Assigns non-overlapping borders to peaks whose borders intersect.
+
+        Args:
+            chrom: Chromatogram with column 'intensity'
+            peaks: Peaks with columns 'index', 'intensity', 'left_border', 'right_border'
+
+        Returns:
+            The modified 'peaks' DataFrame with adjusted borders and the column 'cluster'.
+
+        Raises:
+            ValueError: If columns are missing.
+        """
+        pass
+
+
+class ValleyDropDeconvolver(ChromDeconvolver):
+    """Splits clusters with a perpendicular drop at the valley (intensity minimum) between neighboring apexes.
+
+    Neighboring windows share only the valley point, so no area is counted twice by the integrator.
+    """
+
+    def deconvolve(self, chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+        _check_columns(chrom, peaks)
+        split = _ClusterSplit(chrom["intensity"].to_numpy(), peaks)
+        peaks["left_border"] = split.left
+        peaks["right_border"] = split.right
+        peaks["cluster"] = split.labels
+        return peaks
+
+
+class TangentSkimDeconvolver(ChromDeconvolver):
+    """Like ValleyDropDeconvolver, but small peaks on the flank of a large neighbor are skimmed off with a tangent.
+
+    A peak is a rider if its intensity is below 'skim_ratio' times the intensity of its neighbor in the same cluster.
+    The rider is integrated above the tangent from the valley to its outer flank (columns 'baseline_left', 'baseline_right').
+    The parent window is extended over the rider and the rider area is subtracted from the parent by the integrator (column 'skim_parent').
+    Riders of riders are split with a perpendicular drop.
+
+    Fields:
+        skim_ratio: Maximum intensity ratio rider/parent
+    """
+
+    def __init__(self, skim_ratio: float = 0.1) -> None:
+        self.skim_ratio = skim_ratio
+
+    def deconvolve(self, chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+        _check_columns(chrom, peaks)
+        intensity = chrom["intensity"].to_numpy()
+        split = _ClusterSplit(intensity, peaks)
+        height = peaks["intensity"].to_numpy()
+        left, right = split.left, split.right
+
+        baseline_left = np.full(len(peaks), np.nan)
+        baseline_right = np.full(len(peaks), np.nan)
+        skim_parent = np.full(len(peaks), -1, dtype=np.intp)
+        is_rider = np.zeros(len(peaks), dtype=bool)
+
+        for a, b, valley in zip(
+            split.first_of_pair, split.second_of_pair, split.valleys
+        ):
+            if height[b] < self.skim_ratio * height[a] and not is_rider[a]:
+                parent, rider = a, b
+                right[parent] = right[rider]
+                right[rider] = _tangent_point(intensity, valley, right[rider])
+                baseline_left[rider] = intensity[valley]
+                baseline_right[rider] = intensity[right[rider]]
+            elif height[a] < self.skim_ratio * height[b] and not is_rider[a]:
+                parent, rider = b, a
+                left[parent] = left[rider]
+                left[rider] = _tangent_point(intensity, valley, left[rider])
+                baseline_left[rider] = intensity[left[rider]]
+                baseline_right[rider] = intensity[valley]
+            else:
+                continue
+            is_rider[rider] = True
+            skim_parent[rider] = parent
+
+        peaks["left_border"] = left
+        peaks["right_border"] = right
+        peaks["cluster"] = split.labels
+        peaks["baseline_left"] = baseline_left
+        peaks["baseline_right"] = baseline_right
+        peaks["skim_parent"] = skim_parent
+        return peaks
+
+
+class _ClusterSplit:
+    """Perpendicular drop borders for all clusters, computed in one sweep over the peaks sorted by apex.
+
+    Fields:
+        labels: Cluster label per peak (row position)
+        left, right: New borders per peak
+        first_of_pair, second_of_pair: Row positions of neighboring peaks within a cluster, in retention time order
+        valleys: Index of the intensity minimum between each pair of neighbors
+    """
+
+    def __init__(self, intensity: np.ndarray, peaks: pd.DataFrame) -> None:
+        apex = peaks["index"].to_numpy(dtype=np.intp)
+        self.left = peaks["left_border"].to_numpy(dtype=np.intp).copy()
+        self.right = peaks["right_border"].to_numpy(dtype=np.intp).copy()
+        self.labels = PeakFinder.find_peak_clusters(peaks)
+        if len(peaks) == 0:
+            self.first_of_pair = self.second_of_pair = self.valleys = np.array(
+                [], dtype=np.intp
+            )
+            return
+
+        order = np.lexsort((apex, self.labels))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = self.labels[order][1:] != self.labels[order][:-1]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = first[1:]
+        starts = np.flatnonzero(first)
+        cluster_left = np.minimum.reduceat(self.left[order], starts)
+        cluster_right = np.maximum.reduceat(self.right[order], starts)
+
+        pairs = np.flatnonzero(~last)
+        self.first_of_pair = order[pairs]
+        self.second_of_pair = order[pairs + 1]
+        self.valleys = np.empty(len(pairs), dtype=np.intp)
+        for k, (a, b) in enumerate(
+            zip(apex[self.first_of_pair], apex[self.second_of_pair])
+        ):
+            self.valleys[k] = a + int(np.argmin(intensity[a : b + 1]))
+
+        self.right[self.first_of_pair] = self.valleys
+        self.left[self.second_of_pair] = self.valleys
+        self.left[order[first]] = cluster_left
+        self.right[order[last]] = cluster_right
+
+
+def _tangent_point(intensity: np.ndarray, valley: int, border: int) -> int:
+    """Index between valley and border where the line from the valley touches the flank, i.e. the point with the smallest slope seen from the valley"""
+    if border == valley:
+        return valley
+    step = 1 if border > valley else -1
+    k = np.arange(valley + step, border + step, step)
+    slope = (intensity[k] - intensity[valley]) / np.abs(k - valley)
+    return int(k[np.argmin(slope)])
+
+
+def _check_columns(chrom: pd.DataFrame, peaks: pd.DataFrame) -> None:
+    if "intensity" not in chrom.columns:
+        raise ValueError(
+            "Error deconvolving peaks: chromatogram does not contain intensity column"
+        )
+    to_check = ["index", "intensity", "left_border", "right_border"]
+    if not all(value in peaks.columns for value in to_check):
+        raise ValueError(
+            f"Error deconvolving peaks: peaks must contain columns {to_check}"
+        )
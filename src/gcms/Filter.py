@@ -0,0 +1,85 @@
+from abc import ABC, abstractmethod
+from typing import Any
+import numpy as np
+import pandas as pd
+import scipy
+
+SAVGOL_MODES = ("interp", "mirror", "nearest", "constant", "wrap")
+
+
+class ChromFilter(ABC):
+    """Interface for filters of chromatogram intensities"""
+
+    name: str = "filter"
+
+    @abstractmethod
+    def apply(self, chrom: pd.DataFrame) -> np.ndarray:
+        """Filters the intensities of a chromatogram.
+
+        Args:
+            chrom: DataFrame with column 'intensity'
+
+        Returns:
+            Filtered intensities, one per row of chrom. chrom is not changed
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def params(self) -> dict[str, Any]:
+        """Parameters of the filter, recorded in ChromatogramDF.lineage"""
+        pass
+
+
+class SavgolFilter(ChromFilter):
+    """Savitzky-Golay filter: a local polynomial fit of every window.
+
+    With deriv > 0 the derivative of the fitted polynomial is returned instead (per data point, not per retention
+    time), e.g. deriv=2, whose local minima reveal shoulders of co-eluting peaks.
+
+    Fields:
+        window_length: Number of data points per window, larger than polyorder (odd values keep peaks centered)
+        polyorder: Order of the fitted polynomial
+        deriv: Order of the derivative, 0 for smoothing
+        mode: Handling of the trace ends, one of SAVGOL_MODES
+    """
+
+    name = "savgol"
+
+    def __init__(
+        self,
+        window_length: int = 5,
+        polyorder: int = 2,
+        deriv: int = 0,
+        mode: str = "interp",
+    ) -> None:
+        if mode not in SAVGOL_MODES:
+            raise ValueError(
+                f"Unknown savgol mode '{mode}', expected one of {SAVGOL_MODES}"
+            )
+        if polyorder >= window_length:
+            raise ValueError(
+                f"Error creating savgol filter: window_length must be larger than polyorder, got window_length={window_length}, polyorder={polyorder}"
+            )
+        self.window_length = window_length
+        self.polyorder = polyorder
+        self.deriv = deriv
+        self.mode = mode
+
+    def apply(self, chrom: pd.DataFrame) -> np.ndarray:
+        return scipy.signal.savgol_filter(
+            chrom["intensity"].to_numpy(dtype=np.float64),
+            self.window_length,
+            self.polyorder,
+            deriv=self.deriv,
+            mode=self.mode,
+        )
+
+    @property
+    def params(self) -> dict[str, Any]:
+        return {
+            "window_length": self.window_length,
+            "polyorder": self.polyorder,
+            "deriv": self.deriv,
+            "mode": self.mode,
+        }
@@ -0,0 +1,156 @@
+"""Run-level result reuse for incremental batches.
+
+Next to every peak table a RunRecord ('<table>.meta.json') keeps the fingerprint of the input file and the key of the
+pipeline that produced the table: a hash of the configuration, of the files the configuration refers to (library,
+alkane ladder), of the gcms source code and of the versions of the numeric dependencies. A later batch reuses the
+table instead of processing the file again if both are unchanged.
+
+Input files are compared by size and modification time first. Only if the modification time changed is the content
+hashed, so unchanged files are not read at all.
+"""
+
+from dataclasses import asdict, dataclass, field, replace
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import pathlib
+
+# Packages whose version changes the results of the pipeline
+DEPENDENCIES = ("numpy", "scipy", "pandas", "pyopenms", "lmfit")
+_CHUNK_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """Identity of the content of an input file
+
+    Fields:
+        size: Size in bytes
+        mtime_ns: Modification time in ns
+        digest: blake2b hash of the content
+    """
+
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+def fingerprint(file_path: str | pathlib.Path) -> Fingerprint:
+    """Fingerprint of a file, reads the whole file"""
+    st = os.stat(file_path)
+    return Fingerprint(st.st_size, st.st_mtime_ns, _digest(file_path))
+
+
+def _digest(file_path: str | pathlib.Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_code_version: str | None = None
+
+
+def code_version() -> str:
+    """Hash of the gcms source files and the versions of DEPENDENCIES, computed once per process"""
+    global _code_version
+    if _code_version is None:
+        h = hashlib.blake2b(digest_size=16)
+        package = pathlib.Path(__file__).parent
+        for source in sorted(package.rglob("*.py")):
+            h.update(source.relative_to(package).as_posix().encode())
+            h.update(source.read_bytes())
+        for name in DEPENDENCIES:
+            try:
+                version = importlib.metadata.version(name)
+            except importlib.metadata.PackageNotFoundError:
+                version = ""
+            h.update(f"{name}={version}".encode())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def pipeline_key(config, files: tuple[str | None, ...] = ()) -> str:
+    """Hash of a pipeline configuration (a dataclass), the content of the files it refers to and the code version
+
+    Args:
+        config: Pipeline parameters, e.g. Batch.PipelineConfig
+        files: Paths in config whose content changes the results; None and missing files are skipped
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(asdict(config), sort_keys=True, default=str).encode())
+    for path in files:
+        if path is not None and os.path.isfile(path):
+            h.update(_digest(path).encode())
+    h.update(code_version().encode())
+    return h.hexdigest()
+
+
+@dataclass
+class RunRecord:
+    """Sidecar of a peak table: where it came from and the per-run results that later batch stages need
+
+    Fields:
+        input_path: Input file
+        fingerprint: Fingerprint of the input file before it was processed
+        pipeline_key: See pipeline_key()
+        partition: Partition of the batch the run belongs to
+        n_peaks: Number of peaks
+        qc: QC metrics of the run (see QC.run_metrics)
+        qc_flags: QC metrics for which the run was an outlier
+    """
+
+    input_path: str
+    fingerprint: Fingerprint
+    pipeline_key: str
+    partition: str = ""
+    n_peaks: int = 0
+    qc: dict[str, float] = field(default_factory=dict)
+    qc_flags: list[str] = field(default_factory=list)
+
+    def save(self, file_path: str | pathlib.Path) -> None:
+        path = pathlib.Path(file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, file_path: str | pathlib.Path) -> "RunRecord | None":
+        """Reads a record, None if there is none or it can not be read"""
+        try:
+            with open(file_path) as f:
+                values = json.load(f)
+            return cls(fingerprint=Fingerprint(**values.pop("fingerprint")), **values)
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as e:
+            logging.error(f"Error reading run record '{file_path}': {e}")
+            return None
+
+    def check(self, input_path: str | pathlib.Path, key: str) -> "RunRecord | None":
+        """Returns the record if its peak table can be reused for the current input file and pipeline, else None.
+
+        If only the modification time of the input changed, the content is compared; the returned record then has
+        the new fingerprint and should be saved.
+        """
+        if key != self.pipeline_key:
+            return None
+        try:
+            st = os.stat(input_path)
+        except FileNotFoundError:
+            return None
+        fp = self.fingerprint
+        if st.st_size != fp.size:
+            return None
+        if st.st_mtime_ns == fp.mtime_ns:
+            return self
+        if _digest(input_path) != fp.digest:
+            return None
+        return replace(
+            self, fingerprint=Fingerprint(st.st_size, st.st_mtime_ns, fp.digest)
+        )
@@ -0,0 +1,238 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import asyncio
+import logging
+import pathlib
+import time
+from . import Batch
+
+
+@dataclass
+class _Candidate:
+    """A file seen in the watched directory that is not queued yet"""
+
+    size: int
+    mtime_ns: int
+    stable_since: float
+
+
+@dataclass
+class IngestionStats:
+    """Counters of an IngestionService.
+
+    Fields:
+        queue_depth: Files waiting for a worker
+        in_progress: Files being processed
+        done: Files processed successfully
+        failed: Files that could not be processed
+        latencies: Seconds from the last write of a file to its written peak table, for the most recent files
+        started: time.monotonic() when the service started
+    """
+
+    queue_depth: int = 0
+    in_progress: int = 0
+    done: int = 0
+    failed: int = 0
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def throughput(self) -> float:
+        """Processed files per minute since the start"""
+        minutes = (time.monotonic() - self.started) / 60
+        return (self.done + self.failed) / minutes if minutes > 0 else 0.0
+
+    def latency(self, quantile: float = 0.5) -> float | None:
+        """Quantile of the recent latencies in seconds, None before the first file is done"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+    def snapshot(self) -> dict[str, float | int | None]:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_progress": self.in_progress,
+            "done": self.done,
+            "failed": self.failed,
+            "throughput_per_min": self.throughput,
+            "latency_p50": self.latency(0.5),
+            "latency_p95": self.latency(0.95),
+        }
+
+
+class IngestionService:
+    """Watches a directory and processes every file that lands in it with Batch.run_file.
+
+    The directory is polled. A file is queued once its size and modification time did not change for settle_time
+    seconds, so files that are still being written are not read. The queue holds at most max_queue files; when it is
+    full, the watcher waits (back-pressure) instead of reading ahead. jobs worker processes run the pipeline, results
+    are written to store.
+
+    Fields:
+        watch_dir: Watched directory (searched recursively)
+        config: Pipeline parameters
+        store: Where peak tables are written
+        jobs: Number of worker processes
+        poll_interval: Seconds between directory scans
+        settle_time: Seconds a file must stay unchanged before it is processed
+        max_queue: Maximum number of queued files
+        resume: Skip files whose peak table is newer than the file, e.g. after a restart of the service
+        stats: IngestionStats of the running service
+    """
+
+    def __init__(
+        self,
+        watch_dir: str | pathlib.Path,
+        config: Batch.PipelineConfig,
+        store: Batch.ResultStore,
+        jobs: int = 1,
+        poll_interval: float = 1.0,
+        settle_time: float = 2.0,
+        max_queue: int = 64,
+        resume: bool = True,
+    ) -> None:
+        if jobs < 1 or max_queue < 1:
+            raise ValueError(
+                f"jobs ({jobs}) and max_queue ({max_queue}) must be at least 1"
+            )
+        self.watch_dir = pathlib.Path(watch_dir)
+        self.config = config
+        self.store = store
+        self.jobs = jobs
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.max_queue = max_queue
+        self.resume = resume
+        self.stats = IngestionStats()
+
+        self._candidates: dict[pathlib.Path, _Candidate] = {}
+        # (size, mtime_ns) of every file that was queued, so a file is only processed again when it changes
+        self._queued: dict[pathlib.Path, tuple[int, int]] = {}
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Runs until stop is set. Files that are already queued are processed before returning.
+
+        Raises:
+            FileNotFoundError: If watch_dir does not exist.
+            ValueError: If the store was written with another input root (see Batch.ResultStore.record_input_root).
+        """
+        if not self.watch_dir.is_dir():
+            raise FileNotFoundError(
+                f"Watched directory '{self.watch_dir}' does not exist"
+            )
+        self.store.record_input_root()
+        stop = stop or asyncio.Event()
+        queue: asyncio.Queue[tuple[pathlib.Path, int]] = asyncio.Queue(self.max_queue)
+        self.stats = IngestionStats()
+
+        with Batch.worker_pool(self.config, self.jobs) as pool:
+            workers = [
+                asyncio.create_task(self._work(queue, pool)) for _ in range(self.jobs)
+            ]
+            watcher = asyncio.create_task(self._watch(queue, stop))
+            await stop.wait()
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+            await queue.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _watch(
+        self, queue: asyncio.Queue[tuple[pathlib.Path, int]], stop: asyncio.Event
+    ) -> None:
+        while not stop.is_set():
+            # rglob and stat of a large directory would block the workers' event loop
+            for path, mtime_ns in await asyncio.to_thread(self.scan):
+                # blocks while the queue is full
+                await queue.put((path, mtime_ns))
+                self.stats.queue_depth = queue.qsize()
+            try:
+                await asyncio.wait_for(stop.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+
+    async def _work(
+        self,
+        queue: asyncio.Queue[tuple[pathlib.Path, int]],
+        pool: ProcessPoolExecutor,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            path, mtime_ns = await queue.get()
+            self.stats.queue_depth = queue.qsize()
+            self.stats.in_progress += 1
+            try:
+                result = await loop.run_in_executor(
+                    pool, Batch.run_file, path, self.config, self.store
+                )
+            except Exception as e:
+                # e.g. a crashed worker process; run_file itself does not raise
+                logging.error(f"Error processing '{path}': {e}")
+                result = Batch.FileResult(path, "failed", error=str(e))
+            finally:
+                self.stats.in_progress -= 1
+                queue.task_done()
+
+            if result.status == "done":
+                self.stats.done += 1
+                self.stats.latencies.append(time.time() - mtime_ns / 1e9)
+            else:
+                self.stats.failed += 1
+            logging.info(
+                f"{result.status:8} {path} ({result.n_peaks} peaks, {result.seconds:.2f} s) {self.stats.snapshot()}"
+            )
+
+    def scan(self) -> list[tuple[pathlib.Path, int]]:
+        """Checks the watched directory once and returns the files that are complete and not processed yet.
+
+        Files that are gone are forgotten, so the state of the service stays as large as the directory.
+
+        Returns:
+            List of (path, modification time in ns)
+        """
+        now = time.monotonic()
+        seen = set()
+        ready = []
+        for path in sorted(self.watch_dir.rglob("*")):
+            if not self._is_input(path):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                # removed or renamed since rglob listed it
+                continue
+            seen.add(path)
+            signature = (st.st_size, st.st_mtime_ns)
+            if self._queued.get(path) == signature:
+                continue
+            if self.resume and self._is_up_to_date(path, st.st_mtime_ns):
+                self._queued[path] = signature
+                continue
+            c = self._candidates.get(path)
+            if c is None or (c.size, c.mtime_ns) != signature:
+                self._candidates[path] = _Candidate(*signature, stable_since=now)
+            elif st.st_size > 0 and now - c.stable_since >= self.settle_time:
+                del self._candidates[path]
+                self._queued[path] = signature
+                ready.append((path, st.st_mtime_ns))
+
+        for path in set(self._candidates) - seen:
+            del self._candidates[path]
+        for path in set(self._queued) - seen:
+            del self._queued[path]
+        return ready
+
+    def _is_up_to_date(self, path: pathlib.Path, mtime_ns: int) -> bool:
+        out = self.store.path_for(path)
+        return out.is_file() and out.stat().st_mtime_ns >= mtime_ns
+
+    def _is_input(self, path: pathlib.Path) -> bool:
+        """Files a reader can handle, except hidden/temporary files and the output of the store itself"""
+        if path.name.startswith(".") or not path.is_file():
+            return False
+        if path.resolve().is_relative_to(self.store.output_dir.resolve()):
+            return False
+        return Batch.find_reader(path) is not None
@@ -1,8 +1,23 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import numpy as np
 import pandas as pd
 import scipy
 import logging
-from icecream import ic
+import pathlib
+from . import PeakFinder
+
+NORM_MODES = ("max", "total", "reference", "internal_standard")
+PEAK_MODELS = {
+    "gaussian": "GaussianModel",
+    "emg": "ExponentialGaussianModel",
+    "skewed_gaussian": "SkewedGaussianModel",
+}
+MAX_FIT_EVALUATIONS = 2000
+# fit results kept by ChromPeakModelIntegrator, the least recently used are dropped first
+MAX_CACHED_FITS = 10000
+INTERNAL_STANDARD_TAG = "_IS"
 
 
 class ChromIntegrator(ABC):
@@ -24,22 +39,88 @@ class ChromIntegrator(ABC):
         """
         pass
 
-    def norm_area(self, peaks: pd.DataFrame) -> None:
-        """Noramlize peak areas relative to max peak area"""
+    def norm_area(
+        self,
+        peaks: pd.DataFrame,
+        mode: str = "max",
+        reference_rt: float | None = None,
+        rt_tolerance: float | None = None,
+        group_by: str = "run",
+    ) -> None:
+        """Normalize peak areas per run and save them to peaks['area_norm']
+
+        Args:
+            peaks: Peak table with column 'area'. A combined table of several runs must contain the column given by 'group_by'; without it the table is treated as one run.
+            mode: One of NORM_MODES:
+                'max': relative to the largest peak area of the run.
+                'total': relative to the sum of all peak areas of the run.
+                'reference': relative to the peak closest to 'reference_rt'.
+                'internal_standard': like 'reference', but only runs whose name contains INTERNAL_STANDARD_TAG are normalized, all others get NaN.
+            reference_rt: Retention time of the reference or internal standard peak.
+            rt_tolerance: Maximum distance between 'reference_rt' and the reference peak. Runs without a peak in range get NaN.
+            group_by: Column holding the run name.
+
+        Raises:
+            ValueError: If areas are missing, the mode is unknown or 'reference_rt' is missing for reference modes.
+        """
         if "area" not in peaks.columns:
             raise ValueError(
                 "Error normalizing peak areas. Areas not in peaks DataFrame"
             )
+        if mode not in NORM_MODES:
+            raise ValueError(
+                f"Error normalizing peak areas: unknown mode '{mode}', expected one of {NORM_MODES}"
+            )
 
-        max_area = peaks["area"].max()
-        area_norm = []
-        for a in peaks["area"]:
-            area_norm.append(a / max_area)
+        area = peaks["area"].to_numpy(dtype=np.float64)
+        if group_by in peaks.columns:
+            codes, runs = pd.factorize(peaks[group_by], sort=False)
+        else:
+            codes, runs = np.zeros(len(peaks), dtype=np.intp), pd.Index(["run"])
+        n_runs = len(runs)
+
+        if mode == "max":
+            denom = np.full(n_runs, -np.inf)
+            np.maximum.at(denom, codes, area)
+        elif mode == "total":
+            denom = np.bincount(codes, weights=area, minlength=n_runs)
+        else:
+            if reference_rt is None:
+                raise ValueError(
+                    f"Error normalizing peak areas: mode '{mode}' requires 'reference_rt'"
+                )
+            distance = np.abs(peaks["retention_time"].to_numpy() - reference_rt)
+            # sort by run, then by distance: the first row of each run is its reference peak
+            order = np.lexsort((distance, codes))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = codes[order][1:] != codes[order][:-1]
+            ref_rows = order[first]
+
+            denom = np.full(n_runs, np.nan)
+            denom[codes[ref_rows]] = area[ref_rows]
+            if rt_tolerance is not None:
+                out_of_range = distance[ref_rows] > rt_tolerance
+                denom[codes[ref_rows][out_of_range]] = np.nan
+            if mode == "internal_standard":
+                has_is = np.array(
+                    [has_internal_standard(str(run)) for run in runs], dtype=bool
+                )
+                denom[~has_is] = np.nan
+            if np.isnan(denom).any():
+                logging.warning(
+                    f"No reference peak found for runs: {list(runs[np.isnan(denom)])}"
+                )
+
+        area_norm = area / denom[codes]
         peaks["area_norm"] = area_norm
 
 
 class ChromTrapezoidIntegrator(ChromIntegrator):
-    """Using trapezoid method to calculate are beneath peaks"""
+    """Using trapezoid method to calculate are beneath peaks
+
+    If peaks contain 'baseline_left'/'baseline_right' (see Deconvolver.TangentSkimDeconvolver), the area beneath the straight baseline is excluded.
+    If peaks contain 'skim_parent', the area of each rider is subtracted from its parent peak.
+    """
 
     def integrate(self, chrom: pd.Series | pd.DataFrame, peaks: pd.DataFrame):
         if "intensity" not in chrom.columns:
@@ -50,21 +131,214 @@ class ChromTrapezoidIntegrator(ChromIntegrator):
         if not all(value in peaks.columns for value in to_check):
             raise ValueError("error integrating peak area: peak borders are missing")
 
-        lb = peaks["left_border"]
-        rb = peaks["right_border"]
-        area = []
-        for i in peaks.index:
-            y = []
-            for intensity in chrom["intensity"].iloc[
-                peaks.at[i, "left_border"] : peaks.at[i, "right_border"] + 1
-            ]:
-                y.append(intensity)
-            try:
-                area.append(scipy.integrate.trapezoid(y))
-            except Exception as e:
-                logging.error(
-                    f"Error integrating peak area at peak index: {i}, intensity: {peaks['intensity'].iloc[i]}, left border: {peaks['left_border'].iloc[i]}, right border: {peaks['right_border'].iloc[i]}"
-                )
-                raise e
+        intensity = chrom["intensity"].to_numpy(dtype=np.float64)
+        lb = peaks["left_border"].to_numpy()
+        rb = peaks["right_border"].to_numpy()
+        out_of_range = (lb < 0) | (rb >= len(intensity)) | (lb > rb)
+        if out_of_range.any():
+            i = int(np.flatnonzero(out_of_range)[0])
+            logging.error(
+                f"Error integrating peak area at peak index: {i}, intensity: {peaks['intensity'].iloc[i]}, left border: {lb[i]}, right border: {rb[i]}"
+            )
+            raise ValueError(
+                f"Error integrating peak area: {out_of_range.sum()} peaks have borders outside of the chromatogram"
+            )
+
+        # area between two borders is the difference of the running trapezoid integral
+        cumulative = scipy.integrate.cumulative_trapezoid(intensity, initial=0)
+        area = cumulative[rb] - cumulative[lb]
+
+        if "baseline_left" in peaks.columns and "baseline_right" in peaks.columns:
+            baseline = (
+                (peaks["baseline_left"].to_numpy() + peaks["baseline_right"].to_numpy())
+                / 2
+                * (rb - lb)
+            )
+            skimmed = ~np.isnan(baseline)
+            area[skimmed] -= baseline[skimmed]
+        if "skim_parent" in peaks.columns:
+            parent = peaks["skim_parent"].to_numpy()
+            riders = np.flatnonzero(parent >= 0)
+            np.subtract.at(area, parent[riders], area[riders])
 
         peaks["area"] = area
+
+
+class ChromPeakModelIntegrator(ChromIntegrator):
+    """Fits peak models with lmfit and reports their analytic areas.
+
+    Peaks with intersecting borders are fitted together as one cluster (sum of one model per peak plus a constant baseline).
+    Independent clusters are fitted in parallel in a process pool. Fit results are cached per cluster shape (trace in the window and initial guesses), so integrating the same data again,
+    or a cluster identical to another one, does not refit;
+    the cache keeps the max_cached most recently used clusters.
+    Areas are given in intensity * data points, like ChromTrapezoidIntegrator, and exclude the baseline.
+    peaks['fit_success'] is False where the fit did not converge; if a fit raises, the trapezoid area is used instead.
+
+    Fields:
+        model: One of the keys of PEAK_MODELS ('gaussian', 'emg', 'skewed_gaussian')
+        max_workers: Number of processes. 1 fits in the calling process.
+        max_cached: Maximum number of cached cluster fits
+    """
+
+    def __init__(
+        self,
+        model: str = "gaussian",
+        max_workers: int = 1,
+        max_cached: int = MAX_CACHED_FITS,
+    ) -> None:
+        if model not in PEAK_MODELS:
+            raise ValueError(
+                f"Unknown peak model '{model}', expected one of {tuple(PEAK_MODELS)}"
+            )
+        self.model = model
+        self.max_workers = max_workers
+        self.max_cached = max_cached
+        self._cache: dict[bytes, tuple[np.ndarray, bool]] = {}
+
+    def integrate(self, chrom: pd.Series | pd.DataFrame, peaks: pd.DataFrame):
+        if "intensity" not in chrom.columns:
+            raise ValueError(
+                "Error integrating peak area: chromatogram does not contain intensity column"
+            )
+        to_check = ["index", "left_border", "right_border", "width", "width_height"]
+        if not all(value in peaks.columns for value in to_check):
+            raise ValueError(
+                f"Error integrating peak area: peaks must contain columns {to_check}"
+            )
+        if len(peaks) == 0:
+            peaks["area"] = np.empty(0)
+            peaks["fit_success"] = np.empty(0, dtype=bool)
+            return
+
+        intensity = chrom["intensity"].to_numpy(dtype=np.float64)
+        labels = PeakFinder.find_peak_clusters(peaks)
+        rows_per_cluster = np.split(
+            np.argsort(labels, kind="stable"),
+            np.flatnonzero(np.diff(np.sort(labels))) + 1,
+        )
+
+        jobs = {}
+        for rows in rows_per_cluster:
+            start = int(peaks["left_border"].iloc[rows].min())
+            stop = int(peaks["right_border"].iloc[rows].max()) + 1
+            y = intensity[start:stop]
+            guesses = _initial_guesses(peaks.iloc[rows], start)
+            key = _cluster_key(self.model, y, guesses)
+            # clusters of the same shape share one fit
+            jobs.setdefault(key, (y, guesses, []))[2].append(rows)
+
+        todo = [key for key in jobs if key not in self._cache]
+        args = [(self.model, jobs[key][0], jobs[key][1]) for key in todo]
+        if self.max_workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(_fit_cluster, *zip(*args)))
+        else:
+            results = [_fit_cluster(*a) for a in args]
+
+        area = np.full(len(peaks), np.nan)
+        converged = np.zeros(len(peaks), dtype=bool)
+        fitted = dict(zip(todo, results))
+        for key, (_, _, row_sets) in jobs.items():
+            fit = fitted[key] if key in fitted else self._cache.pop(key)
+            for rows in row_sets:
+                area[rows], converged[rows] = fit
+            # reinserted at the end: the dict is ordered from least to most recently used
+            self._cache[key] = fit
+        while len(self._cache) > self.max_cached:
+            del self._cache[next(iter(self._cache))]
+        failed = ~np.isfinite(area)
+        if failed.any():
+            logging.warning(
+                f"Peak model fit failed for {failed.sum()} peaks, falling back to trapezoid areas"
+            )
+            ChromTrapezoidIntegrator().integrate(chrom, peaks)
+            area[failed] = peaks["area"].to_numpy()[failed]
+        peaks["area"] = area
+        peaks["fit_success"] = converged
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+
+def _initial_guesses(cluster: pd.DataFrame, start: int) -> np.ndarray:
+    """Initial center, sigma and amplitude per peak relative to the cluster window. 'width' is measured at the peak base (rel_height=1.0), which spans about 4 sigma"""
+    center = cluster["index"].to_numpy(dtype=np.float64) - start
+    sigma = np.maximum(cluster["width"].to_numpy(dtype=np.float64) / 4, 0.5)
+    height = np.maximum(
+        cluster["intensity"].to_numpy(dtype=np.float64)
+        - cluster["width_height"].to_numpy(dtype=np.float64),
+        0.0,
+    )
+    amplitude = height * sigma * np.sqrt(2 * np.pi)
+    return np.column_stack((center, sigma, amplitude))
+
+
+def _cluster_key(model: str, y: np.ndarray, guesses: np.ndarray) -> bytes:
+    h = hashlib.blake2b(model.encode(), digest_size=16)
+    h.update(y.tobytes())
+    h.update(guesses.tobytes())
+    return h.digest()
+
+
+def _fit_cluster(
+    model: str, y: np.ndarray, guesses: np.ndarray
+) -> tuple[np.ndarray, bool]:
+    """Fits the sum of one peak model per peak and a constant baseline to y.
+
+    Returns:
+        Peak areas (NaN if the fit raised) and whether the fit converged within MAX_FIT_EVALUATIONS.
+    """
+    import lmfit.models
+
+    x = np.arange(len(y), dtype=np.float64)
+    composite = lmfit.models.ConstantModel(prefix="bl_")
+    params = composite.make_params(c=dict(value=float(y.min()), min=0))
+    for i, (center, sigma, amplitude) in enumerate(guesses):
+        peak = getattr(lmfit.models, PEAK_MODELS[model])(prefix=f"p{i}_")
+        params.update(
+            peak.make_params(
+                center=dict(value=center, min=0, max=len(y) - 1),
+                sigma=dict(value=sigma, min=0.1, max=len(y)),
+                amplitude=dict(value=amplitude, min=0),
+            )
+        )
+        if model == "emg":
+            params[f"p{i}_gamma"].set(value=1 / sigma, min=0.05, max=5)
+        elif model == "skewed_gaussian":
+            params[f"p{i}_gamma"].set(value=0.0)
+        composite = composite + peak
+
+    try:
+        result = composite.fit(y, params, x=x, max_nfev=MAX_FIT_EVALUATIONS)
+    except Exception as e:
+        logging.error(f"Error fitting peak cluster with {len(guesses)} peaks: {e}")
+        return np.full(len(guesses), np.nan), False
+    areas = np.array(
+        [result.params[f"p{i}_amplitude"].value for i in range(len(guesses))]
+    )
+    return areas, bool(result.success)
+
+
+def has_internal_standard(run: str) -> bool:
+    """Checks if a run (file name) was measured with an internal standard"""
+    return INTERNAL_STANDARD_TAG in pathlib.Path(run).stem
+
+
+def concat_runs(
+    peak_tables: dict[str, pd.DataFrame], group_by: str = "run"
+) -> pd.DataFrame:
+    """Combines peak tables of several runs into one table for group-wise normalization
+
+    Args:
+        peak_tables: Mapping of run name (e.g. file name) to its peak table.
+        group_by: Name of the column that holds the run name.
+
+    Returns:
+        One DataFrame with all peaks and an additional column 'group_by'.
+    """
+    if not peak_tables:
+        return pd.DataFrame()
+    return pd.concat(
+        [df.assign(**{group_by: run}) for run, df in peak_tables.items()],
+        ignore_index=True,
+    )
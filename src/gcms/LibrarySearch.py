@@ -0,0 +1,510 @@
+"""Compound identification: apex mass spectra of peaks are scored against a spectral library (NIST-style MSP file).
+
+A library is converted once into an index directory with a memory-mapped matrix of binned, normalized spectra sorted
+by retention index. Searching is a matrix product of the query spectra with the candidate rows, so the cosine
+similarity of many peaks is computed at once.
+"""
+
+from dataclasses import asdict, dataclass
+import json
+import logging
+import pathlib
+import re
+import numpy as np
+import pandas as pd
+from . import Precision
+
+INDEX_FORMAT_VERSION = 1
+# MSP keys that hold a retention index, compared in lower case
+RI_KEYS = ("ri", "retention_index", "retentionindex", "retention index")
+
+
+@dataclass(frozen=True)
+class Binning:
+    """Converts centroided spectra to vectors of nominal mass bins.
+
+    Fields:
+        mz_min: m/z of the first bin
+        mz_max: m/z of the last bin
+        width: Width of a bin
+        intensity_power: Intensities are raised to this power before normalization (0.5 damps dominant fragments)
+    """
+
+    mz_min: float = 1.0
+    mz_max: float = 1000.0
+    width: float = 1.0
+    intensity_power: float = 0.5
+
+    @property
+    def n_bins(self) -> int:
+        return int(np.floor((self.mz_max - self.mz_min) / self.width)) + 1
+
+    def bin_many(self, spectra: list[tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """Bins and L2-normalizes spectra.
+
+        Args:
+            spectra: (mz, intensity) per spectrum
+
+        Returns:
+            float32 matrix of shape (spectra, n_bins). Empty spectra are all zero.
+        """
+        return self.transform(self.bin_raw(spectra))
+
+    def bin_raw(self, spectra: list[tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """Sums the intensities per bin, without weighting or normalization. Returns a float32 matrix (spectra, n_bins)"""
+        counts = np.array([len(mz) for mz, _ in spectra], dtype=np.intp)
+        if counts.sum() == 0:
+            return np.zeros((len(spectra), self.n_bins), dtype=np.float32)
+        mz = np.concatenate([np.asarray(mz, dtype=np.float64) for mz, _ in spectra])
+        intensity = np.concatenate(
+            [np.asarray(i, dtype=np.float64) for _, i in spectra]
+        )
+        row = np.repeat(np.arange(len(spectra)), counts)
+        b = np.rint((mz - self.mz_min) / self.width).astype(np.intp)
+        inside = (b >= 0) & (b < self.n_bins)
+        matrix = np.bincount(
+            row[inside] * self.n_bins + b[inside],
+            weights=intensity[inside],
+            minlength=len(spectra) * self.n_bins,
+        )
+        return matrix.reshape(len(spectra), self.n_bins).astype(np.float32)
+
+    def transform(self, raw: np.ndarray) -> np.ndarray:
+        """Weights binned intensities with intensity_power and L2-normalizes them"""
+        return normalize(
+            np.power(np.maximum(raw.astype(np.float64), 0), self.intensity_power)
+        )
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalizes the rows of matrix as float32; rows of zeros stay zero"""
+    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norm, out=np.zeros(matrix.shape), where=norm > 0).astype(
+        np.float32
+    )
+
+
+@dataclass
+class LibrarySpectrum:
+    """One entry of a spectral library
+
+    Fields:
+        name: Compound name
+        mz: m/z of the fragments
+        intensity: Intensities of the fragments
+        ri: Retention index, NaN if unknown
+    """
+
+    name: str
+    mz: np.ndarray
+    intensity: np.ndarray
+    ri: float = np.nan
+
+
+def read_msp(file_path: str | pathlib.Path) -> list[LibrarySpectrum]:
+    """Reads a NIST-style MSP file: 'Key: value' lines, 'Num Peaks: n', then n 'mz intensity' pairs, entries separated by blank lines.
+
+    Raises:
+        ValueError: If an entry has no name or its peak list can not be read.
+        FileNotFoundError: If the file does not exist.
+    """
+    entries = []
+    name, ri, peaks, n_peaks = None, np.nan, [], None
+
+    def close_entry(line_no: int) -> None:
+        if name is None:
+            raise ValueError(
+                f"Error reading '{file_path}': entry ending at line {line_no} has no name"
+            )
+        values = np.array(peaks, dtype=np.float64).reshape(-1, 2)
+        entries.append(LibrarySpectrum(name, values[:, 0], values[:, 1], ri))
+
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                if name is not None or peaks:
+                    close_entry(line_no)
+                name, ri, peaks, n_peaks = None, np.nan, [], None
+                continue
+            if n_peaks is not None:
+                # peak lines: 'mz intensity' pairs separated by whitespace, ';' or ','
+                try:
+                    peaks.extend(float(v) for v in re.split(r"[\s;,:]+", line) if v)
+                except ValueError:
+                    raise ValueError(
+                        f"Error reading '{file_path}': invalid peak line {line_no}: '{line}'"
+                    )
+                continue
+            key, _, value = line.partition(":")
+            key = key.strip().lower()
+            if key == "name":
+                name = value.strip()
+            elif key in RI_KEYS:
+                try:
+                    ri = float(value.split()[0])
+                except (ValueError, IndexError):
+                    logging.warning(
+                        f"Invalid retention index in line {line_no} of '{file_path}': '{line}'"
+                    )
+            elif key == "num peaks":
+                n_peaks = int(value)
+    if name is not None or peaks:
+        close_entry(line_no)
+    return entries
+
+
+class SpectralLibrary:
+    """A spectral library index: binned, normalized spectra in a read-only memory-mapped matrix, sorted by retention index.
+
+    Create the index once with SpectralLibrary.build() (or load_library()), then open it in every process with
+    SpectralLibrary.open(); the operating system shares the mapped pages between processes.
+
+    Fields:
+        path: Index directory
+        binning: Binning of the spectra
+        names: Compound name per row
+        ri: Retention index per row (NaN rows at the end)
+        base_peak: Bin of the most intense fragment per row
+        spectra: Memory-mapped float32 matrix (rows, binning.n_bins)
+    """
+
+    def __init__(self, path: str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        with open(self.path / "library.json") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(
+                f"Library index '{self.path}' has version {meta.get('version')}, expected {INDEX_FORMAT_VERSION}"
+            )
+        self.meta = meta
+        self.binning = Binning(**meta["binning"])
+        self.names = np.array(meta["names"], dtype=object)
+        self.ri = np.load(self.path / "ri.npy")
+        self.base_peak = np.load(self.path / "base_peak.npy")
+        self.spectra = np.load(self.path / "spectra.npy", mmap_mode="r")
+        self._n_with_ri = int(np.count_nonzero(~np.isnan(self.ri)))
+
+    @classmethod
+    def open(cls, path: str | pathlib.Path) -> "SpectralLibrary":
+        return cls(path)
+
+    @classmethod
+    def build(
+        cls,
+        entries: list[LibrarySpectrum],
+        path: str | pathlib.Path,
+        binning: Binning = Binning(),
+        source: dict | None = None,
+        chunk_size: int = 4096,
+    ) -> "SpectralLibrary":
+        """Writes the index of entries to the directory path and opens it
+
+        Args:
+            entries: Library spectra, e.g. from read_msp()
+            path: Index directory, created if missing
+            binning: Binning of the spectra
+            source: Description of the source file, used by load_library() to detect changes
+            chunk_size: Spectra binned at once
+        """
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        ri = np.array([e.ri for e in entries], dtype=np.float64)
+        # sorted by retention index, entries without one at the end
+        order = np.argsort(ri, kind="stable")
+        spectra = np.lib.format.open_memmap(
+            path / "spectra.npy",
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(entries), binning.n_bins),
+        )
+        for start in range(0, len(entries), chunk_size):
+            rows = order[start : start + chunk_size]
+            spectra[start : start + len(rows)] = binning.bin_many(
+                [(entries[i].mz, entries[i].intensity) for i in rows]
+            )
+        base_peak = np.asarray(spectra.argmax(axis=1), dtype=np.int32)
+        spectra.flush()
+        del spectra
+        np.save(path / "ri.npy", ri[order])
+        np.save(path / "base_peak.npy", base_peak)
+        with open(path / "library.json", "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_FORMAT_VERSION,
+                    "binning": asdict(binning),
+                    "source": source or {},
+                    "names": [entries[i].name for i in order],
+                },
+                f,
+            )
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        ri: np.ndarray | None = None,
+        ri_window: float = 30.0,
+        top_k: int = 3,
+        base_peak_top: int | None = 5,
+        min_score: float = 0.0,
+        block_size: int = 8192,
+    ) -> pd.DataFrame:
+        """Scores binned query spectra against the library by cosine similarity.
+
+        Candidates are pre-filtered: with query retention indices, only library rows within ri_window (and rows
+        without a retention index) are scored, which is a contiguous range of the sorted matrix. With base_peak_top,
+        the base peak of a candidate must be one of the base_peak_top most intense bins of the query.
+
+        Args:
+            queries: Binned, normalized spectra of shape (queries, n_bins), e.g. from SpectrumSet.apex_spectra()
+            ri: Retention index per query, NaN or None to disable the window
+            ri_window: Maximum retention index difference
+            top_k: Number of hits per query
+            base_peak_top: Number of most intense query bins the library base peak must be among, None to disable
+            min_score: Hits below this score are dropped
+            block_size: Library rows scored at once
+
+        Returns:
+            DataFrame with columns 'query', 'rank', 'name', 'score', 'library_ri', at most top_k rows per query
+
+        Raises:
+            ValueError: If the queries do not match the binning of the library.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.binning.n_bins:
+            raise ValueError(
+                f"Error searching library: queries of shape {queries.shape} do not match {self.binning.n_bins} bins"
+            )
+        n_queries = len(queries)
+        q_ri = (
+            np.full(n_queries, np.nan)
+            if ri is None
+            else np.asarray(ri, dtype=np.float64)
+        )
+        lo = np.zeros(n_queries, dtype=np.intp)
+        hi = np.full(n_queries, self._n_with_ri, dtype=np.intp)
+        has_ri = ~np.isnan(q_ri)
+        sorted_ri = self.ri[: self._n_with_ri]
+        lo[has_ri] = np.searchsorted(sorted_ri, q_ri[has_ri] - ri_window, "left")
+        hi[has_ri] = np.searchsorted(sorted_ri, q_ri[has_ri] + ri_window, "right")
+
+        allowed_base_peak = None
+        if base_peak_top:
+            top_bins = np.argpartition(-queries, base_peak_top - 1, axis=1)[
+                :, :base_peak_top
+            ]
+            allowed_base_peak = np.zeros(queries.shape, dtype=bool)
+            np.put_along_axis(allowed_base_peak, top_bins, True, axis=1)
+            # a query with fewer non-zero bins only allows its non-zero bins
+            allowed_base_peak &= queries > 0
+
+        best_score = np.full((n_queries, top_k), -np.inf, dtype=np.float32)
+        best_row = np.full((n_queries, top_k), -1, dtype=np.intp)
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            if stop <= self._n_with_ri:
+                active = np.flatnonzero((lo < stop) & (hi > start))
+            else:
+                # rows without retention index are candidates of every query
+                active = np.arange(n_queries)
+            if len(active) == 0:
+                continue
+            rows = np.arange(start, stop)
+            mask = (rows >= lo[active, None]) & (rows < hi[active, None])
+            mask |= rows >= self._n_with_ri
+            if allowed_base_peak is not None:
+                mask &= allowed_base_peak[active][:, self.base_peak[start:stop]]
+            scores = queries[active] @ np.asarray(self.spectra[start:stop]).T
+            scores[~mask] = -np.inf
+            _merge_top_k(best_score, best_row, active, scores, rows, top_k)
+
+        query, rank = np.nonzero((best_row >= 0) & (best_score >= min_score))
+        row = best_row[query, rank]
+        return pd.DataFrame(
+            {
+                "query": query,
+                "rank": rank,
+                "name": self.names[row] if len(row) else np.array([], dtype=object),
+                "score": best_score[query, rank].astype(np.float64),
+                "library_ri": self.ri[row],
+            }
+        )
+
+
+def _merge_top_k(
+    best_score: np.ndarray,
+    best_row: np.ndarray,
+    active: np.ndarray,
+    scores: np.ndarray,
+    rows: np.ndarray,
+    top_k: int,
+) -> None:
+    """Merges the scores of a library block into the running top_k of the active queries"""
+    k = min(top_k, scores.shape[1])
+    block_best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    all_scores = np.concatenate(
+        (best_score[active], np.take_along_axis(scores, block_best, axis=1)), axis=1
+    )
+    all_rows = np.concatenate((best_row[active], rows[block_best]), axis=1)
+    all_rows[np.isneginf(all_scores)] = -1
+    order = np.argsort(-all_scores, axis=1, kind="stable")[:, :top_k]
+    best_score[active] = np.take_along_axis(all_scores, order, axis=1)
+    best_row[active] = np.take_along_axis(all_rows, order, axis=1)
+
+
+def load_library(
+    msp_path: str | pathlib.Path,
+    index_dir: str | pathlib.Path | None = None,
+    binning: Binning = Binning(),
+) -> SpectralLibrary:
+    """Opens the index of an MSP library, building it first if it is missing or the MSP file or binning changed.
+
+    Args:
+        msp_path: MSP library file
+        index_dir: Index directory, default '<msp_path>.index' next to the library
+        binning: Binning of the spectra
+    """
+    msp_path = pathlib.Path(msp_path)
+    index_dir = pathlib.Path(index_dir or msp_path.with_name(msp_path.name + ".index"))
+    st = msp_path.stat()
+    source = {
+        "path": str(msp_path.resolve()),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+    try:
+        library = SpectralLibrary.open(index_dir)
+        if library.meta["source"] == source and library.binning == binning:
+            return library
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    logging.info(f"Building library index '{index_dir}' from '{msp_path}'")
+    return SpectralLibrary.build(read_msp(msp_path), index_dir, binning, source)
+
+
+@dataclass
+class SpectrumSet:
+    """All mass spectra of a run, binned like a library.
+
+    Fields:
+        rt: Retention time per spectrum, ascending
+        spectra: Binned intensities of shape (spectra, n_bins), not yet weighted or normalized (see Binning.bin_raw)
+        binning: Binning of the spectra
+    """
+
+    rt: np.ndarray
+    spectra: np.ndarray
+    binning: Binning
+
+    @classmethod
+    def read(
+        cls, file_path: str | pathlib.Path, binning: Binning = Binning()
+    ) -> "SpectrumSet":
+        """Reads the MS1 spectra of a mzML file
+
+        Raises:
+            ValueError: If the file contains no spectra.
+        """
+        from .pyopenms_client import PyOpenMsClient as omsc
+
+        exp = omsc.Exp(pathlib.Path(file_path), testdata=False).exp
+        spectra = [s for s in exp.getSpectra() if s.getMSLevel() == 1]
+        if not spectra:
+            raise ValueError(
+                f"Error reading spectra: '{file_path}' contains no MS1 spectra"
+            )
+        rt = np.array([s.getRT() for s in spectra])
+        order = np.argsort(rt, kind="stable")
+        binned = binning.bin_raw([spectra[i].get_peaks() for i in order])
+        return cls(rt[order], binned, binning)
+
+    def apex_spectra(
+        self,
+        peaks: pd.DataFrame,
+        chrom: pd.DataFrame | None = None,
+        subtract_background: bool = False,
+    ) -> np.ndarray:
+        """Spectrum nearest to the apex retention time of every peak.
+
+        Args:
+            peaks: Peaks with column 'retention_time' (and 'left_border', 'right_border' for background subtraction)
+            chrom: Chromatogram the border positions refer to, needed for background subtraction
+            subtract_background: Subtract the mean of the spectra at both borders, which removes co-eluting background
+
+        Returns:
+            Binned, normalized spectra of shape (peaks, n_bins)
+        """
+        apex = self._nearest(peaks["retention_time"].to_numpy())
+        spectra = self.spectra[apex]
+        if subtract_background:
+            if chrom is None:
+                raise ValueError("Error subtracting background: chrom is None")
+            left = self._nearest(
+                Precision.retention_time(
+                    chrom, peaks["left_border"].to_numpy(dtype=np.intp)
+                )
+            )
+            right = self._nearest(
+                Precision.retention_time(
+                    chrom, peaks["right_border"].to_numpy(dtype=np.intp)
+                )
+            )
+            background = (self.spectra[left] + self.spectra[right]) / 2
+            spectra = spectra - background
+        return self.binning.transform(spectra)
+
+    def _nearest(self, rt: np.ndarray) -> np.ndarray:
+        i = np.clip(np.searchsorted(self.rt, rt), 1, len(self.rt) - 1)
+        before = np.abs(rt - self.rt[i - 1]) <= np.abs(self.rt[i] - rt)
+        return (
+            np.where(before, i - 1, i)
+            if len(self.rt) > 1
+            else np.zeros(len(rt), dtype=np.intp)
+        )
+
+
+def identify(
+    peaks: pd.DataFrame,
+    spectra: SpectrumSet,
+    library: SpectralLibrary,
+    chrom: pd.DataFrame | None = None,
+    subtract_background: bool = False,
+    **search_args,
+) -> pd.DataFrame:
+    """Labels peaks with their best library hit: adds the columns 'compound', 'match_score', 'library_ri'.
+
+    If peaks has a column 'ri' (see RetentionIndex), candidates are restricted to the retention index window.
+    Peaks without a hit get an empty name and score 0.
+
+    Args:
+        peaks: Peaks with column 'retention_time'
+        spectra: Spectra of the same run
+        library: Spectral library with the same binning as spectra
+        chrom: Chromatogram of the run, needed for background subtraction
+        subtract_background: See SpectrumSet.apex_spectra
+        search_args: Passed to SpectralLibrary.search (ri_window, base_peak_top, min_score, ...)
+
+    Returns:
+        The modified 'peaks' DataFrame
+    """
+    if spectra.binning != library.binning:
+        raise ValueError(
+            f"Error identifying peaks: spectra binning {spectra.binning} differs from library binning {library.binning}"
+        )
+    queries = spectra.apex_spectra(peaks, chrom, subtract_background)
+    ri = peaks["ri"].to_numpy() if "ri" in peaks.columns else None
+    hits = library.search(queries, ri, top_k=1, **search_args)
+    compound = np.full(len(peaks), "", dtype=object)
+    score = np.zeros(len(peaks))
+    library_ri = np.full(len(peaks), np.nan)
+    compound[hits["query"]] = hits["name"].to_numpy()
+    score[hits["query"]] = hits["score"].to_numpy()
+    library_ri[hits["query"]] = hits["library_ri"].to_numpy()
+    peaks["compound"] = compound
+    peaks["match_score"] = score
+    peaks["library_ri"] = library_ri
+    return peaks
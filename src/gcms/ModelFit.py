@@ -0,0 +1,160 @@
+from dataclasses import dataclass
+import numpy as np
+import scipy
+
+
+@dataclass
+class PolynomialModel:
+    """Polynomial fitted on scaled x, t = (x - x_offset) / x_scale, which keeps the least squares problem well conditioned for raw retention times.
+
+    All fields may carry leading batch dimensions (one model per run).
+
+    Fields:
+        coef: Coefficients in ascending order of t, shape (..., order + 1)
+        x_offset: Center of the fitted x range, shape (...)
+        x_scale: Half width of the fitted x range, shape (...)
+    """
+
+    coef: np.ndarray
+    x_offset: np.ndarray
+    x_scale: np.ndarray
+
+    @property
+    def order(self) -> int:
+        return self.coef.shape[-1] - 1
+
+    def predict(self, x: np.ndarray | float) -> np.ndarray:
+        """Evaluates the model at x. For a batch of models x is broadcast as shape (runs, n) or (n,) for a common grid"""
+        x = np.asarray(x, dtype=np.float64)
+        coef = self.coef
+        offset = np.asarray(self.x_offset)
+        scale = np.asarray(self.x_scale)
+        if coef.ndim > 1:
+            coef, offset, scale = coef[:, None, :], offset[:, None], scale[:, None]
+        t = (x - offset) / scale
+        y = np.zeros(t.shape)
+        for i in range(self.order, -1, -1):
+            y = y * t + coef[..., i]
+        return y
+
+    def to_power_basis(self) -> np.ndarray:
+        """Coefficients in descending order of raw x (np.polyval convention, as used by Processor.calc_predict)"""
+        coef = np.atleast_2d(self.coef)
+        offset = np.atleast_1d(self.x_offset)
+        scale = np.atleast_1d(self.x_scale)
+        out = np.empty_like(coef)
+        for i in range(len(coef)):
+            raw = (
+                np.polynomial.Polynomial(
+                    coef[i],
+                    domain=[offset[i] - scale[i], offset[i] + scale[i]],
+                    window=[-1, 1],
+                )
+                .convert()
+                .coef
+            )
+            out[i] = np.pad(raw, (0, coef.shape[1] - len(raw)))[::-1]
+        return out.reshape(self.coef.shape)
+
+
+class PolynomialModelBatch(PolynomialModel):
+    """A PolynomialModel with a leading run dimension. Indexing returns the model of a single run"""
+
+    def __getitem__(self, i: int) -> PolynomialModel:
+        return PolynomialModel(self.coef[i], self.x_offset[i], self.x_scale[i])
+
+    def __len__(self) -> int:
+        return len(self.coef)
+
+
+def fit_polynomial(
+    x: np.ndarray, y: np.ndarray, order: int = 4, weights: np.ndarray | None = None
+) -> PolynomialModel:
+    """Fits a polynomial of given order with a closed-form least squares solve.
+
+    Args:
+        x: Sample positions (e.g. retention times)
+        y: Values (e.g. intensities)
+        order: Polynomial order (2: quadratic, 3: cubic, ...)
+        weights: Optional weight per sample
+
+    Returns:
+        A PolynomialModel
+    """
+    return fit_polynomial_batch(
+        np.asarray(x)[None, :],
+        np.asarray(y)[None, :],
+        order,
+        None if weights is None else np.asarray(weights)[None, :],
+    )[0]
+
+
+def fit_polynomial_batch(
+    x: np.ndarray, y: np.ndarray, order: int = 4, weights: np.ndarray | None = None
+) -> PolynomialModelBatch:
+    """Fits one polynomial per row of a stacked batch of runs in a single solve.
+
+    Runs of different length are padded with NaN; NaN samples and samples with weight 0 are ignored. Runs whose samples
+    do not determine all coefficients (fewer than order + 1 distinct x) get the least squares solution of minimum norm,
+    e.g. a constant for samples that all share one x.
+
+    Args:
+        x: Sample positions, shape (runs, n)
+        y: Values, shape (runs, n)
+        order: Polynomial order
+        weights: Optional weights, shape (runs, n)
+
+    Returns:
+        A PolynomialModelBatch with one model per run
+
+    Raises:
+        ValueError: If shapes differ or a run has fewer valid samples than order + 1.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape or x.ndim != 2:
+        raise ValueError(
+            f"Error fitting polynomials: x {x.shape} and y {y.shape} must be 2D arrays of the same shape"
+        )
+    w = np.ones_like(x) if weights is None else np.asarray(weights, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y) & (w > 0)
+    n_valid = valid.sum(axis=1)
+    if (n_valid < order + 1).any():
+        raise ValueError(
+            f"Error fitting polynomials of order {order}: runs {np.flatnonzero(n_valid < order + 1).tolist()} have fewer than {order + 1} valid samples"
+        )
+
+    x_min = np.where(valid, x, np.inf).min(axis=1)
+    x_max = np.where(valid, x, -np.inf).max(axis=1)
+    x_offset = (x_max + x_min) / 2
+    x_scale = np.where(x_max > x_min, (x_max - x_min) / 2, 1.0)
+
+    t = np.where(valid, (x - x_offset[:, None]) / x_scale[:, None], 0.0)
+    sqrt_w = np.sqrt(np.where(valid, w, 0.0))
+    vander = (t[..., None] ** np.arange(order + 1)) * sqrt_w[..., None]
+    rhs = np.where(valid, y, 0.0) * sqrt_w
+
+    # a batched pseudo-inverse instead of QR: rank-deficient runs get the minimum norm solution instead of raising
+    coef = (np.linalg.pinv(vander) @ rhs[..., None])[..., 0]
+    return PolynomialModelBatch(coef, x_offset, x_scale)
+
+
+def fit_spline(
+    x: np.ndarray, y: np.ndarray, n_knots: int = 8, k: int = 3
+) -> "scipy.interpolate.BSpline":
+    """Fits a least squares B-spline with evenly spaced interior knots (linear solve, no iteration).
+
+    Args:
+        x: Sample positions, sorted ascending
+        y: Values
+        n_knots: Number of interior knots
+        k: Spline degree
+
+    Returns:
+        A scipy.interpolate.BSpline, which evaluates arrays directly.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    interior = np.linspace(x[0], x[-1], n_knots + 2)[1:-1]
+    knots = np.r_[(x[0],) * (k + 1), interior, (x[-1],) * (k + 1)]
+    return scipy.interpolate.make_lsq_spline(x, y, knots, k=k)
@@ -0,0 +1,170 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# Converts a median absolute deviation to the standard deviation of normally distributed noise
+MAD_TO_SIGMA = 1.4826
+# Converts an interquartile range to the standard deviation of normally distributed noise
+IQR_TO_SIGMA = 1 / 1.349
+
+
+@dataclass
+class NoiseEstimate:
+    """Local baseline and noise level of a chromatogram, one value per data point
+
+    Fields:
+        baseline: Intensity of the baseline
+        noise: Standard deviation of the noise
+    """
+
+    baseline: np.ndarray
+    noise: np.ndarray
+
+    def snr(self, intensity: np.ndarray, index: np.ndarray | None = None) -> np.ndarray:
+        """Signal to noise ratio (intensity - baseline) / noise at the positions 'index' (all data points if None)"""
+        baseline, noise = self.baseline, self.noise
+        if index is not None:
+            baseline, noise = baseline[index], noise[index]
+        signal = np.asarray(intensity, dtype=np.float64) - baseline
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(noise > 0, signal / noise, np.inf * np.sign(signal))
+
+    def threshold(self, min_snr: float) -> np.ndarray:
+        """Minimum intensity per data point for a signal to noise ratio of min_snr"""
+        return self.baseline + min_snr * self.noise
+
+
+class NoiseEstimator(ABC):
+    """Interface for noise estimators of chromatograms"""
+
+    @abstractmethod
+    def estimate(self, intensity: np.ndarray) -> NoiseEstimate:
+        """Estimates baseline and noise along the trace.
+
+        Args:
+            intensity: Intensities of the chromatogram
+
+        Returns:
+            NoiseEstimate with one value per data point
+        """
+        pass
+
+
+class RollingMadNoise(NoiseEstimator):
+    """Block-wise median absolute deviation (MAD).
+
+    The trace is cut into blocks of 'window' data points. Per block, the baseline is the median intensity and the noise
+    is the MAD of the point-to-point differences, which drift and the flanks of wide peaks hardly affect. Values between
+    block centers are interpolated linearly.
+
+    Fields:
+        window: Number of data points per block
+    """
+
+    def __init__(self, window: int = 501) -> None:
+        self.window = window
+
+    def estimate(self, intensity: np.ndarray) -> NoiseEstimate:
+        blocks, diffs = _blocks(intensity, self.window)
+        baseline = np.nanmedian(blocks, axis=1)
+        deviation = np.abs(diffs - np.nanmedian(diffs, axis=1)[:, None])
+        # differences of two noisy points have sqrt(2) times the noise of one point
+        noise = MAD_TO_SIGMA * np.nanmedian(deviation, axis=1) / np.sqrt(2)
+        return _interpolate(len(intensity), self.window, baseline, noise)
+
+
+class PercentileNoise(NoiseEstimator):
+    """Block-wise percentiles.
+
+    Per block of 'window' data points, the baseline is the given low percentile of the intensity (robust in regions
+    crowded with peaks) and the noise is the interquartile range of the point-to-point differences. Values between
+    block centers are interpolated linearly.
+
+    Fields:
+        window: Number of data points per block
+        percentile: Percentile of the intensities used as baseline
+    """
+
+    def __init__(self, window: int = 501, percentile: float = 10.0) -> None:
+        self.window = window
+        self.percentile = percentile
+
+    def estimate(self, intensity: np.ndarray) -> NoiseEstimate:
+        blocks, diffs = _blocks(intensity, self.window)
+        baseline = np.nanpercentile(blocks, self.percentile, axis=1)
+        q25, q75 = np.nanpercentile(diffs, [25, 75], axis=1)
+        noise = IQR_TO_SIGMA * (q75 - q25) / np.sqrt(2)
+        return _interpolate(len(intensity), self.window, baseline, noise)
+
+
+def _blocks(intensity: np.ndarray, window: int) -> tuple[np.ndarray, np.ndarray]:
+    """Intensities and point-to-point differences reshaped to (blocks, window), the last block padded with NaN.
+
+    A last block of a single point has no differences, so it is merged into the previous block, which then has
+    window + 1 points (one more NaN column in all other blocks).
+
+    Raises:
+        ValueError: If window is smaller than 2 or the trace is empty.
+    """
+    y = np.asarray(intensity, dtype=np.float64)
+    if window < 2 or len(y) == 0:
+        raise ValueError(
+            f"Error estimating noise: window must be at least 2 (got {window}) and the trace must not be empty"
+        )
+    n_blocks = _n_blocks(len(y), window)
+    width = max(window, len(y) - (n_blocks - 1) * window)
+    block = np.minimum(np.arange(len(y)) // window, n_blocks - 1)
+    column = np.arange(len(y)) - block * window
+    padded = np.full((n_blocks, width), np.nan)
+    padded[block, column] = y
+    diffs = np.full((n_blocks, width), np.nan)
+    diffs[block[:-1], column[:-1]] = np.diff(y)
+    return padded, diffs
+
+
+def _n_blocks(n: int, window: int) -> int:
+    n_blocks = -(-n // window)
+    if n_blocks > 1 and n - (n_blocks - 1) * window < 2:
+        return n_blocks - 1
+    return n_blocks
+
+
+def _interpolate(
+    n: int, window: int, baseline: np.ndarray, noise: np.ndarray
+) -> NoiseEstimate:
+    starts = np.arange(len(baseline)) * window
+    stops = np.append(starts[1:], n)
+    centers = (starts + stops - 1) / 2
+    positions = np.arange(n)
+    return NoiseEstimate(
+        np.interp(positions, centers, baseline), np.interp(positions, centers, noise)
+    )
+
+
+def add_snr(
+    chrom: pd.DataFrame,
+    peaks: pd.DataFrame,
+    estimator: NoiseEstimator,
+    min_snr: float | None = None,
+) -> pd.DataFrame:
+    """Adds the columns 'noise' and 'snr' to peaks and optionally drops peaks below a signal to noise ratio.
+
+    Args:
+        chrom: Chromatogram with column 'intensity' the noise is estimated on: the unfiltered trace the peaks were
+            found in. Smoothing correlates neighboring points, which the difference-based estimators assume to be
+            independent: on a Savitzky-Golay filtered trace (window 5) they report about half the noise
+        peaks: Peaks with the positional column 'index' and 'intensity'
+        estimator: Noise estimator
+        min_snr: Peaks with a lower signal to noise ratio are removed
+
+    Returns:
+        peaks with the new columns, re-indexed from 0 if peaks were removed
+    """
+    estimate = estimator.estimate(chrom["intensity"].to_numpy())
+    index = peaks["index"].to_numpy(dtype=np.intp)
+    peaks["noise"] = estimate.noise[index]
+    peaks["snr"] = estimate.snr(peaks["intensity"].to_numpy(), index)
+    if min_snr is not None:
+        peaks = peaks[peaks["snr"] >= min_snr].reset_index(drop=True)
+    return peaks
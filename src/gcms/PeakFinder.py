@@ -1,11 +1,12 @@
 from abc import ABC, abstractmethod
 import pandas as pd
 import numpy as np
-import pyopenms as oms
-from .pyopenms_client import PyOpenMsClient as omsc
 import logging
-from icecream import ic
 import scipy
+from . import Noise, Precision
+
+# Number of data points on each side searched for the raw apex of a picked peak
+APEX_RADIUS = 2
 
 
 class ChromPeakFinder(ABC):
@@ -16,8 +17,14 @@ class ChromPeakFinder(ABC):
         pass
 
     @abstractmethod
-    def find_peaks(self, chrom: pd.DataFrame) -> pd.DataFrame:
+    def find_peaks(
+        self, chrom: pd.DataFrame, raw: pd.DataFrame | None = None
+    ) -> pd.DataFrame:
         """Takes a chromatogram and finds the find_peaks
+        Args:
+            chrom: Chromatogram to pick peaks in, usually filtered
+            raw: Unfiltered version of chrom, which the noise is estimated on (chrom if None). Filters correlate
+                neighboring data points, so the noise of a filtered trace is underestimated
         Returns:
             pandas DataFrame with 'retention_time' and 'intensity'
         """
@@ -25,57 +32,208 @@ class ChromPeakFinder(ABC):
 
 
 class PyopenmsChromPeakFinder(ChromPeakFinder):
-    """Using the peak finder implementations in PyOpenMs"""
+    """Using the peak finder implementations in PyOpenMs
 
-    def __init__(self) -> None:
+    Fields:
+        signal_to_noise: Minimum signal to noise ratio of the pyopenms picker (its own noise estimation)
+        noise: Noise estimator for the columns 'noise' and 'snr' of the found peaks, no columns if None
+        min_snr: Peaks below this signal to noise ratio of 'noise' are removed
+    """
+
+    def __init__(
+        self,
+        signal_to_noise: float = 0.8,
+        noise: Noise.NoiseEstimator | None = None,
+        min_snr: float | None = None,
+    ) -> None:
         super().__init__()
+        self.signal_to_noise = signal_to_noise
+        self.noise = noise
+        self.min_snr = min_snr
+
+    def find_peaks(
+        self, chrom: pd.DataFrame, raw: pd.DataFrame | None = None
+    ) -> pd.DataFrame:
+        from .pyopenms_client import PyOpenMsClient as omsc
 
-    def find_peaks(self, chrom: pd.DataFrame) -> pd.DataFrame:
         chrom_adapter = omsc.Chrom(testdata=False)
         chrom_adapter.import_df(chrom)
-        chrom_adapter.find_peaks()
+        chrom_adapter.find_peaks(signal_to_noise=self.signal_to_noise)
 
         peak_df = omsc.export_df(
             chrom=chrom_adapter.chrom, peaks=chrom_adapter.picked_peaks
         )[1]
 
-        rt_corr = []
-        index_corr = []
-        intensity_corr = []
+        # the picker reports smoothed apexes: move each to the highest raw data point within +-2
+        intensity = chrom["intensity"].to_numpy()
+        index = _refine_apex(
+            intensity, peak_df["index"].to_numpy(dtype=np.intp), APEX_RADIUS
+        )
+        peaks = pd.DataFrame(
+            {
+                "index": index,
+                "retention_time": Precision.retention_time(chrom, index),
+                "intensity": intensity[index],
+            }
+        )
+        if self.noise is not None:
+            peaks = Noise.add_snr(
+                chrom if raw is None else raw, peaks, self.noise, self.min_snr
+            )
+        return peaks
+
 
-        chrom_len = len(chrom) - 1
+class LocalMaxChromPeakFinder(ChromPeakFinder):
+    """Native peak finder without pyopenms: strict local maxima within +-order data points that reach a minimum height.
 
-        for k in peak_df.index:
-            i = int(peak_df.at[k, "index"])
-            max_intensity = chrom.at[i, "intensity"]
-            max_index = i
+    Only 'order' data points after a peak are needed to confirm it, so the same rule can be applied to streamed data (see Streaming).
 
-            for j in range(-2, 3):
-                check_idx = max(0, min(chrom_len, i + j))
-                check_intensity = chrom.at[check_idx, "intensity"]
-                if check_intensity > max_intensity:
-                    max_intensity = check_intensity
-                    max_index = check_idx
+    Fields:
+        order: Number of data points on each side a peak must exceed
+        height: Minimum intensity of a peak
+        noise: Noise estimator for the columns 'noise' and 'snr' of the found peaks, no columns if None
+        min_snr: Peaks below this signal to noise ratio of 'noise' are removed
+    """
 
-            rt_corr.append(chrom.at[max_index, "retention_time"])
-            index_corr.append(max_index)
-            intensity_corr.append(max_intensity)
+    def __init__(
+        self,
+        order: int = 2,
+        height: float = 0.0,
+        noise: Noise.NoiseEstimator | None = None,
+        min_snr: float | None = None,
+    ) -> None:
+        super().__init__()
+        self.order = order
+        self.height = height
+        self.noise = noise
+        self.min_snr = min_snr
 
-        if len(rt_corr) != len(peak_df["retention_time"]):
-            raise AssertionError(
-                f"Error checking for local max between found peaks and original chrom: length found peaks:{len(peak_df['retention_time'])}, corrected peaks: {len(rt_corr)}"
+    def find_peaks(
+        self, chrom: pd.DataFrame, raw: pd.DataFrame | None = None
+    ) -> pd.DataFrame:
+        intensity = chrom["intensity"].to_numpy()
+        index = scipy.signal.argrelmax(intensity, order=self.order)[0]
+        index = index[intensity[index] >= self.height]
+        peaks = pd.DataFrame(
+            {
+                "index": index,
+                "retention_time": Precision.retention_time(chrom, index),
+                "intensity": intensity[index],
+            }
+        )
+        if self.noise is not None:
+            peaks = Noise.add_snr(
+                chrom if raw is None else raw, peaks, self.noise, self.min_snr
             )
-        return pd.DataFrame(
+        return peaks
+
+
+class CwtChromPeakFinder(ChromPeakFinder):
+    """Continuous wavelet transform peak picking (scipy.signal.find_peaks_cwt), robust against noise but slow.
+
+    The CWT runs on a copy of the trace decimated by block means to at most max_points data points, with widths
+    scaled accordingly. Ridge lines end next to, not on the apex, so every peak is then moved to the highest data point
+    of the full trace within the largest width (at least one block). Ridges on the flank of a larger peak (shoulders)
+    do not end on a local maximum there and are dropped. Adds the column 'prominence'.
+
+    Fields:
+        widths: Peak widths in data points of the full trace, the scales of the transform
+        ridge_snr: Minimum signal to noise ratio of the ridge lines of the transform (min_snr of find_peaks_cwt, whose
+            default of 1 picks up noise)
+        max_points: Maximum length of the trace the CWT runs on, None to use the full trace
+        noise: Noise estimator for the columns 'noise' and 'snr' of the found peaks, no columns if None
+        min_snr: Peaks below this signal to noise ratio of 'noise' are removed
+    """
+
+    def __init__(
+        self,
+        widths: tuple[float, ...] = (5, 10, 20),
+        ridge_snr: float = 3.0,
+        max_points: int | None = 20000,
+        noise: Noise.NoiseEstimator | None = None,
+        min_snr: float | None = None,
+    ) -> None:
+        super().__init__()
+        self.widths = widths
+        self.ridge_snr = ridge_snr
+        self.max_points = max_points
+        self.noise = noise
+        self.min_snr = min_snr
+
+    def find_peaks(
+        self, chrom: pd.DataFrame, raw: pd.DataFrame | None = None
+    ) -> pd.DataFrame:
+        intensity = chrom["intensity"].to_numpy(dtype=np.float64)
+        n = len(intensity)
+        factor = 1
+        if self.max_points is not None and n > self.max_points:
+            factor = -(-n // self.max_points)
+        coarse = intensity
+        if factor > 1:
+            n_blocks = n // factor
+            coarse = intensity[: n_blocks * factor].reshape(n_blocks, factor).mean(1)
+        widths = np.maximum(np.asarray(self.widths, dtype=np.float64) / factor, 1.0)
+        index = np.asarray(
+            scipy.signal.find_peaks_cwt(coarse, widths, min_snr=self.ridge_snr),
+            dtype=np.intp,
+        )
+        radius = max(factor, int(np.ceil(max(self.widths))))
+        index = _refine_apex(intensity, index * factor + factor // 2, radius)
+        index = np.unique(index[_is_local_max(intensity, index)])
+
+        peaks = pd.DataFrame(
             {
-                "index": index_corr,
-                "retention_time": rt_corr,
-                "intensity": intensity_corr,
+                "index": index,
+                "retention_time": Precision.retention_time(chrom, index),
+                "intensity": intensity[index],
             }
         )
+        add_prominence(chrom, peaks)
+        if self.noise is not None:
+            peaks = Noise.add_snr(
+                chrom if raw is None else raw, peaks, self.noise, self.min_snr
+            )
+        return peaks
+
+
+def _refine_apex(intensity: np.ndarray, index: np.ndarray, radius: int) -> np.ndarray:
+    """Moves every position in index to the first highest data point within +-radius, if that is higher than the position itself"""
+    offsets = np.arange(-radius, radius + 1)
+    window = np.clip(index[:, None] + offsets, 0, len(intensity) - 1)
+    best = window[np.arange(len(index)), np.argmax(intensity[window], axis=1)]
+    return np.where(intensity[best] > intensity[index], best, index)
+
+
+def _is_local_max(intensity: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Whether the data points at index are at least as high as both neighbors"""
+    left = intensity[np.maximum(index - 1, 0)]
+    right = intensity[np.minimum(index + 1, len(intensity) - 1)]
+    return (intensity[index] >= left) & (intensity[index] >= right)
+
+
+def add_prominence(chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+    """Adds the column 'prominence' (see scipy.signal.peak_prominences) to peaks
+
+    Args:
+        chrom: Chromatogram with column 'intensity'
+        peaks: Peaks with the positional column 'index'
+
+    Returns:
+        peaks with the new column
+    """
+    prominences, _, _ = scipy.signal.peak_prominences(
+        chrom["intensity"].to_numpy(), peaks["index"].to_numpy(dtype=np.intp)
+    )
+    peaks["prominence"] = prominences
+    return peaks
 
 
 def find_peak_borders(chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
     """Using scipy.signal.peak_width to find the peak borders
+
+    Before, the intensity next to each peak is adjusted (see adjust_neighbor), so that scipy finds a non-zero
+    prominence. This changes chrom['intensity'].
+
     Args:
         signal: DataFrame that contains the signal. Must have columns 'retention_time', 'intensity'
         peaks: DataFrame that contains peaks of the same signal. Must have columns 'retention_time', 'intensity', 'border_left', 'border_right'
@@ -84,41 +242,47 @@ def find_peak_borders(chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
         The found borders are added to 'peaks'. The modified 'peaks' DataFrame is returned.
 
     """
-    widths, _, _, _ = scipy.signal.peak_widths(
-        chrom["intensity"], peaks["index"], rel_height=1.0, wlen=11
-    )
-
-    if len(widths) != len(peaks["index"]):
-        raise AssertionError(
-            f"Error finding peak borders. width: {len(widths)} und peaks: {len(peaks['index'])} are of different length"
-        )
-
-    for i in peaks.index:
-        for k in [-1, 1]:
-            adjust_neighbor(chrom, peaks, i, k)
+    intensity = chrom["intensity"].to_numpy(dtype=np.float64, copy=True)
+    index = peaks["index"].to_numpy(dtype=np.intp)
+    height = peaks["intensity"].to_numpy(dtype=np.float64)
+    # peaks are adjusted one after another: an adjustment can change the neighbor of the next peak
+    for ind, h in zip(index.tolist(), height.tolist()):
+        for k in (-1, 1):
+            _adjust_neighbor_values(intensity, ind, h, k)
+    chrom["intensity"] = intensity
 
     widths, width_heights, left, right = scipy.signal.peak_widths(
-        chrom["intensity"], peaks["index"], rel_height=1.0, wlen=11
+        intensity, index, rel_height=1.0, wlen=11
     )
+    for i in np.flatnonzero(widths == 0):
+        logging.error(
+            f"Width with value 0 at retention time: {peaks['retention_time'].iloc[i]}"
+        )
 
-    for i in peaks.index:
-        if widths[i] == 0:
-            logging.error(
-                f"Width with value 0 at retention time: {peaks['retention_time'].iloc[i]}"
-            )
-
-    left_border = []
-    right_border = []
-    for i in peaks.index:
-        left_border.append(int(np.floor(left[i])))
-        right_border.append(int(np.ceil(right[i])))
     peaks["width"] = widths
     peaks["width_height"] = width_heights
-    peaks["left_border"] = left_border
-    peaks["right_border"] = right_border
+    peaks["left_border"] = np.floor(left).astype(np.int64)
+    peaks["right_border"] = np.ceil(right).astype(np.int64)
     return peaks
 
 
+def _adjust_neighbor_values(
+    intensity: np.ndarray, ind: int, height: float, k: int
+) -> None:
+    """adjust_neighbor on an intensity array"""
+    neighbor_indx = max(0, min(len(intensity) - 1, ind + k))
+    diff = intensity[ind] - intensity[neighbor_indx]
+
+    if diff <= 0.2 * height:
+        if neighbor_indx == 0 or neighbor_indx == len(intensity) - 1:
+            intensity[neighbor_indx] = height / 2
+        else:
+            next_indx = neighbor_indx + k
+            intensity[neighbor_indx] = (
+                intensity[neighbor_indx] + intensity[next_indx]
+            ) / 2
+
+
 def adjust_neighbor(chrom: pd.DataFrame, peaks: pd.DataFrame, i: int, k: int) -> None:
     """Adjusts the intensity of a chromatogram next to a peak for the scipy algorithm to calculate a non-zero prominence"""
     ind = int(peaks.at[i, "index"])
@@ -133,3 +297,28 @@ def adjust_neighbor(chrom: pd.DataFrame, peaks: pd.DataFrame, i: int, k: int) ->
             chrom.at[neighbor_indx, "intensity"] = (
                 chrom.at[neighbor_indx, "intensity"] + chrom.at[next_indx, "intensity"]
             ) / 2
+
+
+def find_peak_clusters(peaks: pd.DataFrame) -> np.ndarray:
+    """Groups peaks with intersecting borders into connected clusters.
+
+    One linear sweep over the peaks sorted by left border: a new cluster starts as soon as a left border lies behind the largest right border seen so far.
+
+    Args:
+        peaks: DataFrame with columns 'left_border', 'right_border'
+
+    Returns:
+        Array with one cluster label per row of 'peaks'. Labels start at 0 and increase with retention time.
+    """
+    left = peaks["left_border"].to_numpy()
+    right = peaks["right_border"].to_numpy()
+    labels = np.zeros(len(peaks), dtype=np.intp)
+    if len(peaks) == 0:
+        return labels
+    order = np.argsort(left, kind="stable")
+    reach = np.maximum.accumulate(right[order])
+    new_cluster = np.empty(len(order), dtype=bool)
+    new_cluster[0] = False
+    new_cluster[1:] = left[order][1:] > reach[:-1]
+    labels[order] = np.cumsum(new_cluster)
+    return labels
@@ -1,10 +1,22 @@
+from dataclasses import dataclass, field
 from pathlib import Path
-from . import DataReader, PeakFinder, Integrator
+from typing import Any
+from . import (
+    DataReader,
+    Filter,
+    PeakFinder,
+    Integrator,
+    Deconvolver,
+    ModelFit,
+    Precision,
+    Profiling,
+    QC,
+    RetentionIndex,
+)
+from .plotting import Overlay
 import logging
 import pandas as pd
-from icecream import ic
 import numpy as np
-import scipy
 
 
 class ChromatogramProcessor:
@@ -13,8 +25,11 @@ class ChromatogramProcessor:
     Fields:
         reader: Data reader of type DataReader.ChromDataReader
         peak_finder: Peak finder of type PeakFinder.ChromPeakFinder
-        filter: Filter of type Processor.ChromFilter
+        filter: Filter of type Filter.ChromFilter, used by apply_filter()
         integrator: Integrator calculates peak area of type Processor.ChromIntegrator
+        deconvolver: Splits overlapping peaks, of type Deconvolver.ChromDeconvolver
+        ri_calibration: Alkane ladder to convert retention times to retention indices, of type RetentionIndex.RiCalibration
+        profiler: If set, every step runs as a stage of this Profiling.StageProfiler
     """
 
     def __init__(self) -> None:
@@ -23,6 +38,9 @@ class ChromatogramProcessor:
         self.peak_finder = None
         self.filter = None
         self.integrator = None
+        self.deconvolver = None
+        self.ri_calibration = None
+        self.profiler = None
         return
 
     def set_reader(self, reader: DataReader.ChromDataReader) -> None:
@@ -34,14 +52,31 @@ class ChromatogramProcessor:
         self.peak_finder = peak_finder
         return
 
+    def set_filter(self, chrom_filter: Filter.ChromFilter) -> None:
+        """Dependency injection of a filter"""
+        self.filter = chrom_filter
+
     def set_integrator(self, integrator: Integrator.ChromIntegrator) -> None:
         self.integrator = integrator
 
+    def set_deconvolver(self, deconvolver: Deconvolver.ChromDeconvolver) -> None:
+        """Dependency injection of a deconvolver for co-eluting peaks"""
+        self.deconvolver = deconvolver
+
+    def set_ri_calibration(self, calibration: RetentionIndex.RiCalibration) -> None:
+        """Dependency injection of the alkane ladder calibration of the instrument and method"""
+        self.ri_calibration = calibration
+
+    def set_profiler(self, profiler: Profiling.StageProfiler | None) -> None:
+        """Dependency injection of a profiler of the steps, None to stop profiling"""
+        self.profiler = profiler
+
     def read_to_df(self, file_path: str | Path) -> None:
         """Using the reader to import chromatogram to df.chromatogram_og"""
 
         if self.reader is not None:
-            self.df.init_chromatogram(self.reader.read_data(file_path))
+            with Profiling.stage(self.profiler, "read"):
+                self.df.init_chromatogram(self.reader.read_data(file_path))
         else:
             logging.error(
                 f"A reader must be set in {self.__class__} using read_to_df()"
@@ -49,12 +84,16 @@ class ChromatogramProcessor:
         return
 
     def find_peaks(self, chrom: pd.DataFrame | None) -> None:
-        """Use dependency to peak finder to find peaks in the chromatogram"""
+        """Use dependency to peak finder to find peaks in the chromatogram. Noise is estimated on df.chromatogram_og"""
         if chrom is None:
             logging.error("Error in Processor.find_peaks(chrom): chrom is None")
             return
+        raw = self.df.chromatogram_og
+        if raw is not None and len(raw) != len(chrom):
+            raw = None
         if self.peak_finder is not None:
-            self.df.peaks = self.peak_finder.find_peaks(chrom)
+            with Profiling.stage(self.profiler, "find_peaks"):
+                self.df.peaks = self.peak_finder.find_peaks(chrom, raw)
         else:
             logging.error("No ChromPeakFinder set, yet")
         return
@@ -69,28 +108,39 @@ class ChromatogramProcessor:
             raise ValueError(
                 f"Error finding peak borders with 'chromatogram': {self.df.chromatogram} and 'peaks': {self.df.peaks}\n Must not be None."
             )
-        self.df.peaks = PeakFinder.find_peak_borders(
-            self.df.chromatogram, self.df.peaks
-        )
+        with Profiling.stage(self.profiler, "find_peak_borders"):
+            # find_peak_borders replaces the intensity column of the copy, the current version is not changed
+            adjusted = self.df.chromatogram.copy(deep=False)
+            self.df.peaks = PeakFinder.find_peak_borders(adjusted, self.df.peaks)
+            intensity = adjusted["intensity"]
+            if self.df.precision == "compact":
+                intensity = intensity.astype(np.float32)
+            self.df.derive("adjust_neighbor", intensity=intensity)
+
+    def deconvolve_peaks(self) -> None:
+        """Split peaks with overlapping borders into non-overlapping integration windows. Run after find_peak_borders()"""
+        if (
+            self.deconvolver is None
+            or self.df.chromatogram is None
+            or self.df.peaks is None
+        ):
+            logging.error(
+                f"Error deconvolving peaks. Check if objects are not initialized: deconvolver: {type(self.deconvolver)}, chromatogram: {type(self.df.chromatogram)}, peaks: {type(self.df.peaks)}"
+            )
+            return
+        with Profiling.stage(self.profiler, "deconvolve"):
+            self.df.peaks = self.deconvolver.deconvolve(
+                self.df.chromatogram, self.df.peaks
+            )
+        return
 
     def create_peak_border_df(self) -> pd.DataFrame:
-        """Create a DataFrame from peak borders to be plotted"""
-        border_rt = []
-        border_intensity = []
+        """Create a DataFrame from peak borders to be plotted (see plotting.Overlay for integration regions)"""
         if self.df.peaks is None or self.df.chromatogram is None:
             raise ValueError(
                 f"Error creating peak border DataFrame for plotting: chrom is {type(self.df.chromatogram)}, peaks is {type(self.df.peaks)}"
             )
-        for i in self.df.peaks.index:
-            m = self.df.chromatogram.iloc[self.df.peaks["left_border"].iloc[i]]
-            n = self.df.chromatogram.iloc[self.df.peaks["right_border"].iloc[i]]
-            border_rt.append(m["retention_time"])
-            border_intensity.append(m["intensity"])
-            border_rt.append(n["retention_time"])
-            border_intensity.append(n["intensity"])
-        return pd.DataFrame(
-            {"retention_time": border_rt, "intensity": border_intensity}
-        )
+        return Overlay.border_points(self.df.chromatogram, self.df.peaks)
 
     def integrate_peak_area(self) -> None:
         """Calculates area beneath peaks and saves areas to df.peaks"""
@@ -103,35 +153,117 @@ class ChromatogramProcessor:
                 f"Error integrating peak area. Check if objects are not initialized: integrator: {type(self.integrator)}, chromatogram: {type(self.df.chromatogram)}, peaks: {type(self.df.peaks)}"
             )
             return
-        self.integrator.integrate(self.df.chromatogram, self.df.peaks)
+        with Profiling.stage(self.profiler, "integrate"):
+            self.integrator.integrate(self.df.chromatogram, self.df.peaks)
         return
 
-    def normalize_integral(self) -> None:
+    def normalize_integral(
+        self,
+        mode: str = "max",
+        reference_rt: float | None = None,
+        rt_tolerance: float | None = None,
+    ) -> None:
+        """Normalizes peak areas to df.peaks['area_norm']. See Integrator.ChromIntegrator.norm_area for modes"""
         if self.integrator is None or self.df.peaks is None:
             logging.error(
                 f"Error integrating peak area. Check if objects are not initialized: integrator: {type(self.integrator)},  peaks: {type(self.df.peaks)}"
             )
             return
-        self.integrator.norm_area(self.df.peaks)
+        with Profiling.stage(self.profiler, "normalize"):
+            self.integrator.norm_area(
+                self.df.peaks,
+                mode=mode,
+                reference_rt=reference_rt,
+                rt_tolerance=rt_tolerance,
+            )
         return
 
-    # HACK:
-    def filter_savgol(self) -> None:
-        """Apply Savgol and replace df.chromatogram"""
-        intensity_filtered = scipy.signal.savgol_filter(
-            self.df.chromatogram["intensity"], 5, 2
-        )
-        self.df.chromatogram["intensity"] = intensity_filtered
+    def calc_retention_index(self) -> None:
+        """Adds the retention index of every peak to df.peaks['ri']"""
+        if self.ri_calibration is None or self.df.peaks is None:
+            logging.error(
+                f"Error calculating retention indices. Check if objects are not initialized: ri_calibration: {type(self.ri_calibration)}, peaks: {type(self.df.peaks)}"
+            )
+            return
+        with Profiling.stage(self.profiler, "retention_index"):
+            RetentionIndex.add_ri(self.df.peaks, self.ri_calibration)
+        return
+
+    def calc_qc(
+        self,
+        saturation: float | None = None,
+        reference_rt: float | None = None,
+        rt_tolerance: float | None = None,
+    ) -> None:
+        """Saves the QC metrics of the run (see QC.run_metrics) to df.qc. Run after integrate_peak_area()"""
+        if self.df.chromatogram_og is None or self.df.peaks is None:
+            logging.error(
+                f"Error calculating QC metrics. Check if objects are not initialized: chromatogram_og: {type(self.df.chromatogram_og)}, peaks: {type(self.df.peaks)}"
+            )
+            return
+        with Profiling.stage(self.profiler, "qc"):
+            self.df.qc = QC.run_metrics(
+                self.df.chromatogram_og,
+                self.df.peaks,
+                saturation=saturation,
+                reference_rt=reference_rt,
+                rt_tolerance=rt_tolerance,
+            )
+
+    def apply_filter(self, chrom_filter: Filter.ChromFilter | None = None) -> None:
+        """Apply chrom_filter (the filter set with set_filter() if None) and replace df.chromatogram with the filtered version. df.chromatogram_og is not changed"""
+        chrom_filter = chrom_filter or self.filter
+        if chrom_filter is None or self.df.chromatogram is None:
+            logging.error(
+                f"Error applying filter. Check if objects are not initialized: filter: {type(chrom_filter)}, chromatogram: {type(self.df.chromatogram)}"
+            )
+            return
+        with Profiling.stage(self.profiler, "filter"):
+            self.df.derive(
+                chrom_filter.name,
+                chrom_filter.params,
+                intensity=chrom_filter.apply(self.df.chromatogram),
+            )
+        self.df.count_filter_iterations += 1
+
+    def filter_savgol(self, window_length: int = 5, polyorder: int = 2) -> None:
+        """Apply Savgol and replace df.chromatogram with the filtered version. df.chromatogram_og is not changed"""
+        self.apply_filter(Filter.SavgolFilter(window_length, polyorder))
+
+
+@dataclass
+class Derivation:
+    """One processing step in the lineage of ChromatogramDF.chromatogram
+
+    Fields:
+        step: Name of the step, e.g. 'savgol'
+        params: Parameters of the step
+        columns: Columns the step replaced
+    """
+
+    step: str
+    params: dict[str, Any] = field(default_factory=dict)
+    columns: tuple[str, ...] = ()
 
 
 class ChromatogramDF:
     """Data class to hold DataFrames of original chromatogram, filtered chrom, peaks with borders, peak_area
 
+    chromatogram_og is read-only. chromatogram starts as a shallow copy of it, and every processing step creates a new
+    version with derive(): replaced columns are allocated, all other columns are read-only views of the previous
+    version, so the versions together need little more memory than the raw data. This does not depend on pandas
+    copy-on-write. Versions are not modified in place: writing into a column raises 'assignment destination is
+    read-only' (with copy-on-write, pandas >= 3, a shared column is copied first). Replace columns instead.
+
     Fields:
-        chromatogram_og: original data as a pd.DataFrame[['index', 'retention_time', 'intensity']]
+        chromatogram_og: original data as a pd.DataFrame[['index', 'retention_time', 'intensity']], read-only
         chromatogram: filtered chromatogram as pd.DataFrame[['index', 'retention_time', 'intensity']]
         peaks: peaks of a chromatogram as pd.DataFrame[['retention_time', 'intensity', 'left_border', 'right_border', 'area']]
         count_filter_iterations: Number of timex how often a filter was applied to chromatogram_filtered
+        lineage: Derivation of every step that created the current chromatogram from chromatogram_og
+        qc: QC metrics of the run, see QC.run_metrics
+        qc_flags: Metrics for which the run is an outlier of its batch, see QC.BatchReference
+        precision: One of Precision.PRECISIONS, see compact()
     """
 
     def __init__(self) -> None:
@@ -140,11 +272,77 @@ class ChromatogramDF:
         self.peaks: pd.DataFrame | None = None
         self.count_filter_iterations: int = 0
         self.post_processed: None | pd.DataFrame = None
+        self.lineage: list[Derivation] = []
+        self.qc: dict[str, float] = {}
+        self.qc_flags: list[str] = []
+        self.precision: str = "double"
         return
 
-    def init_chromatogram(self, df):
-        self.chromatogram_og = df
-        self.chromatogram = df
+    def init_chromatogram(self, df: pd.DataFrame) -> None:
+        """Sets df as read-only chromatogram_og, without copying its data, and chromatogram as its first version"""
+        self.chromatogram_og = _read_only_frame(
+            {c: df[c] for c in df.columns}, df.index
+        )
+        self.chromatogram_og.attrs.update(df.attrs)
+        self.chromatogram = self.chromatogram_og.copy(deep=False)
+        self.count_filter_iterations = 0
+        self.lineage = []
+
+    def compact(self, rt_offset: bool = False) -> None:
+        """Converts chromatogram_og to compact precision (see Precision.compact_chromatogram) and restarts chromatogram from it.
+
+        Call right after reading: versions derived before are dropped. Later versions keep float32 intensities.
+
+        Raises:
+            ValueError: If no chromatogram is initialized.
+        """
+        if self.chromatogram_og is None:
+            raise ValueError("Error compacting chromatogram: chromatogram_og is None")
+        self.init_chromatogram(
+            Precision.compact_chromatogram(self.chromatogram_og, rt_offset)
+        )
+        self.precision = "compact"
+
+    def derive(
+        self,
+        step: str,
+        params: dict[str, Any] | None = None,
+        **columns: np.ndarray | pd.Series,
+    ) -> pd.DataFrame:
+        """Replaces chromatogram with a new version in which the given columns are replaced.
+
+        Args:
+            step: Name of the processing step, recorded in lineage
+            params: Parameters of the step, recorded in lineage
+            columns: New values per column name, e.g. intensity=filtered
+
+        Returns:
+            The new chromatogram
+
+        Raises:
+            ValueError: If no chromatogram is initialized.
+        """
+        if self.chromatogram is None:
+            raise ValueError(f"Error deriving '{step}': chromatogram is None")
+        previous = self.chromatogram
+        self.chromatogram = _read_only_frame(
+            {c: previous[c] for c in previous.columns} | columns, previous.index
+        )
+        self.chromatogram.attrs.update(previous.attrs)
+        self.lineage.append(Derivation(step, dict(params or {}), tuple(columns)))
+        return self.chromatogram
+
+
+def _read_only_frame(
+    columns: dict[str, np.ndarray | pd.Series], index: pd.Index
+) -> pd.DataFrame:
+    """DataFrame of read-only views of the given arrays: one block per column, nothing is copied"""
+    views = {}
+    for c, v in columns.items():
+        a = (v.to_numpy() if isinstance(v, pd.Series) else np.asarray(v)).view()
+        a.flags.writeable = False
+        views[c] = a
+    return pd.DataFrame(views, index=index, copy=False)
 
 
 # TODO:
@@ -186,15 +384,18 @@ def func(x, a1, a2, a3, a4, a5) -> int:
     return a1 * x**4 + a2 * x**3 + a3 * x**2 + a4 * x + a5
 
 
-def fit_model(x, y) -> np.ndarray:
-    """Returns parameters"""
-    rt = x.to_list()
-    intensity = y.to_list()
+def fit_model(x, y, order: int = 4) -> np.ndarray:
+    """Fits a polynomial of given order with a closed-form least squares solve on scaled x (see ModelFit)
 
-    popt, _ = scipy.optimize.curve_fit(func, rt, intensity)
-    return popt
+    Returns:
+        Parameters in descending order of x, e.g. for order 4 the parameters a1..a5 of func
+    """
+    model = ModelFit.fit_polynomial(
+        np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), order
+    )
+    return model.to_power_basis()
 
 
-def calc_predict(x: float, a: np.ndarray) -> int:
-    """Calc intensity with parameter array a"""
-    return func(x, a[0], a[1], a[2], a[3], a[4])
+def calc_predict(x: float | np.ndarray, a: np.ndarray) -> float | np.ndarray:
+    """Calc intensity with parameter array a (descending order, any polynomial order). Works on scalars and arrays"""
+    return np.polyval(a, x)
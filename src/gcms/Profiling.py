@@ -0,0 +1,456 @@
+"""Opt-in profiling of the pipeline per stage and per file.
+
+A StageProfiler is set on a ChromatogramProcessor (set_profiler) or passed to Batch.run_file. Every step of the
+processor (read, filter, find_peaks, ...) and of the batch runner (library_search, write) runs as a stage. Stages
+nest: the time of an inner stage is not counted for the outer one.
+
+Two profilers are available:
+    'sample': SamplingProfiler, a thread that records the Python stack of the profiled thread every few ms. Its
+        overhead is small enough to profile whole batches. Calls into extensions that hold the GIL (e.g. pyopenms'
+        pickChromatogram) cannot be interrupted, their time is attributed to the calling Python frame.
+    'cprofile': CProfileProfiler, exact call counts and times per function with cProfile. Its overhead grows with the
+        number of Python calls (several times slower on pandas-heavy steps), and it only records flat stacks
+        (stage;function by self time).
+
+The FileProfile of every file is aggregated across a batch with write_profiles(): collapsed stacks
+('profile.collapsed', for flamegraph.pl, speedscope and others), a speedscope file with the batch and every file
+('profile.speedscope.json'), the time of every stage per file ('stages.csv') and per function ('functions.csv').
+report() names the slowest files with their stages and the hottest functions.
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass
+import cProfile
+import json
+import pathlib
+import pstats
+import sys
+import threading
+import time
+from types import FrameType
+import pandas as pd
+
+PROFILE_MODES = ("none", "sample", "cprofile")
+FUNCTION_COLUMNS = ["stage", "function", "calls", "self_seconds", "total_seconds"]
+# Stage of the time of a file outside all stages (e.g. fingerprinting), see StageProfiler.result()
+OTHER = "other"
+
+
+@dataclass
+class FileProfile:
+    """Profile of processing one file
+
+    Fields:
+        input_path: Processed file
+        mode: One of PROFILE_MODES
+        seconds: Wall time per stage, in the order the stages were entered, without the time of nested stages
+        stacks: Seconds per collapsed stack 'stage;outermost frame;...;innermost frame'
+        functions: Time per stage and function, with columns FUNCTION_COLUMNS ('calls' is NaN when sampled)
+    """
+
+    input_path: str
+    mode: str
+    seconds: dict[str, float]
+    stacks: dict[str, float]
+    functions: pd.DataFrame
+
+    @property
+    def total(self) -> float:
+        return sum(self.seconds.values())
+
+
+class StageProfiler(ABC):
+    """Interface for profilers of the stages of one file.
+
+    Stages are entered with stage(name) as context managers, from a single thread.
+    """
+
+    mode: str = "none"
+
+    def __init__(self) -> None:
+        self.seconds: dict[str, float] = {}
+        self._stack: list[tuple[str, FrameType | None]] = []
+        self._mark = 0.0
+
+    def stage(self, name: str) -> "_Stage":
+        """Context manager that runs its block as stage name"""
+        return _Stage(self, name)
+
+    def _enter(self, name: str, root: FrameType | None) -> None:
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(now)
+            self._pause(self._stack[-1][0])
+        else:
+            self._start()
+        self._mark = now
+        self._stack.append((name, root))
+        self.seconds.setdefault(name, 0.0)
+        self._resume(name)
+
+    def _exit(self) -> None:
+        now = time.perf_counter()
+        name, _ = self._stack[-1]
+        self._pause(name)
+        self._charge(now)
+        self._stack.pop()
+        self._mark = now
+        if self._stack:
+            self._resume(self._stack[-1][0])
+        else:
+            self._stop()
+
+    def _charge(self, now: float) -> None:
+        self.seconds[self._stack[-1][0]] += now - self._mark
+
+    def _start(self) -> None:
+        """Called when the first stage is entered"""
+        pass
+
+    def _stop(self) -> None:
+        """Called when the last stage is left"""
+        pass
+
+    @abstractmethod
+    def _resume(self, name: str) -> None:
+        """Starts recording stage name"""
+        pass
+
+    @abstractmethod
+    def _pause(self, name: str) -> None:
+        """Stops recording stage name"""
+        pass
+
+    @abstractmethod
+    def _stacks(self) -> dict[str, float]:
+        pass
+
+    @abstractmethod
+    def _functions(self) -> pd.DataFrame:
+        pass
+
+    def result(self, input_path: str, total: float | None = None) -> FileProfile:
+        """Profile of all stages run so far.
+
+        Args:
+            input_path: Processed file
+            total: Wall time of the whole file; time outside all stages is reported as stage OTHER
+        """
+        seconds = dict(self.seconds)
+        if total is not None and total > sum(seconds.values()):
+            seconds[OTHER] = total - sum(seconds.values())
+        return FileProfile(
+            str(input_path), self.mode, seconds, self._stacks(), self._functions()
+        )
+
+
+class _Stage:
+    """Context manager of StageProfiler.stage(), which keeps the frame of the caller as root of sampled stacks"""
+
+    def __init__(self, profiler: StageProfiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.profiler._enter(self.name, sys._getframe(1))
+
+    def __exit__(self, *exc) -> None:
+        self.profiler._exit()
+
+
+class SamplingProfiler(StageProfiler):
+    """Records the stack of the profiled thread every interval seconds.
+
+    Every sample is weighted with the time since the previous one, so samples delayed by the GIL are not lost.
+    Stacks start at the frame that entered the stage.
+
+    Fields:
+        interval: Seconds between samples
+    """
+
+    mode = "sample"
+
+    def __init__(self, interval: float = 0.005) -> None:
+        super().__init__()
+        if interval <= 0:
+            raise ValueError(f"interval must be positive, got {interval}")
+        self.interval = interval
+        self.samples: dict[str, float] = {}
+        self._thread: threading.Thread | None = None
+        self._done = threading.Event()
+        self._target = 0
+
+    def _start(self) -> None:
+        self._target = threading.get_ident()
+        self._done.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="gcms-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def _stop(self) -> None:
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _resume(self, name: str) -> None:
+        pass
+
+    def _pause(self, name: str) -> None:
+        pass
+
+    def _sample(self) -> None:
+        last = time.perf_counter()
+        while not self._done.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self._target)
+            try:
+                name, root = self._stack[-1]
+            except IndexError:
+                break
+            if frame is not None:
+                key = ";".join([name, *_walk(frame, root)])
+                self.samples[key] = self.samples.get(key, 0.0) + now - last
+            last = now
+            del frame
+
+    def _stacks(self) -> dict[str, float]:
+        return dict(self.samples)
+
+    def _functions(self) -> pd.DataFrame:
+        self_time: dict[tuple[str, str], float] = {}
+        total: dict[tuple[str, str], float] = {}
+        for key, seconds in self.samples.items():
+            stage, *frames = key.split(";")
+            if not frames:
+                continue
+            leaf = (stage, frames[-1])
+            self_time[leaf] = self_time.get(leaf, 0.0) + seconds
+            # a recursive function is counted once per sample
+            for f in set(frames):
+                total[(stage, f)] = total.get((stage, f), 0.0) + seconds
+        rows = [
+            (stage, f, float("nan"), self_time.get((stage, f), 0.0), t)
+            for (stage, f), t in total.items()
+        ]
+        return pd.DataFrame(rows, columns=FUNCTION_COLUMNS)
+
+
+class CProfileProfiler(StageProfiler):
+    """Profiles every stage with its own cProfile.Profile. Cannot run while another profiler (e.g. a debugger) is active"""
+
+    mode = "cprofile"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.profiles: dict[str, cProfile.Profile] = {}
+
+    def _resume(self, name: str) -> None:
+        self.profiles.setdefault(name, cProfile.Profile()).enable()
+
+    def _pause(self, name: str) -> None:
+        self.profiles[name].disable()
+
+    def _stats(self):
+        for stage, profile in self.profiles.items():
+            for func, (_, calls, tottime, cumtime, _) in pstats.Stats(
+                profile
+            ).stats.items():
+                yield stage, _function_name(*func), calls, tottime, cumtime
+
+    def _stacks(self) -> dict[str, float]:
+        stacks: dict[str, float] = {}
+        for stage, func, _, tottime, _ in self._stats():
+            if tottime > 0:
+                key = f"{stage};{func}"
+                stacks[key] = stacks.get(key, 0.0) + tottime
+        return stacks
+
+    def _functions(self) -> pd.DataFrame:
+        return pd.DataFrame(list(self._stats()), columns=FUNCTION_COLUMNS)
+
+
+def build_profiler(mode: str) -> StageProfiler | None:
+    """Profiler of a mode in PROFILE_MODES, None for 'none'"""
+    if mode not in PROFILE_MODES:
+        raise ValueError(
+            f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}"
+        )
+    if mode == "sample":
+        return SamplingProfiler()
+    if mode == "cprofile":
+        return CProfileProfiler()
+    return None
+
+
+def stage(profiler: StageProfiler | None, name: str) -> AbstractContextManager:
+    """profiler.stage(name), or a context manager that does nothing if profiler is None"""
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def _walk(frame: FrameType, root: FrameType | None) -> list[str]:
+    """Names of the frames from root (inclusive) to frame, outermost first"""
+    names = []
+    f: FrameType | None = frame
+    while f is not None:
+        code = f.f_code
+        names.append(
+            _function_name(code.co_filename, code.co_firstlineno, code.co_qualname)
+        )
+        if f is root:
+            break
+        f = f.f_back
+    names.reverse()
+    return names
+
+
+def _function_name(file_name: str, line: int, name: str) -> str:
+    name = name.replace(";", ":")
+    if file_name == "~":
+        # built-in functions of cProfile, e.g. "<method 'copy' of 'numpy.ndarray' objects>"
+        return name
+    return f"{name} ({pathlib.PurePath(file_name).name}:{line})"
+
+
+def stage_table(profiles: list[FileProfile]) -> pd.DataFrame:
+    """One row per file with columns 'input_path', 'seconds' (sum of all stages) and the seconds of every stage"""
+    stages = list(dict.fromkeys(s for p in profiles for s in p.seconds))
+    rows = [
+        {
+            "input_path": p.input_path,
+            "seconds": p.total,
+            **{s: p.seconds.get(s, 0.0) for s in stages},
+        }
+        for p in profiles
+    ]
+    return pd.DataFrame(rows, columns=["input_path", "seconds", *stages])
+
+
+def top_files(profiles: list[FileProfile], n: int = 10) -> pd.DataFrame:
+    """The n slowest files of stage_table(), slowest first"""
+    return (
+        stage_table(profiles)
+        .sort_values("seconds", ascending=False, kind="stable")
+        .head(n)
+        .reset_index(drop=True)
+    )
+
+
+def function_table(profiles: list[FileProfile]) -> pd.DataFrame:
+    """Time per stage and function summed over all files, by self time, slowest first"""
+    tables = [p.functions for p in profiles if len(p.functions)]
+    if not tables:
+        return pd.DataFrame(columns=FUNCTION_COLUMNS)
+    return (
+        pd.concat(tables, ignore_index=True)
+        .groupby(["stage", "function"], as_index=False, sort=False)
+        .sum(min_count=1)
+        .sort_values("self_seconds", ascending=False, kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def merge_stacks(profiles: list[FileProfile]) -> dict[str, float]:
+    """Seconds per collapsed stack summed over all files"""
+    stacks: dict[str, float] = {}
+    for p in profiles:
+        for key, seconds in p.stacks.items():
+            stacks[key] = stacks.get(key, 0.0) + seconds
+    return stacks
+
+
+def write_collapsed(
+    stacks: dict[str, float], file_path: str | pathlib.Path
+) -> pathlib.Path:
+    """Writes stacks in the collapsed format 'frame;frame;... weight', weights in microseconds"""
+    path = pathlib.Path(file_path)
+    with open(path, "w") as f:
+        for key, seconds in sorted(stacks.items()):
+            us = round(seconds * 1e6)
+            if us > 0:
+                f.write(f"{key} {us}\n")
+    return path
+
+
+def write_speedscope(
+    profiles: list[FileProfile], file_path: str | pathlib.Path
+) -> pathlib.Path:
+    """Writes a speedscope file (https://www.speedscope.app) with one profile of the whole batch and one per file"""
+    frames: dict[str, int] = {}
+
+    def sampled(name: str, stacks: dict[str, float]) -> dict:
+        samples, weights = [], []
+        for key, seconds in stacks.items():
+            samples.append([frames.setdefault(f, len(frames)) for f in key.split(";")])
+            weights.append(round(seconds * 1e6))
+        return {
+            "type": "sampled",
+            "name": name,
+            "unit": "microseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }
+
+    batch = sampled("batch", merge_stacks(profiles))
+    per_file = [sampled(p.input_path, p.stacks) for p in profiles]
+    document = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": "gcms batch",
+        "exporter": "gcms",
+        "activeProfileIndex": 0,
+        "shared": {"frames": [{"name": f} for f in frames]},
+        "profiles": [batch, *per_file],
+    }
+    path = pathlib.Path(file_path)
+    path.write_text(json.dumps(document))
+    return path
+
+
+def write_profiles(
+    profiles: list[FileProfile], directory: str | pathlib.Path
+) -> list[pathlib.Path]:
+    """Writes the profiles of a batch to directory: 'profile.collapsed', 'profile.speedscope.json', 'stages.csv' and
+    'functions.csv'. Every file is replaced.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    stages = directory / "stages.csv"
+    stage_table(profiles).to_csv(stages, index=False)
+    functions = directory / "functions.csv"
+    function_table(profiles).to_csv(functions, index=False)
+    return [
+        write_collapsed(merge_stacks(profiles), directory / "profile.collapsed"),
+        write_speedscope(profiles, directory / "profile.speedscope.json"),
+        stages,
+        functions,
+    ]
+
+
+def report(profiles: list[FileProfile], n: int = 10) -> str:
+    """Text report of the n slowest files with the seconds of their stages, and the n functions with most self time"""
+    if not profiles:
+        return "No profiles recorded"
+    lines = [f"{min(n, len(profiles))} slowest of {len(profiles)} files:"]
+    for _, row in top_files(profiles, n).iterrows():
+        # stages below 1 % of the file or 5 ms are left out
+        limit = max(0.01 * row["seconds"], 0.005)
+        stages = sorted(
+            ((s, row[s]) for s in row.index[2:] if row[s] >= limit),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        breakdown = ", ".join(f"{s} {t:.2f}" for s, t in stages)
+        lines.append(f"  {row['seconds']:8.2f} s  {row['input_path']}  ({breakdown})")
+    functions = function_table(profiles).head(n)
+    lines.append(f"Top {len(functions)} functions by self time:")
+    for _, row in functions.iterrows():
+        lines.append(
+            f"  {row['self_seconds']:8.2f} s  {row['stage']:18} {row['function']}"
+        )
+    return "\n".join(lines)
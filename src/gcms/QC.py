@@ -0,0 +1,214 @@
+"""Per-run quality control metrics and a rolling batch reference to flag outlier runs."""
+
+from collections import deque
+import numpy as np
+import pandas as pd
+
+QC_METRICS = (
+    "peak_count",
+    "total_area",
+    "median_width",
+    "noise",
+    "saturated_points",
+    "is_rt_drift",
+)
+# Absolute lower bound of the spread of a metric in BatchReference: replicate runs have (nearly) no variance, and a
+# deviation by one peak, one saturated point or a fraction of a second is no outlier
+MIN_SPREAD = {
+    "peak_count": 1.0,
+    "saturated_points": 1.0,
+    "is_rt_drift": 0.1,
+}
+
+
+def run_metrics(
+    chrom: pd.DataFrame,
+    peaks: pd.DataFrame,
+    saturation: float | None = None,
+    reference_rt: float | None = None,
+    rt_tolerance: float | None = None,
+) -> dict[str, float]:
+    """QC metrics of one run, taken from the peak table of the finished pipeline.
+
+    Only the peak table and the border windows of saturated peaks are read, not the whole trace.
+
+    Args:
+        chrom: Raw chromatogram with columns 'intensity' (ChromatogramDF.chromatogram_og)
+        peaks: Peak table with columns 'index', 'retention_time' and, where available, 'area', 'width', 'noise',
+            'left_border', 'right_border'
+        saturation: Detector saturation level. If None, points equal to the highest apex intensity of the run count
+            as saturated if there is more than one (a flat top)
+        reference_rt: Retention time of the internal standard, for 'is_rt_drift'
+        rt_tolerance: Maximum distance of the internal standard peak from reference_rt
+
+    Returns:
+        One value per name in QC_METRICS, NaN where the peak table lacks the columns:
+            peak_count: Number of peaks
+            total_area: Sum of all peak areas
+            median_width: Median peak width in data points
+            noise: Median noise level at the peaks (see Noise.add_snr)
+            saturated_points: Number of data points at or above the saturation level
+            is_rt_drift: Retention time of the internal standard peak minus reference_rt
+    """
+
+    def column(name: str) -> np.ndarray | None:
+        return peaks[name].to_numpy(dtype=np.float64) if name in peaks.columns else None
+
+    area, width, noise = column("area"), column("width"), column("noise")
+    metrics = {
+        "peak_count": float(len(peaks)),
+        "total_area": np.nan if area is None else float(np.nansum(area)),
+        "median_width": np.nan
+        if width is None or len(peaks) == 0
+        else float(np.nanmedian(width)),
+        "noise": np.nan
+        if noise is None or len(peaks) == 0
+        else float(np.nanmedian(noise)),
+        "saturated_points": _saturated_points(chrom, peaks, saturation),
+        "is_rt_drift": np.nan,
+    }
+    if reference_rt is not None and len(peaks):
+        distance = peaks["retention_time"].to_numpy() - reference_rt
+        closest = np.argmin(np.abs(distance))
+        if rt_tolerance is None or abs(distance[closest]) <= rt_tolerance:
+            metrics["is_rt_drift"] = float(distance[closest])
+    return metrics
+
+
+def _saturated_points(
+    chrom: pd.DataFrame, peaks: pd.DataFrame, saturation: float | None
+) -> float:
+    if len(peaks) == 0 or not {"left_border", "right_border"} <= set(peaks.columns):
+        return np.nan
+    intensity = chrom["intensity"].to_numpy()
+    apex = intensity[peaks["index"].to_numpy(dtype=np.intp)]
+    level = apex.max() if saturation is None else saturation
+    clipped = apex >= level
+    left = peaks["left_border"].to_numpy(dtype=np.intp)[clipped]
+    right = peaks["right_border"].to_numpy(dtype=np.intp)[clipped]
+    # data points of all border windows of saturated peaks, each point once
+    lengths = right - left + 1
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    window = np.unique(np.repeat(left, lengths) + offsets)
+    if saturation is not None:
+        return float(np.count_nonzero(intensity[window] >= saturation))
+    # a clipped detector repeats its maximum value exactly
+    n = int(np.count_nonzero(intensity[window] == level))
+    return float(n) if n > 1 else 0.0
+
+
+class RunningStats:
+    """Mean and variance of each metric with Welford's algorithm, updated one run at a time.
+
+    Runs can also be removed again, so the statistics can cover a sliding window. NaN values are ignored per metric.
+
+    Fields:
+        count: Number of values per metric
+        mean: Mean per metric
+        m2: Sum of squared deviations from the mean per metric
+    """
+
+    def __init__(self, n_metrics: int) -> None:
+        self.count = np.zeros(n_metrics)
+        self.mean = np.zeros(n_metrics)
+        self.m2 = np.zeros(n_metrics)
+
+    def add(self, x: np.ndarray) -> None:
+        valid = np.isfinite(x)
+        self.count[valid] += 1
+        delta = np.where(valid, x - self.mean, 0.0)
+        self.mean[valid] += delta[valid] / self.count[valid]
+        self.m2[valid] += delta[valid] * (x[valid] - self.mean[valid])
+
+    def remove(self, x: np.ndarray) -> None:
+        valid = np.isfinite(x) & (self.count > 0)
+        self.count[valid] -= 1
+        empty = valid & (self.count == 0)
+        keep = valid & ~empty
+        delta = np.where(keep, x - self.mean, 0.0)
+        self.mean[keep] -= delta[keep] / self.count[keep]
+        self.m2[keep] -= delta[keep] * (x[keep] - self.mean[keep])
+        self.mean[empty] = 0.0
+        self.m2[empty] = 0.0
+        np.maximum(self.m2, 0.0, out=self.m2)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Sample standard deviation per metric, NaN with fewer than two values"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+
+class BatchReference:
+    """Rolling reference of the QC metrics of the last accepted runs of a batch.
+
+    A run is flagged for a metric if it deviates more than z_limit spreads from the reference mean. The spread is the
+    standard deviation of the reference, but at least rel_spread times the absolute mean and the metric's entry in
+    min_spread: otherwise a reference of identical replicate runs flags every small deviation, and since flagged runs
+    are not added, the reference never adapts to them. Only runs that were not flagged are added to the reference, so
+    bad runs do not shift it.
+
+    Fields:
+        window: Number of runs in the reference
+        min_runs: Runs are not flagged before the reference holds this many runs
+        z_limit: Maximum absolute z-score of a metric
+        metrics: Names of the checked metrics
+        rel_spread: Lower bound of the spread relative to the absolute reference mean
+        min_spread: Absolute lower bound of the spread per metric, 0 for metrics that are not listed
+    """
+
+    def __init__(
+        self,
+        window: int = 50,
+        min_runs: int = 5,
+        z_limit: float = 4.0,
+        metrics: tuple[str, ...] = QC_METRICS,
+        rel_spread: float = 0.05,
+        min_spread: dict[str, float] = MIN_SPREAD,
+    ) -> None:
+        self.window = window
+        self.min_runs = min_runs
+        self.z_limit = z_limit
+        self.metrics = metrics
+        self.rel_spread = rel_spread
+        self.min_spread = np.array([min_spread.get(m, 0.0) for m in metrics])
+        self.stats = RunningStats(len(metrics))
+        self._history: deque[np.ndarray] = deque()
+
+    def _vector(self, metrics: dict[str, float]) -> np.ndarray:
+        return np.array(
+            [metrics.get(m, np.nan) for m in self.metrics], dtype=np.float64
+        )
+
+    def zscores(self, metrics: dict[str, float]) -> dict[str, float]:
+        """z-score of each metric against the reference, NaN where the reference has too few runs"""
+        x = self._vector(metrics)
+        spread = np.fmax(
+            self.stats.std,
+            np.maximum(self.rel_spread * np.abs(self.stats.mean), self.min_spread),
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # a constant reference without a lower bound of its spread flags any deviation
+            z = np.where(
+                spread > 0,
+                (x - self.stats.mean) / spread,
+                np.sign(x - self.stats.mean) * np.inf,
+            )
+            z = np.where(
+                (self.stats.count >= self.min_runs) & np.isfinite(x), z, np.nan
+            )
+        return dict(zip(self.metrics, z.tolist()))
+
+    def check(self, metrics: dict[str, float]) -> list[str]:
+        """Names of the metrics for which the run is an outlier"""
+        return [m for m, z in self.zscores(metrics).items() if abs(z) > self.z_limit]
+
+    def update(self, metrics: dict[str, float]) -> None:
+        """Adds a run to the reference, dropping the oldest run once the window is full"""
+        x = self._vector(metrics)
+        self.stats.add(x)
+        self._history.append(x)
+        if len(self._history) > self.window:
+            self.stats.remove(self._history.popleft())
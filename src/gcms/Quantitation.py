@@ -0,0 +1,425 @@
+"""Concentrations of target compounds from peak areas, with calibration curves fitted on standard runs.
+
+All steps work on a runs x compounds matrix: targets are matched in the combined peak table of all runs (see
+Integrator.concat_runs), the curves of all compounds are fitted in one batched solve (see ModelFit) and applied to
+all runs at once.
+"""
+
+from dataclasses import dataclass
+import hashlib
+import logging
+import pathlib
+import numpy as np
+import pandas as pd
+from . import Export, ModelFit
+
+CURVE_MODELS = {"linear": 1, "quadratic": 2}
+WEIGHTINGS = ("none", "1/x", "1/x2")
+
+
+def read_targets(file_path: str | pathlib.Path) -> pd.DataFrame:
+    """Reads target compounds from a CSV file with the columns 'compound', 'retention_time' and/or 'ri' and optionally 'window'
+
+    Raises:
+        ValueError: If columns are missing.
+    """
+    targets = pd.read_csv(file_path)
+    if "compound" not in targets.columns or not (
+        {"retention_time", "ri"} & set(targets.columns)
+    ):
+        raise ValueError(
+            f"Target file '{file_path}' must have the column 'compound' and 'retention_time' or 'ri'"
+        )
+    return targets
+
+
+def read_standards(file_path: str | pathlib.Path) -> pd.DataFrame:
+    """Reads the concentrations of standard runs from a CSV file with the columns 'run', 'compound', 'concentration'
+
+    Returns:
+        runs x compounds matrix of concentrations, NaN where a compound was not spiked
+
+    Raises:
+        ValueError: If columns are missing.
+    """
+    table = pd.read_csv(file_path)
+    missing = {"run", "compound", "concentration"} - set(table.columns)
+    if missing:
+        raise ValueError(f"Standards file '{file_path}' has no columns {missing}")
+    return table.pivot_table(
+        index="run", columns="compound", values="concentration", aggfunc="mean"
+    )
+
+
+def read_peak_tables(directory: str | pathlib.Path) -> pd.DataFrame:
+    """Reads all peak tables written by Batch.ResultStore into one table with the column 'run' (the run name, see Export.peak_table_files)"""
+    tables = [
+        peaks.assign(run=run) for run, peaks in Export.iter_peak_tables(directory)
+    ]
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
+
+
+def match_targets(
+    peaks: pd.DataFrame,
+    targets: pd.DataFrame,
+    by: str | None = None,
+    window: float = 5.0,
+    value: str = "area",
+    group_by: str = "run",
+) -> pd.DataFrame:
+    """Finds every target compound in every run and returns the value of its peak.
+
+    The peak of a target is the peak of the run closest to the expected position within the window. Peaks are
+    sorted once and the window of each target is located with searchsorted, so only peaks inside a window are
+    compared.
+
+    Args:
+        peaks: Peak table of several runs, with the columns by, value and group_by
+        targets: Target table with the columns 'compound', by and optionally 'window'
+        by: 'retention_time' or 'ri'. None uses 'ri' if both tables have it, else 'retention_time'
+        window: Maximum distance to the expected position, for targets without a 'window'
+        value: Peak column to report, e.g. 'area' or 'area_norm'
+        group_by: Column holding the run name
+
+    Returns:
+        runs x compounds DataFrame of values, NaN where the target was not found
+
+    Raises:
+        ValueError: If columns are missing.
+    """
+    if by is None:
+        by = (
+            "ri"
+            if "ri" in peaks.columns and "ri" in targets.columns
+            else "retention_time"
+        )
+    for table, columns in ((peaks, (by, value, group_by)), (targets, ("compound", by))):
+        missing = set(columns) - set(table.columns)
+        if missing:
+            raise ValueError(f"Error matching targets: no columns {missing}")
+
+    runs_codes, runs = pd.factorize(peaks[group_by], sort=True)
+    position = peaks[by].to_numpy(dtype=np.float64)
+    order = np.argsort(position, kind="stable")
+    sorted_position = position[order]
+
+    expected = targets[by].to_numpy(dtype=np.float64)
+    tolerance = np.full(len(targets), window, dtype=np.float64)
+    if "window" in targets.columns:
+        tolerance = targets["window"].fillna(window).to_numpy(dtype=np.float64)
+    start = np.searchsorted(sorted_position, expected - tolerance, side="left")
+    stop = np.searchsorted(sorted_position, expected + tolerance, side="right")
+
+    # one candidate per (target, peak in its window)
+    counts = np.maximum(stop - start, 0)
+    target = np.repeat(np.arange(len(targets)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    row = order[np.repeat(start, counts) + offsets]
+    run = runs_codes[row]
+    distance = np.abs(position[row] - expected[target])
+
+    # per (target, run) the closest candidate comes first
+    best = np.lexsort((distance, run, target))
+    first = np.ones(len(best), dtype=bool)
+    first[1:] = (np.diff(target[best]) != 0) | (np.diff(run[best]) != 0)
+    best = best[first]
+
+    matrix = np.full((len(runs), len(targets)), np.nan)
+    matrix[run[best], target[best]] = peaks[value].to_numpy(dtype=np.float64)[row[best]]
+    return pd.DataFrame(
+        matrix,
+        index=pd.Index(runs, name=group_by),
+        columns=pd.Index(targets["compound"], name="compound"),
+    )
+
+
+@dataclass
+class CalibrationCurves:
+    """One calibration curve area = f(concentration) per compound.
+
+    Fields:
+        compounds: Compound of each curve
+        coef: Coefficients in descending order of concentration, shape (compounds, order + 1), NaN for compounds
+            without enough standards
+        conc_min: Lowest concentration of the standards per compound
+        conc_max: Highest concentration of the standards per compound
+        r2: Weighted coefficient of determination per compound
+        model: One of CURVE_MODELS
+        weighting: One of WEIGHTINGS
+    """
+
+    compounds: pd.Index
+    coef: np.ndarray
+    conc_min: np.ndarray
+    conc_max: np.ndarray
+    r2: np.ndarray
+    model: str = "linear"
+    weighting: str = "none"
+
+    def response(self, concentration: np.ndarray) -> np.ndarray:
+        """Areas at the concentrations, shape (runs, compounds)"""
+        x = np.asarray(concentration, dtype=np.float64)
+        y = np.zeros(np.broadcast_shapes(x.shape, self.conc_min.shape))
+        for c in self.coef.T:
+            y = y * x + c
+        return y
+
+    def quantify(self, areas: pd.DataFrame) -> pd.DataFrame:
+        """Concentrations of the compounds in all runs at once.
+
+        For quadratic curves the root closest to the calibrated range is used. Concentrations outside of the
+        calibrated range are extrapolated, see in_range().
+
+        Args:
+            areas: runs x compounds matrix of areas (see match_targets); compounds without a curve get NaN
+
+        Returns:
+            runs x compounds matrix of concentrations
+        """
+        i = self.compounds.get_indexer(areas.columns)
+        known = (i >= 0)[:, None]
+        coef = np.where(known, self.coef[i], np.nan)
+        y = areas.to_numpy(dtype=np.float64)
+        if self.model == "linear":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = (y - coef[:, 1]) / coef[:, 0]
+        else:
+            x = _solve_quadratic(
+                coef[:, 0],
+                coef[:, 1],
+                coef[:, 2] - y,
+                self.conc_min[i],
+                self.conc_max[i],
+            )
+        return pd.DataFrame(x, index=areas.index, columns=areas.columns)
+
+    def in_range(self, concentrations: pd.DataFrame) -> pd.DataFrame:
+        """True where a concentration lies within the range of the standards"""
+        i = self.compounds.get_indexer(concentrations.columns)
+        x = concentrations.to_numpy(dtype=np.float64)
+        inside = (i >= 0) & (x >= self.conc_min[i]) & (x <= self.conc_max[i])
+        return pd.DataFrame(
+            inside, index=concentrations.index, columns=concentrations.columns
+        )
+
+    def summary(self) -> pd.DataFrame:
+        """One row per compound with the coefficients, range and r2"""
+        names = [f"c{self.coef.shape[1] - 1 - i}" for i in range(self.coef.shape[1])]
+        return pd.DataFrame(
+            {
+                **dict(zip(names, self.coef.T)),
+                "conc_min": self.conc_min,
+                "conc_max": self.conc_max,
+                "r2": self.r2,
+            },
+            index=self.compounds,
+        )
+
+
+def _solve_quadratic(
+    a: np.ndarray, b: np.ndarray, c: np.ndarray, lo: np.ndarray, hi: np.ndarray
+) -> np.ndarray:
+    """Root of a x^2 + b x + c closest to [lo, hi], per element; c has shape (runs, compounds)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        root = np.sqrt(b**2 - 4 * a * c)
+        q = -0.5 * (b + np.copysign(root, b))
+        # numerically stable pair of roots; for a == 0 the first one is the linear solution -c / b
+        x1 = c / q
+        x2 = np.where(a != 0, q / a, np.nan)
+
+    def distance(x):
+        return np.where(
+            np.isnan(x), np.inf, np.maximum(lo - x, 0) + np.maximum(x - hi, 0)
+        )
+
+    return np.where(distance(x2) < distance(x1), x2, x1)
+
+
+def fit_curves(
+    areas: pd.DataFrame,
+    concentrations: pd.DataFrame,
+    model: str = "linear",
+    weighting: str = "1/x",
+) -> CalibrationCurves:
+    """Fits one calibration curve per compound on the standard runs, all compounds in one batched least squares solve.
+
+    Args:
+        areas: runs x compounds matrix of areas, must contain all standard runs
+        concentrations: standard runs x compounds matrix of concentrations (see read_standards), NaN = not spiked
+        model: One of CURVE_MODELS
+        weighting: One of WEIGHTINGS, weights 1/x or 1/x^2 of the concentration x
+
+    Returns:
+        CalibrationCurves for the compounds of concentrations. Compounds with fewer standards than coefficients get
+        NaN curves
+
+    Raises:
+        ValueError: If model or weighting are unknown or standard runs have no areas.
+    """
+    if model not in CURVE_MODELS:
+        raise ValueError(
+            f"Unknown calibration model '{model}', expected one of {tuple(CURVE_MODELS)}"
+        )
+    if weighting not in WEIGHTINGS:
+        raise ValueError(
+            f"Unknown weighting '{weighting}', expected one of {WEIGHTINGS}"
+        )
+    missing = concentrations.index.difference(areas.index)
+    if len(missing):
+        raise ValueError(
+            f"Error fitting calibration curves: no areas for standard runs {list(missing)}"
+        )
+    order = CURVE_MODELS[model]
+
+    # compounds x standards
+    x = concentrations.to_numpy(dtype=np.float64).T
+    y = areas.reindex(index=concentrations.index, columns=concentrations.columns)
+    y = y.to_numpy(dtype=np.float64).T
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = np.where(valid, x, np.nan), np.where(valid, y, np.nan)
+
+    # blanks (x = 0) get the weight of the lowest spiked level
+    positive = np.where(valid & (x > 0), x, np.nan)
+    with np.errstate(invalid="ignore"):
+        floor = np.nanmin(
+            np.where(np.isnan(positive).all(1)[:, None], 1.0, positive), axis=1
+        )
+    x_w = np.maximum(np.nan_to_num(x, nan=1.0), floor[:, None])
+    weights = {"none": np.ones_like(x_w), "1/x": 1 / x_w, "1/x2": 1 / x_w**2}[weighting]
+
+    n_coef = order + 1
+    fitted = valid.sum(axis=1) >= n_coef
+    coef = np.full((len(x), n_coef), np.nan)
+    r2 = np.full(len(x), np.nan)
+    if fitted.any():
+        batch = ModelFit.fit_polynomial_batch(
+            x[fitted], y[fitted], order, weights[fitted]
+        )
+        coef[fitted] = batch.to_power_basis()
+        w = np.where(valid[fitted], weights[fitted], 0.0)
+        yf = np.nan_to_num(y[fitted])
+        predicted = np.nan_to_num(batch.predict(np.nan_to_num(x[fitted])))
+        mean = (w * yf).sum(1) / w.sum(1)
+        ss_res = (w * (yf - predicted) ** 2).sum(1)
+        ss_tot = (w * (yf - mean[:, None]) ** 2).sum(1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2[fitted] = 1 - ss_res / ss_tot
+    if not fitted.all():
+        logging.warning(
+            f"Too few standards for a {model} calibration of {list(concentrations.columns[~fitted])}"
+        )
+    with np.errstate(invalid="ignore"):
+        conc_min = np.nanmin(np.where(valid, x, np.inf), axis=1)
+        conc_max = np.nanmax(np.where(valid, x, -np.inf), axis=1)
+    return CalibrationCurves(
+        concentrations.columns.copy(), coef, conc_min, conc_max, r2, model, weighting
+    )
+
+
+class CurveCache:
+    """Fitted calibration curves, keyed by a hash of the standards (their areas and concentrations) and the fit settings.
+
+    Curves are only refitted when the standards change; with a directory they are kept across batches.
+
+    Fields:
+        directory: Directory of the cached curves (.npz), None to keep them in memory only
+    """
+
+    def __init__(self, directory: str | pathlib.Path | None = None) -> None:
+        self.directory = None if directory is None else pathlib.Path(directory)
+        self._curves: dict[str, CalibrationCurves] = {}
+
+    @staticmethod
+    def key(
+        areas: pd.DataFrame, concentrations: pd.DataFrame, model: str, weighting: str
+    ) -> str:
+        standards = areas.reindex(
+            index=concentrations.index, columns=concentrations.columns
+        )
+        h = hashlib.blake2b(f"{model}|{weighting}".encode(), digest_size=16)
+        for frame in (concentrations, standards):
+            h.update("\0".join(map(str, frame.index)).encode())
+            h.update("\0".join(map(str, frame.columns)).encode())
+            h.update(np.ascontiguousarray(frame.to_numpy(dtype=np.float64)).tobytes())
+        return h.hexdigest()
+
+    def get_or_fit(
+        self,
+        areas: pd.DataFrame,
+        concentrations: pd.DataFrame,
+        model: str = "linear",
+        weighting: str = "1/x",
+    ) -> CalibrationCurves:
+        """Returns the cached curves of these standards, fitting them with fit_curves() if they are not cached"""
+        key = self.key(areas, concentrations, model, weighting)
+        if key in self._curves:
+            return self._curves[key]
+        path = None if self.directory is None else self.directory / f"{key}.npz"
+        if path is not None and path.is_file():
+            curves = _load_curves(path)
+        else:
+            curves = fit_curves(areas, concentrations, model, weighting)
+            if path is not None:
+                _save_curves(curves, path)
+        self._curves[key] = curves
+        return curves
+
+
+def _save_curves(curves: CalibrationCurves, path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.stem}.tmp.npz")
+    np.savez(
+        tmp,
+        compounds=np.asarray(curves.compounds, dtype=str),
+        coef=curves.coef,
+        conc_min=curves.conc_min,
+        conc_max=curves.conc_max,
+        r2=curves.r2,
+        settings=np.array([curves.model, curves.weighting]),
+    )
+    tmp.replace(path)
+
+
+def _load_curves(path: pathlib.Path) -> CalibrationCurves:
+    with np.load(path) as f:
+        model, weighting = f["settings"]
+        return CalibrationCurves(
+            pd.Index(f["compounds"], name="compound"),
+            f["coef"],
+            f["conc_min"],
+            f["conc_max"],
+            f["r2"],
+            str(model),
+            str(weighting),
+        )
+
+
+def quantify_runs(
+    peaks: pd.DataFrame,
+    targets: pd.DataFrame,
+    standards: pd.DataFrame,
+    model: str = "linear",
+    weighting: str = "1/x",
+    cache: CurveCache | None = None,
+    **match_args,
+) -> tuple[pd.DataFrame, CalibrationCurves]:
+    """Matches targets in all runs, fits (or reuses) the calibration curves on the standards and quantifies all runs.
+
+    Args:
+        peaks: Peak table of several runs (see read_peak_tables, Integrator.concat_runs)
+        targets: Target compounds (see read_targets)
+        standards: Concentrations of the standard runs (see read_standards)
+        model: One of CURVE_MODELS
+        weighting: One of WEIGHTINGS
+        cache: Cache of fitted curves, curves are fitted without caching if None
+        match_args: Passed to match_targets (by, window, value, group_by)
+
+    Returns:
+        runs x compounds matrix of concentrations and the calibration curves
+    """
+    areas = match_targets(peaks, targets, **match_args)
+    cache = cache or CurveCache()
+    curves = cache.get_or_fit(areas, standards, model, weighting)
+    return curves.quantify(areas), curves
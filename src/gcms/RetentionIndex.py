@@ -0,0 +1,321 @@
+"""Retention indices from n-alkane ladders.
+
+A calibration maps retention times to retention indices (100 x carbon number at the n-alkane peaks) of one
+instrument and method. Calibrations are stored as small JSON files, so a batch computes each of them once.
+"""
+
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+import pathlib
+import re
+import numpy as np
+import pandas as pd
+
+RI_MODES = ("linear", "kovats")
+
+
+@dataclass(frozen=True)
+class RiCalibration:
+    """n-alkane retention times of one instrument and method.
+
+    Fields:
+        carbons: Carbon numbers of the alkanes, ascending
+        retention_times: Retention time of each alkane, ascending
+        mode: 'linear' (van den Dool and Kratz, temperature programmed runs) or 'kovats' (logarithmic, isothermal runs)
+        instrument: Name of the instrument
+        method: Name of the GC method
+        source: File the ladder was taken from
+        origin: What the calibration was computed from, see ladder_origin(). Empty if unknown
+    """
+
+    carbons: tuple[int, ...]
+    retention_times: tuple[float, ...]
+    mode: str = "linear"
+    instrument: str = "default"
+    method: str = "default"
+    source: str = ""
+    origin: dict = field(default_factory=dict, hash=False)
+
+    def __post_init__(self) -> None:
+        if self.mode not in RI_MODES:
+            raise ValueError(
+                f"Unknown retention index mode '{self.mode}', expected one of {RI_MODES}"
+            )
+        if len(self.carbons) < 2 or len(self.carbons) != len(self.retention_times):
+            raise ValueError(
+                f"Error creating calibration: need at least 2 alkanes with one retention time each, got {len(self.carbons)} carbons and {len(self.retention_times)} retention times"
+            )
+        if np.any(np.diff(self.carbons) <= 0) or np.any(
+            np.diff(self.retention_times) <= 0
+        ):
+            raise ValueError(
+                "Error creating calibration: carbons and retention times must be strictly ascending"
+            )
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.instrument, self.method)
+
+    def to_ri(self, retention_time: np.ndarray | float) -> np.ndarray:
+        """Converts retention times to retention indices.
+
+        Between two alkanes the index is interpolated linearly in retention time ('linear') or in log retention time
+        ('kovats'); outside of the ladder the first or last segment is extrapolated.
+        """
+        rt = np.asarray(retention_time, dtype=np.float64)
+        ladder = np.asarray(self.retention_times, dtype=np.float64)
+        carbons = np.asarray(self.carbons, dtype=np.float64)
+        if self.mode == "kovats":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rt, ladder = np.log(rt), np.log(ladder)
+        i = np.clip(np.searchsorted(ladder, rt), 1, len(ladder) - 1)
+        fraction = (rt - ladder[i - 1]) / (ladder[i] - ladder[i - 1])
+        return 100 * (carbons[i - 1] + fraction * (carbons[i] - carbons[i - 1]))
+
+    def save(self, file_path: str | pathlib.Path) -> None:
+        path = pathlib.Path(file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, file_path: str | pathlib.Path) -> "RiCalibration":
+        with open(file_path) as f:
+            values = json.load(f)
+        return cls(
+            carbons=tuple(values.pop("carbons")),
+            retention_times=tuple(values.pop("retention_times")),
+            **values,
+        )
+
+    @classmethod
+    def from_table(cls, file_path: str | pathlib.Path, **kwargs) -> "RiCalibration":
+        """Reads a CSV table with the columns 'carbon' and 'retention_time'
+
+        Raises:
+            ValueError: If the columns are missing.
+        """
+        table = pd.read_csv(file_path)
+        if not {"carbon", "retention_time"} <= set(table.columns):
+            raise ValueError(
+                f"Alkane table '{file_path}' must have the columns 'carbon' and 'retention_time'"
+            )
+        table = table.sort_values("retention_time")
+        return cls(
+            tuple(int(c) for c in table["carbon"]),
+            tuple(float(t) for t in table["retention_time"]),
+            **kwargs,
+        )
+
+
+def is_ladder_file(file_path: str | pathlib.Path) -> bool:
+    """True for saved calibrations (.json) and alkane tables (.csv with a 'carbon' column), False for ladder runs"""
+    path = pathlib.Path(file_path)
+    if path.suffix.lower() == ".json":
+        return True
+    if path.suffix.lower() != ".csv":
+        return False
+    return "carbon" in pd.read_csv(path, nrows=0).columns
+
+
+def read_ladder_file(file_path: str | pathlib.Path, **kwargs) -> RiCalibration:
+    """Reads a saved calibration (.json) or an alkane table (.csv). kwargs are passed to RiCalibration.from_table"""
+    if pathlib.Path(file_path).suffix.lower() == ".json":
+        return RiCalibration.load(file_path)
+    return RiCalibration.from_table(file_path, source=str(file_path), **kwargs)
+
+
+# n-alkane names used by spectral libraries, e.g. 'Decane', 'n-Decane', 'Tetracosane'
+_ALKANE_NAMES = {
+    "octane": 8,
+    "nonane": 9,
+    "decane": 10,
+    "undecane": 11,
+    "dodecane": 12,
+    "tridecane": 13,
+    "tetradecane": 14,
+    "pentadecane": 15,
+    "hexadecane": 16,
+    "heptadecane": 17,
+    "octadecane": 18,
+    "nonadecane": 19,
+    "eicosane": 20,
+    "icosane": 20,
+    "heneicosane": 21,
+    "henicosane": 21,
+    "docosane": 22,
+    "tricosane": 23,
+    "tetracosane": 24,
+    "pentacosane": 25,
+    "hexacosane": 26,
+    "heptacosane": 27,
+    "octacosane": 28,
+    "nonacosane": 29,
+    "triacontane": 30,
+    "hentriacontane": 31,
+    "dotriacontane": 32,
+    "tritriacontane": 33,
+    "tetratriacontane": 34,
+    "pentatriacontane": 35,
+    "hexatriacontane": 36,
+    "heptatriacontane": 37,
+    "octatriacontane": 38,
+    "nonatriacontane": 39,
+    "tetracontane": 40,
+}
+
+
+def alkane_carbons(names: pd.Series) -> np.ndarray:
+    """Carbon number of every compound name that is an n-alkane, 0 otherwise"""
+    cleaned = names.fillna("").str.lower().str.replace(r"^n-", "", regex=True)
+    return cleaned.map(_ALKANE_NAMES).fillna(0).to_numpy(dtype=int)
+
+
+def detect_ladder(
+    peaks: pd.DataFrame,
+    first_carbon: int = 8,
+    n_alkanes: int | None = None,
+    min_rel_intensity: float = 0.1,
+    **calibration_args,
+) -> RiCalibration:
+    """Finds the n-alkanes in the peak table of a ladder run.
+
+    If peaks have a 'compound' column (see LibrarySearch.identify), peaks named like n-alkanes are used. Otherwise
+    the alkanes are taken to be the peaks above min_rel_intensity x the highest peak (the n_alkanes most intense of
+    them if given), numbered consecutively from first_carbon in order of retention time. An apex split by noise into
+    neighboring peaks counts as one alkane.
+
+    Args:
+        peaks: Peak table of the ladder run with columns 'retention_time', 'intensity'
+        first_carbon: Carbon number of the first alkane of the ladder
+        n_alkanes: Number of alkanes in the ladder
+        min_rel_intensity: Minimum intensity of an alkane relative to the highest peak
+        calibration_args: Passed to RiCalibration (mode, instrument, method)
+
+    Returns:
+        RiCalibration of the ladder
+
+    Raises:
+        ValueError: If fewer than two alkanes are found.
+    """
+    if "compound" in peaks.columns:
+        carbons = alkane_carbons(peaks["compound"])
+        named = carbons > 0
+        if named.sum() >= 2:
+            table = pd.DataFrame(
+                {
+                    "carbon": carbons[named],
+                    "retention_time": peaks["retention_time"].to_numpy()[named],
+                    "intensity": peaks["intensity"].to_numpy()[named],
+                }
+            )
+            # the most intense peak per name, if a name was assigned twice
+            table = (
+                table.sort_values("intensity", ascending=False)
+                .drop_duplicates("carbon")
+                .sort_values("retention_time")
+            )
+            return RiCalibration(
+                tuple(int(c) for c in table["carbon"]),
+                tuple(float(t) for t in table["retention_time"]),
+                **calibration_args,
+            )
+
+    rt = peaks["retention_time"].to_numpy(dtype=np.float64)
+    intensity = peaks["intensity"].to_numpy(dtype=np.float64)
+    candidates = np.flatnonzero(intensity >= min_rel_intensity * intensity.max())
+    rt, intensity = _merge_split_peaks(rt[candidates], intensity[candidates])
+    if n_alkanes is not None:
+        rt = np.sort(rt[np.argsort(-intensity, kind="stable")[:n_alkanes]])
+    if len(rt) < 2:
+        raise ValueError(
+            f"Error detecting alkane ladder: found {len(rt)} alkane peaks, need at least 2"
+        )
+    gaps = np.diff(rt)
+    if gaps.max() > 3 * np.median(gaps):
+        logging.warning(
+            f"Alkane ladder has an irregular gap of {gaps.max():.1f} (median {np.median(gaps):.1f}); check for a missing alkane"
+        )
+    return RiCalibration(
+        tuple(range(first_carbon, first_carbon + len(rt))),
+        tuple(float(t) for t in rt),
+        **calibration_args,
+    )
+
+
+def _merge_split_peaks(
+    rt: np.ndarray, intensity: np.ndarray, min_gap: float = 0.25
+) -> tuple[np.ndarray, np.ndarray]:
+    """Keeps the most intense of peaks closer than min_gap x the median distance of neighboring peaks
+
+    Returns:
+        Retention times and intensities of the remaining peaks, in order of retention time
+    """
+    order = np.argsort(rt, kind="stable")
+    rt, intensity = rt[order], intensity[order]
+    if len(rt) < 3:
+        return rt, intensity
+    gaps = np.diff(rt)
+    group = np.concatenate(([0], np.cumsum(gaps >= min_gap * np.median(gaps))))
+    # per group, the most intense peak comes first
+    order = np.lexsort((-intensity, group))
+    first = np.concatenate(([True], np.diff(group[order]) > 0))
+    keep = np.sort(order[first])
+    return rt[keep], intensity[keep]
+
+
+class CalibrationCache:
+    """Calibrations per (instrument, method), kept in memory and optionally as JSON files in a directory.
+
+    Fields:
+        directory: Directory of the JSON files, None to keep calibrations in memory only
+    """
+
+    def __init__(self, directory: str | pathlib.Path | None = None) -> None:
+        self.directory = None if directory is None else pathlib.Path(directory)
+        self._calibrations: dict[tuple[str, str], RiCalibration] = {}
+
+    def path_for(self, instrument: str, method: str) -> pathlib.Path | None:
+        if self.directory is None:
+            return None
+        name = re.sub(r"[^\w.-]", "_", f"{instrument}__{method}")
+        return self.directory / f"{name}.ri.json"
+
+    def get(self, instrument: str, method: str) -> RiCalibration | None:
+        key = (instrument, method)
+        if key not in self._calibrations:
+            path = self.path_for(instrument, method)
+            if path is None or not path.is_file():
+                return None
+            self._calibrations[key] = RiCalibration.load(path)
+        return self._calibrations[key]
+
+    def put(self, calibration: RiCalibration) -> None:
+        self._calibrations[calibration.key] = calibration
+        path = self.path_for(*calibration.key)
+        if path is not None:
+            calibration.save(path)
+
+
+def ladder_origin(ladder: str | pathlib.Path, mode: str, first_carbon: int) -> dict:
+    """Identity of a ladder file and the settings a calibration is computed with: a cached calibration with another
+    origin is outdated. The file is identified by path, size and modification time, like LibrarySearch.load_library
+    """
+    path = pathlib.Path(ladder)
+    st = path.stat()
+    return {
+        "path": str(path.resolve()),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "mode": mode,
+        "first_carbon": first_carbon,
+    }
+
+
+def add_ri(peaks: pd.DataFrame, calibration: RiCalibration) -> pd.DataFrame:
+    """Adds the column 'ri' to peaks"""
+    peaks["ri"] = calibration.to_ri(peaks["retention_time"].to_numpy())
+    return peaks
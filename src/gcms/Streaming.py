@@ -0,0 +1,312 @@
+from collections import deque
+from dataclasses import dataclass
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+import scipy
+
+
+@dataclass
+class StreamUpdate:
+    """Results that became final after feeding a chunk.
+
+    Fields:
+        chromatogram: Final data points with columns 'index', 'retention_time', 'intensity' (filtered and neighbor-adjusted, like ChromatogramDF.chromatogram)
+        peaks: Confirmed peaks with columns 'index', 'retention_time', 'intensity', 'width', 'width_height', 'left_border', 'right_border', 'area'
+    """
+
+    chromatogram: pd.DataFrame
+    peaks: pd.DataFrame
+
+
+class StreamingChromProcessor:
+    """Processes a chromatogram while it is acquired.
+
+    Data points are fed in chunks with feed(); finish() flushes the end of the run. Every data point and peak is emitted
+    once, as soon as later data can not change it anymore. Concatenated, the updates equal the batch result of a
+    ChromatogramProcessor with filter_savgol(window_length, polyorder), PeakFinder.LocalMaxChromPeakFinder(order, height),
+    find_peak_borders() and ChromTrapezoidIntegrator (peak borders use wlen=11 like PeakFinder.find_peak_borders).
+
+    Only a fixed number of data points is kept, independent of the run length: the Savitzky-Golay filter looks ahead
+    window_length // 2 points, a peak is confirmed 'order' points later and its borders and area are final wlen // 2 + 2 points after that.
+    Larger feeds are processed in pieces of chunk_size points.
+    """
+
+    WLEN = 11
+
+    def __init__(
+        self,
+        window_length: int = 5,
+        polyorder: int = 2,
+        order: int = 2,
+        height: float = 0.0,
+        chunk_size: int = 4096,
+    ) -> None:
+        self.window_length = window_length
+        self.polyorder = polyorder
+        self.order = order
+        self.height = height
+
+        self._half = window_length // 2
+        self._wlen_half = self.WLEN // 2
+        # adjust_neighbor reads two points next to a peak
+        self._lookahead = max(order, 2)
+        span = window_length + self._lookahead + 2 * self._wlen_half + 4
+        self._buffer = _SampleBuffer(capacity=span + chunk_size)
+        self._max_chunk = chunk_size
+
+        self._n_raw = 0
+        self._n_filtered = 0
+        self._n_checked = 0
+        self._n_emitted = 0
+        self._pending: deque[int] = deque()
+        self._finished = False
+
+    def feed(self, rt: np.ndarray, intensity: np.ndarray) -> StreamUpdate:
+        """Adds data points to the run and returns everything that became final.
+
+        Raises:
+            ValueError: If rt and intensity differ in length or the run is already finished.
+        """
+        if self._finished:
+            raise ValueError("Error feeding data: run is already finished")
+        rt = np.asarray(rt, dtype=np.float64)
+        intensity = np.asarray(intensity, dtype=np.float64)
+        if rt.shape != intensity.shape:
+            raise ValueError(
+                f"Error feeding data: rt {rt.shape} and intensity {intensity.shape} differ in shape"
+            )
+        chroms, peaks = [], []
+        for start in range(0, len(rt), self._max_chunk):
+            stop = start + self._max_chunk
+            self._buffer.append(rt[start:stop], intensity[start:stop])
+            self._n_raw += len(rt[start:stop])
+            chrom, rows = self._advance(final=False)
+            chroms.append(chrom)
+            peaks.extend(rows)
+        return _update(chroms, peaks)
+
+    def finish(self) -> StreamUpdate:
+        """Ends the run and returns the remaining data points and peaks.
+
+        Raises:
+            ValueError: If fewer data points than window_length were fed.
+        """
+        if self._n_raw < self.window_length:
+            raise ValueError(
+                f"Error finishing run: {self._n_raw} data points are fewer than the filter window {self.window_length}"
+            )
+        self._finished = True
+        chrom, peaks = self._advance(final=True)
+        return _update([chrom], peaks)
+
+    def _advance(self, final: bool) -> tuple[np.ndarray, list[tuple]]:
+        self._filter(final)
+        new_peaks = self._check_peaks(final)
+        for q in new_peaks:
+            self._adjust_neighbors(q, final)
+            self._pending.append(q)
+        peaks = self._finish_peaks(final)
+        chrom = self._emit(final)
+        self._discard()
+        return chrom, peaks
+
+    def _filter(self, final: bool) -> None:
+        """Savitzky-Golay filter on all points whose window is complete, evaluated on a slice so the values equal the batch filter"""
+        n, half = self._n_raw, self._half
+        if n < self.window_length:
+            return
+        stop = n if final else n - half
+        if stop <= self._n_filtered:
+            return
+        lo = max(0, self._n_filtered - half)
+        hi = n if final else stop + half
+        lo = min(lo, hi - self.window_length)
+        filtered = scipy.signal.savgol_filter(
+            self._buffer.get("raw", lo, hi), self.window_length, self.polyorder
+        )
+        values = filtered[self._n_filtered - lo : stop - lo]
+        self._buffer.set("filtered", self._n_filtered, values)
+        self._buffer.set("adjusted", self._n_filtered, values)
+        self._n_filtered = stop
+
+    def _check_peaks(self, final: bool) -> np.ndarray:
+        """Strict local maxima like scipy.signal.argrelmax(mode='clip') among all points whose neighbors are filtered"""
+        stop = self._n_filtered if final else self._n_filtered - self._lookahead
+        start = self._n_checked
+        if stop <= start:
+            return np.array([], dtype=np.intp)
+        last = self._n_filtered - 1
+        q = np.arange(start, stop)
+        lo = max(0, start - self.order)
+        y = self._buffer.get("filtered", lo, min(stop + self.order, last + 1))
+        is_peak = np.ones(len(q), dtype=bool)
+        for k in range(1, self.order + 1):
+            for neighbor in (q - k, q + k):
+                # at the last point of a finished run, the clipped neighbor is the point itself
+                neighbor = np.clip(neighbor, 0, last if final else None)
+                is_peak &= y[q - lo] > y[neighbor - lo]
+        is_peak &= y[q - lo] >= self.height
+        self._n_checked = stop
+        return q[is_peak]
+
+    def _adjust_neighbors(self, q: int, final: bool) -> None:
+        """Same as PeakFinder.adjust_neighbor for both sides of the peak at index q"""
+        last = self._n_raw - 1 if final else None
+        peak_intensity = self._buffer.get("filtered", q, q + 1)[0]
+        for k in (-1, 1):
+            neighbor = max(0, q + k)
+            if last is not None:
+                neighbor = min(last, neighbor)
+            adjusted = self._buffer.get("adjusted", q, q + 1)[0]
+            neighbor_value = self._buffer.get("adjusted", neighbor, neighbor + 1)[0]
+            if adjusted - neighbor_value <= 0.2 * peak_intensity:
+                if neighbor == 0 or neighbor == last:
+                    value = peak_intensity / 2
+                else:
+                    next_value = self._buffer.get(
+                        "adjusted", neighbor + k, neighbor + k + 1
+                    )[0]
+                    value = (neighbor_value + next_value) / 2
+                self._buffer.set("adjusted", neighbor, np.array([value]))
+
+    def _final_stop(self, final: bool) -> int:
+        """Adjusted values before this index can not change anymore"""
+        return self._n_filtered if final else max(0, self._n_checked - 1)
+
+    def _finish_peaks(self, final: bool) -> list[tuple]:
+        """Borders and areas of pending peaks whose window of +-wlen // 2 points is final"""
+        final_stop = self._final_stop(final)
+        rows = []
+        while self._pending and (
+            final or self._pending[0] + self._wlen_half < final_stop
+        ):
+            q = self._pending.popleft()
+            lo = max(0, q - self._wlen_half)
+            hi = min(q + self._wlen_half + 1, final_stop)
+            y = self._buffer.get("adjusted", lo, hi)
+            with warnings.catch_warnings():
+                # zero widths are logged below, once per peak
+                warnings.simplefilter("ignore")
+                widths, width_heights, left, right = scipy.signal.peak_widths(
+                    y, [q - lo], rel_height=1.0, wlen=self.WLEN
+                )
+            rt = self._buffer.get("rt", q, q + 1)[0]
+            if widths[0] == 0:
+                logging.error(f"Width with value 0 at retention time: {rt}")
+            left_border = int(np.floor(left[0])) + lo
+            right_border = int(np.ceil(right[0])) + lo
+            area = scipy.integrate.trapezoid(
+                self._buffer.get("adjusted", left_border, right_border + 1)
+            )
+            rows.append(
+                (
+                    q,
+                    rt,
+                    self._buffer.get("filtered", q, q + 1)[0],
+                    widths[0],
+                    width_heights[0],
+                    left_border,
+                    right_border,
+                    area,
+                )
+            )
+        return rows
+
+    def _emit(self, final: bool) -> np.ndarray:
+        """Final data points as rows of index, retention time and intensity"""
+        start, stop = self._n_emitted, self._final_stop(final)
+        if final:
+            stop = self._n_filtered
+        self._n_emitted = max(start, stop)
+        if stop <= start:
+            return np.empty((0, 3))
+        return np.column_stack(
+            (
+                np.arange(start, stop),
+                self._buffer.get("rt", start, stop),
+                self._buffer.get("adjusted", start, stop),
+            )
+        )
+
+    def _discard(self) -> None:
+        keep = min(
+            self._n_filtered - self.window_length,
+            # the next peak may be at n_checked and needs wlen // 2 points before it
+            self._n_checked - max(self._lookahead + 1, self._wlen_half),
+            self._n_emitted,
+        )
+        if self._pending:
+            keep = min(keep, self._pending[0] - self._wlen_half)
+        self._buffer.discard_before(max(0, keep))
+
+
+PEAK_COLUMNS = [
+    "index",
+    "retention_time",
+    "intensity",
+    "width",
+    "width_height",
+    "left_border",
+    "right_border",
+    "area",
+]
+CHROMATOGRAM_COLUMNS = ["index", "retention_time", "intensity"]
+
+
+class _SampleBuffer:
+    """Fixed-size buffer of the most recent data points, addressed by their absolute index in the run.
+
+    Holds the columns 'rt', 'raw', 'filtered' and 'adjusted'. Data points before the index given to discard_before() are
+    dropped; the remaining points are moved to the front when new data would not fit.
+    """
+
+    COLUMNS = ("rt", "raw", "filtered", "adjusted")
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._data = {c: np.empty(capacity) for c in self.COLUMNS}
+        self._base = 0
+        self._offset = 0
+        self._size = 0
+
+    def append(self, rt: np.ndarray, raw: np.ndarray) -> None:
+        if self._offset + self._size + len(rt) > self.capacity:
+            self._compact()
+        if self._size + len(rt) > self.capacity:
+            raise ValueError(
+                f"Error buffering data: {self._size + len(rt)} data points exceed the capacity {self.capacity}"
+            )
+        stop = self._offset + self._size
+        self._data["rt"][stop : stop + len(rt)] = rt
+        self._data["raw"][stop : stop + len(rt)] = raw
+        self._size += len(rt)
+
+    def get(self, column: str, start: int, stop: int) -> np.ndarray:
+        if start < self._base or stop > self._base + self._size:
+            raise IndexError(
+                f"Data points {start}:{stop} are not buffered ({self._base}:{self._base + self._size})"
+            )
+        i = start - self._base + self._offset
+        return self._data[column][i : i + stop - start]
+
+    def set(self, column: str, start: int, values: np.ndarray) -> None:
+        self.get(column, start, start + len(values))[:] = values
+
+    def discard_before(self, index: int) -> None:
+        drop = min(max(0, index - self._base), self._size)
+        self._base += drop
+        self._offset += drop
+        self._size -= drop
+
+    def _compact(self) -> None:
+        for a in self._data.values():
+            a[: self._size] = a[self._offset : self._offset + self._size]
+        self._offset = 0
+
+
+def _update(chroms: list[np.ndarray], peaks: list[tuple]) -> StreamUpdate:
+    chrom = pd.DataFrame(np.concatenate(chroms), columns=CHROMATOGRAM_COLUMNS)
+    chrom["index"] = chrom["index"].astype(np.int64)
+    return StreamUpdate(chrom, pd.DataFrame(peaks, columns=PEAK_COLUMNS))
@@ -0,0 +1,209 @@
+"""Passes chromatogram DataFrames between processes through shared memory instead of pickling them.
+
+The owning process copies the columns of a DataFrame once into a shared memory block and sends only a small
+FrameHandle to workers. Workers attach to the block and get a DataFrame whose columns are read-only views into it.
+Only columns and DataFrame.attrs are passed on, the attached DataFrame has a RangeIndex.
+"""
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+import logging
+import weakref
+import numpy as np
+import pandas as pd
+
+# Column offsets are aligned so every column view is aligned for its dtype
+_ALIGNMENT = 64
+
+
+@dataclass(frozen=True)
+class FrameHandle:
+    """Picklable reference to a DataFrame in a shared memory block.
+
+    Fields:
+        name: Name of the shared memory block
+        n_rows: Number of rows
+        columns: (column name, dtype string, byte offset) per column
+        attrs: Items of DataFrame.attrs, e.g. the retention time base of a compact chromatogram (see Precision)
+    """
+
+    name: str
+    n_rows: int
+    columns: tuple[tuple[str, str, int], ...]
+    attrs: tuple[tuple[str, object], ...] = ()
+
+
+def _layout(df: pd.DataFrame) -> tuple[tuple[tuple[str, str, int], ...], int]:
+    """Column offsets and total size in bytes of a DataFrame in a shared memory block
+
+    Raises:
+        ValueError: If a column does not have a numeric or boolean dtype.
+    """
+    columns = []
+    size = 0
+    for c in df.columns:
+        dtype = df[c].dtype
+        if not isinstance(dtype, np.dtype) or dtype.kind not in "biuf":
+            raise ValueError(
+                f"Error sharing DataFrame: column '{c}' has dtype {dtype}, only numeric and boolean columns can be shared"
+            )
+        size = -(-size // _ALIGNMENT) * _ALIGNMENT
+        columns.append((str(c), dtype.str, size))
+        size += dtype.itemsize * len(df)
+    return tuple(columns), size
+
+
+def _views(
+    buf: memoryview, handle: FrameHandle, writeable: bool
+) -> dict[str, np.ndarray]:
+    views = {}
+    for c, dtype, offset in handle.columns:
+        a = np.ndarray((handle.n_rows,), dtype=dtype, buffer=buf, offset=offset)
+        a.flags.writeable = writeable
+        views[c] = a
+    return views
+
+
+class SharedFrameStore:
+    """Owner of shared memory blocks. Blocks live until they are released or the store is closed.
+
+    Use as a context manager, so the blocks are removed even if processing fails:
+
+        with SharedFrameStore() as store:
+            handle = store.share(df)
+            pool.submit(worker, handle)
+
+    Blocks that are still open when the store is garbage collected are removed as well.
+    """
+
+    def __init__(self) -> None:
+        self._blocks: dict[str, shared_memory.SharedMemory] = {}
+        self._finalizer = weakref.finalize(self, _unlink_all, self._blocks)
+
+    def __enter__(self) -> "SharedFrameStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def share(self, df: pd.DataFrame) -> FrameHandle:
+        """Copies the columns of df into a new shared memory block.
+
+        Raises:
+            ValueError: If a column is not numeric or boolean.
+        """
+        block, handle = _create_block(df)
+        self._blocks[block.name] = block
+        return handle
+
+    def release(self, handle: FrameHandle) -> None:
+        """Removes the block of handle. Workers must not attach to it afterwards"""
+        block = self._blocks.pop(handle.name, None)
+        if block is None:
+            logging.error(
+                f"Shared memory block '{handle.name}' is not owned by this store"
+            )
+            return
+        _unlink(block)
+
+    def close(self) -> None:
+        """Removes all blocks of this store"""
+        _unlink_all(self._blocks)
+
+
+def _create_block(df: pd.DataFrame) -> tuple[shared_memory.SharedMemory, FrameHandle]:
+    columns, size = _layout(df)
+    # zero sized blocks can not be created
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    handle = FrameHandle(block.name, len(df), columns, tuple(df.attrs.items()))
+    views = _views(block.buf, handle, writeable=True)
+    for c in df.columns:
+        views[str(c)][:] = df[c].to_numpy()
+    del views
+    return block, handle
+
+
+def hand_over(df: pd.DataFrame) -> FrameHandle:
+    """Shares df in a block that is owned by whoever calls collect() with the returned handle.
+
+    Workers return results this way, the calling process collects them.
+    """
+    block, handle = _create_block(df)
+    block.close()
+    return handle
+
+
+def _unlink(block: shared_memory.SharedMemory) -> None:
+    try:
+        block.close()
+    except BufferError:
+        # views into the block are still alive in this process, the mapping is released with them
+        pass
+    block.unlink()
+
+
+def _unlink_all(blocks: dict[str, shared_memory.SharedMemory]) -> None:
+    while blocks:
+        _unlink(blocks.popitem()[1])
+
+
+class AttachedFrame:
+    """A DataFrame backed by a shared memory block of another process.
+
+    The DataFrame's columns are read-only views into the block, so nothing is copied and the block is never changed.
+    Writing into a column raises 'assignment destination is read-only' without pandas copy-on-write (pandas < 3);
+    with copy-on-write (pandas >= 3) the column is copied first. Replacing a column (df[c] = ...) works with both.
+    Use as a context manager or call close() when the DataFrame is no longer needed; copy the DataFrame to keep it
+    longer.
+
+    Fields:
+        df: The attached DataFrame
+    """
+
+    def __init__(self, handle: FrameHandle) -> None:
+        self._block = shared_memory.SharedMemory(name=handle.name)
+        # df is a shallow copy of _base: while _base is alive, pandas copy-on-write sees the columns as shared and copies
+        # them on write instead of writing into the read-only views
+        self._base = pd.DataFrame(
+            _views(self._block.buf, handle, writeable=False), copy=False
+        )
+        self._base.attrs.update(handle.attrs)
+        self.df = self._base.copy(deep=False)
+
+    def __enter__(self) -> pd.DataFrame:
+        return self.df
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.df = None
+        self._base = None
+        try:
+            self._block.close()
+        except BufferError:
+            logging.error(
+                f"Shared memory block '{self._block.name}' is still referenced, it is unmapped when the references are gone"
+            )
+
+
+def attach(handle: FrameHandle) -> AttachedFrame:
+    """Attaches to a shared DataFrame without copying it"""
+    return AttachedFrame(handle)
+
+
+def read_frame(handle: FrameHandle) -> pd.DataFrame:
+    """Returns a private copy of a shared DataFrame"""
+    with attach(handle) as df:
+        return df.copy(deep=True)
+
+
+def collect(handle: FrameHandle) -> pd.DataFrame:
+    """Takes ownership of a block from hand_over(): returns a private copy and removes the block"""
+    df = read_frame(handle)
+    block = shared_memory.SharedMemory(name=handle.name)
+    _unlink(block)
+    return df
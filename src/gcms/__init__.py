@@ -1,5 +1,44 @@
+import importlib
+
 __all__ = ["Processor", "DataReader", "PeakFinder"]
 
-from . import Processor
-from . import DataReader
-from . import PeakFinder
+# Submodules are imported on first attribute access, so 'import gcms' stays cheap
+# and e.g. the command line interface does not load pyopenms before it is needed.
+_SUBMODULES = {
+    "Batch",
+    "Chunked",
+    "Comparison",
+    "DataReader",
+    "Deconvolver",
+    "Export",
+    "Filter",
+    "Incremental",
+    "Ingestion",
+    "Integrator",
+    "LibrarySearch",
+    "ModelFit",
+    "Noise",
+    "PeakFinder",
+    "Precision",
+    "Processor",
+    "Profiling",
+    "QC",
+    "Quantitation",
+    "RetentionIndex",
+    "Streaming",
+    "Transport",
+    "cli",
+    "plotting",
+    "pyopenms_client",
+    "readfile",
+}
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | _SUBMODULES)
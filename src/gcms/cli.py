@@ -0,0 +1,479 @@
+"""Command line interface of gcms.
+
+Only the standard library is imported at module level, so 'gcms --help' returns immediately.
+The processing pipeline (pandas, scipy, pyopenms) is imported when a command runs.
+"""
+
+import argparse
+import dataclasses
+import logging
+import sys
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "-v", "--verbose", action="store_true", help="Log progress of every file."
+    )
+    parser = argparse.ArgumentParser(
+        prog="gcms", description="Process GC-MS chromatograms in batches."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument(
+        "-o",
+        "--output-dir",
+        default="gcms_results",
+        help="Directory for the peak tables (default: %(default)s).",
+    )
+    output.add_argument(
+        "-f",
+        "--format",
+        choices=("csv", "parquet"),
+        default="csv",
+        help="Output format of the peak tables (default: %(default)s).",
+    )
+    output.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes (default: %(default)s).",
+    )
+    output.add_argument(
+        "-c", "--config", help="TOML or JSON file with pipeline parameters."
+    )
+    output.add_argument(
+        "--mzml",
+        action="store_true",
+        help="Also write the filtered chromatogram and peaks of every run to '<name>.processed.mzML' (zlib-compressed).",
+    )
+    output.add_argument(
+        "--numpress",
+        choices=("none", "linear", "slof", "pic"),
+        default="none",
+        help="Numpress encoding of the mzML arrays; 'slof' and 'pic' are lossy (default: %(default)s).",
+    )
+    output.add_argument(
+        "--input-root",
+        help="Name the outputs of each input by its path relative to this directory, e.g. 'night1__run01' for 'night1/run01.csv' (default: the root recorded in the output directory by an earlier run, else the deepest directory that contains all inputs). A root that differs from the recorded one is rejected.",
+    )
+
+    run = commands.add_parser(
+        "run",
+        parents=[common, output],
+        help="Run the processing pipeline over files or directories.",
+        description="Read, filter, find peaks, integrate and normalize each input file and write one peak table per file.",
+    )
+    run.add_argument(
+        "inputs", nargs="+", help="Input files or directories (searched recursively)."
+    )
+    run.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip inputs whose peak table already exists in the output directory.",
+    )
+    run.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the peak tables of inputs that are unchanged since they were processed with the same configuration and code.",
+    )
+    run.add_argument(
+        "--chunk-size",
+        type=int,
+        help="Process each trace out of core in chunks of this many data points (for very long runs).",
+    )
+    run.add_argument(
+        "--profile",
+        choices=("sample", "cprofile"),
+        help="Profile every file per pipeline stage and write flame graphs and tables to '<output-dir>/profile'.",
+    )
+    run.add_argument(
+        "--profile-top",
+        type=int,
+        default=10,
+        help="Number of slowest files and hottest functions in the profile report (default: %(default)s).",
+    )
+    run.set_defaults(handler=_run)
+
+    watch = commands.add_parser(
+        "watch",
+        parents=[common, output],
+        help="Process files as they land in a directory.",
+        description="Watch a directory and write a peak table for every completely written input file until interrupted.",
+    )
+    watch.add_argument("directory", help="Watched directory (searched recursively).")
+    watch.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between directory scans (default: %(default)s).",
+    )
+    watch.add_argument(
+        "--settle-time",
+        type=float,
+        default=2.0,
+        help="Seconds a file must stay unchanged before it is processed (default: %(default)s).",
+    )
+    watch.add_argument(
+        "--max-queue",
+        type=int,
+        default=64,
+        help="Maximum number of files waiting for a worker (default: %(default)s).",
+    )
+    watch.add_argument(
+        "--reprocess",
+        action="store_true",
+        help="Also process files whose peak table is already up to date.",
+    )
+    watch.set_defaults(handler=_watch)
+
+    thumbnails = commands.add_parser(
+        "thumbnails",
+        parents=[common],
+        help="Render overview images of chromatograms.",
+        description="Render one small PNG overview per input file, e.g. for QC reports.",
+    )
+    thumbnails.add_argument(
+        "inputs", nargs="+", help="Input files or directories (searched recursively)."
+    )
+    thumbnails.add_argument(
+        "-o",
+        "--output-dir",
+        default="gcms_thumbnails",
+        help="Directory for the images (default: %(default)s).",
+    )
+    thumbnails.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes (default: %(default)s).",
+    )
+    thumbnails.add_argument(
+        "--dpi", type=int, default=100, help="Resolution (default: %(default)s)."
+    )
+    thumbnails.set_defaults(handler=_thumbnails)
+
+    quantify = commands.add_parser(
+        "quantify",
+        parents=[common],
+        help="Quantify target compounds in processed runs.",
+        description="Match target compounds in the peak tables of a results directory, fit calibration curves on the standard runs and write a runs x compounds table of concentrations.",
+    )
+    quantify.add_argument(
+        "results_dir", help="Directory with the peak tables written by 'gcms run'."
+    )
+    quantify.add_argument(
+        "--targets",
+        required=True,
+        help="CSV with the columns 'compound', 'retention_time' or 'ri' and optionally 'window'.",
+    )
+    quantify.add_argument(
+        "--standards",
+        required=True,
+        help="CSV with the columns 'run', 'compound', 'concentration' of the standard runs.",
+    )
+    quantify.add_argument(
+        "-o",
+        "--output",
+        default="concentrations.csv",
+        help="Output CSV (default: %(default)s).",
+    )
+    quantify.add_argument(
+        "--model",
+        choices=("linear", "quadratic"),
+        default="linear",
+        help="Calibration curve (default: %(default)s).",
+    )
+    quantify.add_argument(
+        "--weighting",
+        choices=("none", "1/x", "1/x2"),
+        default="1/x",
+        help="Weights of the standards (default: %(default)s).",
+    )
+    quantify.add_argument(
+        "--window",
+        type=float,
+        default=5.0,
+        help="Match window for targets without a 'window' column (default: %(default)s).",
+    )
+    quantify.add_argument(
+        "--value",
+        default="area",
+        help="Peak column to calibrate, e.g. area_norm (default: %(default)s).",
+    )
+    quantify.add_argument(
+        "--cache-dir",
+        help="Directory for fitted curves, reused while the standards do not change.",
+    )
+    quantify.set_defaults(handler=_quantify)
+
+    compare = commands.add_parser(
+        "compare",
+        parents=[common, output],
+        help="Compare sample runs with blank or reference runs.",
+        description="Process every run of the pairs once (incremental), then compare each sample with its reference on a common retention time grid and report peaks unique to or enriched in one run.",
+    )
+    compare.add_argument(
+        "pairs",
+        help="CSV with the columns 'sample' and 'reference' (paths relative to the CSV).",
+    )
+    compare.add_argument(
+        "--align",
+        choices=("none", "shift"),
+        default="none",
+        help="Shift the reference onto the sample by cross-correlation (default: %(default)s).",
+    )
+    compare.add_argument(
+        "--max-shift",
+        type=float,
+        default=10.0,
+        help="Largest retention time shift for --align shift (default: %(default)s).",
+    )
+    compare.add_argument(
+        "--rt-tolerance",
+        type=float,
+        default=2.0,
+        help="Largest retention time distance of matched peaks (default: %(default)s).",
+    )
+    compare.add_argument(
+        "--min-ratio",
+        type=float,
+        default=2.0,
+        help="Ratio of matched peaks from which a peak is enriched (default: %(default)s).",
+    )
+    compare.add_argument(
+        "--value",
+        default="area",
+        help="Peak column to compare, e.g. area_norm (default: %(default)s).",
+    )
+    compare.add_argument(
+        "--traces",
+        action="store_true",
+        help="Also write the difference, ratio and correlation traces.",
+    )
+    compare.set_defaults(handler=_compare)
+
+    export = commands.add_parser(
+        "export",
+        parents=[common],
+        help="Combine the peak tables of a results directory into one file.",
+        description="Stream all peak tables written by 'gcms run' into one CSV or Parquet file with the column 'run'.",
+    )
+    export.add_argument(
+        "results_dir", help="Directory with the peak tables written by 'gcms run'."
+    )
+    export.add_argument(
+        "-o",
+        "--output",
+        default="peaks.csv",
+        help="Output file, .csv or .parquet (default: %(default)s).",
+    )
+    export.set_defaults(handler=_export)
+    return parser
+
+
+def _check_output_args(args: argparse.Namespace) -> bool:
+    if args.jobs < 1:
+        logging.error(f"--jobs must be at least 1, got {args.jobs}")
+        return False
+    if args.format == "parquet":
+        import importlib.util
+
+        if importlib.util.find_spec("pyarrow") is None:
+            logging.error("Output format 'parquet' requires the package 'pyarrow'")
+            return False
+    return True
+
+
+def _result_store(args: argparse.Namespace, inputs: list):
+    from . import Batch, Export
+
+    mzml = Export.MzmlOptions(numpress=args.numpress) if args.mzml else None
+    store = Batch.ResultStore(args.output_dir, args.format, mzml, args.input_root)
+    if args.input_root is None:
+        # later batches into the same directory keep the root of the first one, if it contains their inputs
+        recorded, root = store.recorded_input_root()
+        default = Batch.input_root(inputs)
+        if recorded and (
+            root is None or default is None or default.is_relative_to(root)
+        ):
+            store.input_root = root
+        else:
+            store.input_root = default
+    return store
+
+
+def _run(args: argparse.Namespace) -> int:
+    from . import Batch
+
+    if not _check_output_args(args):
+        return 2
+
+    config = Batch.load_config(args.config) if args.config else Batch.PipelineConfig()
+    if args.chunk_size is not None:
+        config = dataclasses.replace(config, chunk_size=args.chunk_size)
+    inputs = Batch.collect_inputs(args.inputs)
+    store = _result_store(args, args.inputs)
+    summary = Batch.run_batch(
+        inputs,
+        config,
+        store,
+        jobs=args.jobs,
+        resume=args.resume,
+        incremental=args.incremental,
+        profile=args.profile or "none",
+    )
+
+    for r in summary.results:
+        logging.info(
+            f"{r.status:8} {r.input_path} ({r.n_peaks} peaks, {r.seconds:.2f} s)"
+        )
+    print(
+        f"{len(summary.results)} files: {summary.count('done')} done, {summary.count('reused')} reused, {summary.count('skipped')} skipped, {summary.count('failed')} failed, {len(summary.flagged())} QC outliers"
+    )
+    if args.profile:
+        from . import Profiling
+
+        print(Profiling.report(summary.profiles(), args.profile_top))
+        print(f"Profiles written to '{store.profile_dir}'")
+    return 1 if summary.count("failed") else 0
+
+
+def _watch(args: argparse.Namespace) -> int:
+    import asyncio
+    import signal
+    from . import Batch, Ingestion
+
+    if not _check_output_args(args):
+        return 2
+
+    config = Batch.load_config(args.config) if args.config else Batch.PipelineConfig()
+    service = Ingestion.IngestionService(
+        args.directory,
+        config,
+        _result_store(args, [args.directory]),
+        jobs=args.jobs,
+        poll_interval=args.poll_interval,
+        settle_time=args.settle_time,
+        max_queue=args.max_queue,
+        resume=not args.reprocess,
+    )
+
+    async def serve() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await service.run(stop)
+
+    asyncio.run(serve())
+    stats = service.stats.snapshot()
+    print(
+        f"{stats['done'] + stats['failed']} files: {stats['done']} done, {stats['failed']} failed"
+    )
+    return 1 if stats["failed"] else 0
+
+
+def _thumbnails(args: argparse.Namespace) -> int:
+    from . import Batch
+    from .plotting import FastPlotting
+
+    if args.jobs < 1:
+        logging.error(f"--jobs must be at least 1, got {args.jobs}")
+        return 2
+    inputs = Batch.collect_inputs(args.inputs)
+    written = FastPlotting.render_thumbnails(
+        inputs,
+        args.output_dir,
+        jobs=args.jobs,
+        dpi=args.dpi,
+        input_root=Batch.input_root(args.inputs),
+    )
+    print(f"{len(written)} of {len(inputs)} thumbnails written to {args.output_dir}")
+    return 0 if len(written) == len(inputs) else 1
+
+
+def _quantify(args: argparse.Namespace) -> int:
+    import pathlib
+    from . import Quantitation
+
+    peaks = Quantitation.read_peak_tables(args.results_dir)
+    if peaks.empty:
+        logging.error(f"No peak tables found in '{args.results_dir}'")
+        return 2
+    concentrations, curves = Quantitation.quantify_runs(
+        peaks,
+        Quantitation.read_targets(args.targets),
+        Quantitation.read_standards(args.standards),
+        model=args.model,
+        weighting=args.weighting,
+        cache=Quantitation.CurveCache(args.cache_dir),
+        window=args.window,
+        value=args.value,
+    )
+    output = pathlib.Path(args.output)
+    concentrations.to_csv(output)
+    curves.summary().to_csv(output.with_name(f"{output.stem}.curves.csv"))
+    print(
+        f"{concentrations.shape[1]} compounds quantified in {concentrations.shape[0]} runs, written to {output}"
+    )
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    from . import Batch, Comparison
+
+    if not _check_output_args(args):
+        return 2
+
+    config = Batch.load_config(args.config) if args.config else Batch.PipelineConfig()
+    pairs = Comparison.read_pairs(args.pairs)
+    store = _result_store(args, [f for pair in pairs for f in pair])
+    summary = Comparison.compare_pairs(
+        pairs,
+        config,
+        store,
+        jobs=args.jobs,
+        write_traces=args.traces,
+        align=args.align,
+        max_shift=args.max_shift,
+        rt_tolerance=args.rt_tolerance,
+        min_ratio=args.min_ratio,
+        value=args.value,
+    )
+    output = store.output_dir / "comparisons" / "summary.csv"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(output, index=False)
+    failed = int(summary["error"].notna().sum())
+    print(
+        f"{len(summary)} pairs: {len(summary) - failed} compared, {failed} failed, written to {output}"
+    )
+    return 1 if failed else 0
+
+
+def _export(args: argparse.Namespace) -> int:
+    from . import Export
+
+    rows = Export.export_peak_tables(args.results_dir, args.output)
+    print(f"{rows} peaks written to {args.output}")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(levelname)s: %(message)s",
+    )
+    try:
+        return args.handler(args)
+    except (ValueError, FileNotFoundError) as e:
+        logging.error(e)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,10 @@
 import logging
+from typing import TYPE_CHECKING
 from numpy import linspace
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.axes import Axes
-import seaborn as sns
-from icecream import ic
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
 
 
 def plot_any_df(
@@ -14,8 +14,8 @@ def plot_any_df(
     labels: list[str] | tuple[str] | None = None,
     title: str = "DataFrames Scatter Plot",
     legend: bool = True,
-    ax: Axes | None = None,
-) -> Axes | None:
+    ax: "Axes | None" = None,
+) -> "Axes | None":
     # TODO:Finish documentation
     """Takes a list of DataFrames and plots all in one scatter plot
 
@@ -24,6 +24,9 @@ def plot_any_df(
         x: Name for x-axis
         y: Name for y-axis
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     if labels is not None:
         if len(dfs) != len(labels):
             raise ValueError("arg 'labels' must be of same length as 'dfs'")
@@ -0,0 +1,241 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+import logging
+import pathlib
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
+
+def decimate_minmax(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_bins: int,
+    x_range: tuple[float, float] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Reduces a line to the minimum and maximum of n_bins consecutive bins, which looks the same at a resolution of n_bins pixels.
+
+    Args:
+        x: Sorted x values (e.g. retention times)
+        y: y values
+        n_bins: Number of bins, usually the width of the axes in pixels
+        x_range: Only points in this range (plus one neighbor on each side, so the line reaches the border) are kept
+
+    Returns:
+        x and y of at most 2 * n_bins + 2 points, in the original order
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    start, stop = 0, len(x)
+    if x_range is not None:
+        start = max(0, int(np.searchsorted(x, x_range[0], side="left")) - 1)
+        stop = min(len(x), int(np.searchsorted(x, x_range[1], side="right")) + 1)
+    n = stop - start
+    if n <= 2 * n_bins + 2:
+        return x[start:stop], y[start:stop]
+
+    size = -(-n // n_bins)
+    n_full = n // size
+    binned = y[start : start + n_full * size].reshape(n_full, size)
+    base = start + np.arange(n_full) * size
+    keep = [base + binned.argmin(axis=1), base + binned.argmax(axis=1)]
+    if n_full * size < n:
+        rest = y[start + n_full * size : stop]
+        last = start + n_full * size
+        keep.append(np.array([last + rest.argmin(), last + rest.argmax()]))
+    keep.append(np.array([start, stop - 1]))
+    index = np.unique(np.concatenate(keep))
+    return x[index], y[index]
+
+
+class DecimatedLine:
+    """A matplotlib Line2D that shows a min/max decimated version of a long line and decimates again when the x limits change (zoom, pan).
+
+    Fields:
+        x: All x values, sorted
+        y: All y values
+        line: The Line2D added to the axes
+    """
+
+    def __init__(self, ax: "Axes", x: np.ndarray, y: np.ndarray, **kwargs) -> None:
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        (self.line,) = ax.plot([], [], **kwargs)
+        self._ax = ax
+        self.update()
+        if len(self.x):
+            ax.update_datalim(
+                [(self.x[0], np.nanmin(self.y)), (self.x[-1], np.nanmax(self.y))]
+            )
+            ax.autoscale_view()
+        # the registry holds the lambda strongly, which keeps this object alive as long as the axes
+        ax.callbacks.connect("xlim_changed", lambda _: self.update())
+
+    def update(self) -> None:
+        """Decimates the visible part of the line to the current width of the axes"""
+        n_bins = max(1, int(self._ax.bbox.width))
+        # while autoscaling, the limits follow the data and everything is shown
+        x_range = None if self._ax.get_autoscalex_on() else self._ax.get_xlim()
+        self.line.set_data(*decimate_minmax(self.x, self.y, n_bins, x_range))
+
+
+def plot_fast(
+    dfs: tuple[tuple[pd.DataFrame, str]],
+    x: str = "retention_time",
+    y: str = "intensity",
+    labels: list[str] | tuple[str] | None = None,
+    title: str = "DataFrames Scatter Plot",
+    legend: bool = True,
+    ax: "Axes | None" = None,
+) -> "Axes":
+    """Same as ChromPlotting.plot_any_df, but draws plain matplotlib lines and markers instead of seaborn plots.
+
+    Lines are min/max decimated to the axes width (see DecimatedLine), so chromatograms with millions of points draw
+    and zoom quickly.
+
+    Args:
+        dfs: Pairs of DataFrame and plot type ('line' or 'scatter'). All frames must have the columns x and y
+        x: Column for the x-axis, sorted ascending in 'line' frames
+        y: Column for the y-axis
+        labels: Legend label per DataFrame
+        title: Title of the axes
+        legend: Show a legend
+        ax: Axes to draw into, a new figure is created if None
+
+    Returns:
+        The axes
+    """
+    import matplotlib.pyplot as plt
+
+    if labels is not None:
+        if len(dfs) != len(labels):
+            raise ValueError("arg 'labels' must be of same length as 'dfs'")
+    else:
+        labels = [f"DF {i}" for i in range(len(dfs))]
+
+    if ax is None:
+        fig, ax = plt.subplots()
+
+    cmap = plt.get_cmap("viridis")
+    colors = [cmap(i) for i in np.linspace(0, 1, len(dfs))]
+
+    for i, (df, plot_type) in enumerate(dfs):
+        if x not in df.columns or y not in df.columns:
+            raise KeyError(f"DF {i} does not contain all colums: '{x}', '{y}'")
+        if plot_type == "scatter":
+            ax.plot(
+                df[x].to_numpy(),
+                df[y].to_numpy(),
+                linestyle="",
+                marker="o",
+                markersize=4,
+                label=labels[i],
+                color=colors[i],
+            )
+        elif plot_type == "line":
+            DecimatedLine(
+                ax,
+                df[x].to_numpy(),
+                df[y].to_numpy(),
+                label=labels[i],
+                color=colors[i],
+                linewidth=1,
+            )
+        else:
+            logging.error(f"Unknown plot type '{plot_type}' of DF {i}")
+
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.set_title(title)
+    if legend:
+        ax.legend()
+    return ax
+
+
+def render_thumbnail(
+    input_path: str | pathlib.Path,
+    output_path: str | pathlib.Path,
+    size: tuple[float, float] = (4.0, 2.0),
+    dpi: int = 100,
+) -> pathlib.Path:
+    """Reads a chromatogram file and saves an overview image of it with the Agg backend (no display needed).
+
+    Args:
+        input_path: Chromatogram file, read with the first compatible reader of Batch.available_readers()
+        output_path: Image file, the format is taken from the suffix (e.g. .png)
+        size: Figure size in inches
+        dpi: Resolution
+
+    Returns:
+        output_path
+
+    Raises:
+        ValueError: If no reader is available for the file.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from .. import Batch
+
+    reader = Batch.find_reader(input_path)
+    if reader is None:
+        raise ValueError(f"No reader available for file '{input_path}'")
+    chrom = reader.read_data(input_path)
+
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    rt, intensity = decimate_minmax(
+        chrom["retention_time"].to_numpy(),
+        chrom["intensity"].to_numpy(),
+        int(size[0] * dpi),
+    )
+    ax.plot(rt, intensity, linewidth=0.5)
+    ax.set_title(pathlib.Path(input_path).name, fontsize=8)
+    ax.tick_params(labelsize=6)
+    output_path = pathlib.Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(output_path)
+    return output_path
+
+
+def render_thumbnails(
+    inputs: list[pathlib.Path],
+    output_dir: str | pathlib.Path,
+    jobs: int = 1,
+    size: tuple[float, float] = (4.0, 2.0),
+    dpi: int = 100,
+    input_root: str | pathlib.Path | None = None,
+) -> list[pathlib.Path]:
+    """Renders one overview image '<name>.png' per input file in output_dir, in a process pool if jobs > 1.
+
+    Images are named like the peak tables of Batch.ResultStore (see Batch.run_name). Files that can not be rendered
+    are logged and skipped.
+
+    Returns:
+        Paths of the written images
+    """
+    from .. import Batch
+
+    output_dir = pathlib.Path(output_dir)
+    outputs = [output_dir / f"{Batch.run_name(f, input_root)}.png" for f in inputs]
+    written = []
+    if jobs > 1 and len(inputs) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [
+                pool.submit(render_thumbnail, f, out, size, dpi)
+                for f, out in zip(inputs, outputs)
+            ]
+            for f, future in zip(inputs, futures):
+                try:
+                    written.append(future.result())
+                except Exception as e:
+                    logging.error(f"Error rendering '{f}': {e}")
+    else:
+        for f, out in zip(inputs, outputs):
+            try:
+                written.append(render_thumbnail(f, out, size, dpi))
+            except Exception as e:
+                logging.error(f"Error rendering '{f}': {e}")
+    return written
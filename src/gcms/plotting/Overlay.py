@@ -0,0 +1,83 @@
+"""Peak border and integration region geometry for plots and exports. Only needs numpy, not matplotlib."""
+
+import numpy as np
+import pandas as pd
+from .. import Precision
+
+
+def _border_index(
+    chrom: pd.DataFrame, peaks: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """Left and right border positions of all peaks
+
+    Raises:
+        ValueError: If columns are missing or borders lie outside of chrom.
+    """
+    missing = {"left_border", "right_border"} - set(peaks.columns)
+    if missing:
+        raise ValueError(f"Error reading peak borders: peaks has no columns {missing}")
+    left = peaks["left_border"].to_numpy(dtype=np.intp)
+    right = peaks["right_border"].to_numpy(dtype=np.intp)
+    if len(peaks) and (left.min() < 0 or right.max() >= len(chrom)):
+        raise ValueError(
+            f"Error reading peak borders: borders must lie within the chromatogram of length {len(chrom)}"
+        )
+    return left, right
+
+
+def border_points(chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+    """Data points at the peak borders, left and right border of each peak interleaved.
+
+    Args:
+        chrom: DataFrame with columns 'retention_time', 'intensity'
+        peaks: DataFrame with positional columns 'left_border', 'right_border'
+
+    Returns:
+        DataFrame with columns 'retention_time', 'intensity' and two rows per peak
+    """
+    left, right = _border_index(chrom, peaks)
+    index = np.column_stack((left, right)).ravel()
+    return pd.DataFrame(
+        {
+            "retention_time": Precision.retention_time(chrom, index),
+            "intensity": chrom["intensity"].to_numpy()[index],
+        }
+    )
+
+
+def peak_polygons(chrom: pd.DataFrame, peaks: pd.DataFrame) -> np.ndarray:
+    """Integration region of every peak as a closed polygon: the curve from left to right border, then back along the baseline.
+
+    The baseline is zero, or the straight line between 'baseline_left' and 'baseline_right' if peaks has these
+    columns (see Deconvolver.TangentSkimDeconvolver; NaN means zero). Polygons of narrower peaks are padded by
+    repeating their last curve point, so all polygons have the same number of vertices.
+
+    Args:
+        chrom: DataFrame with columns 'retention_time', 'intensity'
+        peaks: DataFrame with positional columns 'left_border', 'right_border'
+
+    Returns:
+        Array of shape (peaks, vertices, 2) with (retention_time, intensity) vertices, which can be passed directly to
+        matplotlib.collections.PolyCollection
+    """
+    left, right = _border_index(chrom, peaks)
+    if len(peaks) == 0:
+        return np.empty((0, 0, 2))
+    rt = Precision.retention_time(chrom)
+    intensity = chrom["intensity"].to_numpy()
+
+    n_points = int((right - left).max()) + 1
+    curve = np.minimum(left[:, None] + np.arange(n_points), right[:, None])
+
+    base_left = np.zeros(len(peaks))
+    base_right = np.zeros(len(peaks))
+    if "baseline_left" in peaks.columns and "baseline_right" in peaks.columns:
+        base_left = np.nan_to_num(peaks["baseline_left"].to_numpy(dtype=np.float64))
+        base_right = np.nan_to_num(peaks["baseline_right"].to_numpy(dtype=np.float64))
+
+    polygons = np.empty((len(peaks), n_points + 2, 2))
+    polygons[:, :n_points, 0] = rt[curve]
+    polygons[:, :n_points, 1] = intensity[curve]
+    polygons[:, n_points] = np.column_stack((rt[right], base_right))
+    polygons[:, n_points + 1] = np.column_stack((rt[left], base_left))
+    return polygons
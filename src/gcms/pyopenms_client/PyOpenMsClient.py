@@ -1,18 +1,14 @@
-from decimal import ExtendedContext
-from matplotlib.pyplot import axis
-from pandas import DataFrame
-import pandas as pd
 import numpy as np
+from pandas import DataFrame
 from pyopenms import (
     MSChromatogram,
-    plotting,
     MSExperiment,
     MzMLFile,
+    PeakFileOptions,
     PeakPickerChromatogram,
 )
 import logging
 import pathlib
-from icecream import ic
 
 
 class Exp:
@@ -60,10 +56,42 @@ class Exp:
         except Exception as e:
             raise FileNotFoundError(f"Error while importing mzML file '{file}': {e}")
 
-    def extract_chrom(self) -> MSChromatogram | None:
-        """Extracts a TIC (total intensity current)."""
+    def store(
+        self, file: str | pathlib.Path, options: PeakFileOptions | None = None
+    ) -> None:
+        """Writes the experiment to a mzML file, atomically: readers never see a partially written file
+
+        Args:
+            file: Path of the mzML file
+            options: Compression of the binary arrays (zlib, numpress), defaults of MzMLFile if None
+        """
+        path = pathlib.Path(file)
+        tmp = path.with_name(f".{path.name}.tmp")
+        mzml = MzMLFile()
+        if options is not None:
+            mzml.setOptions(options)
+        try:
+            mzml.store(str(tmp), self.exp)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            raise ValueError(f"Error while writing mzML file '{file}': {e}")
+        tmp.replace(path)
+        self.mzml_file = path
+
+    def extract_chrom(self, native_id: str | None = None) -> MSChromatogram | None:
+        """Extracts a TIC (total intensity current).
+
+        Args:
+            native_id: Native ID of the chromatogram to extract, for files with several chromatograms (e.g. written
+                by Export.write_mzml). If None, the file must contain exactly one chromatogram
+        """
         if self.mzml_file is None:
             return None
+        if native_id is not None:
+            for chrom in self.exp.getChromatograms():
+                if chrom.getNativeID() == native_id:
+                    return chrom
+            raise ValueError(f"No chromatogram with native ID '{native_id}'")
         if self.exp.getNrChromatograms() != 1:
             raise ValueError(
                 f"Number of chromatograms contained in mzML file: {self.exp.getNrChromatograms()}"
@@ -92,18 +120,25 @@ class Chrom:
         return
 
     def plot(self, chrom=None) -> None:
+        # pyopenms.plotting imports matplotlib, which is only needed here
+        from pyopenms import plotting
+
         if chrom is None:
             chrom = self.chrom
         plotting.plot_chromatogram(chrom)
         return
 
-    def find_peaks(self) -> None:
-        """Find peaks inside a MSChromatogram and save peaks to separate MSChromatogram"""
+    def find_peaks(self, signal_to_noise: float = 0.8) -> None:
+        """Find peaks inside a MSChromatogram and save peaks to separate MSChromatogram
+
+        Args:
+            signal_to_noise: Minimum signal to noise ratio of a peak, estimated by the picker
+        """
         params = self.picker.getParameters()
         params.setValue(b"sgolay_frame_length", 5)
         params.setValue(b"sgolay_polynomial_order", 2)
         params.setValue(b"use_gauss", "false")
-        params.setValue(b"signal_to_noise", 0.8)
+        params.setValue(b"signal_to_noise", float(signal_to_noise))
         self.picker.setParameters(params)
 
         try:
@@ -144,26 +179,20 @@ def export_df(chrom: MSChromatogram, peaks: MSChromatogram | None) -> list[DataF
 
     if peaks is not None:
         peaks_df = read_peaks_to_df(peaks)
-        time_step = (
-            chrom_df["retention_time"].iloc[0] - chrom_df["retention_time"].iloc[2]
-        ) / 2
-        peak_indices = []
-        current_peak = 0
-        last_peak = len(peaks_df["retention_time"])
-        last_chrom_point = len(chrom_df["retention_time"])
-        for i, chrom_rt in enumerate(chrom_df["retention_time"]):
-            if current_peak == last_chrom_point or current_peak == last_peak:
-                break
-            if (
-                chrom_rt
-                >= peaks_df["retention_time"].iloc[current_peak] - time_step / 2
-            ):
-                peak_indices.append(chrom_df["index"].iloc[i])
-                current_peak += 1
-
-        if len(peak_indices) != len(peaks_df["retention_time"]):
+        rt = chrom_df["retention_time"].to_numpy()
+        time_step = (rt[0] - rt[2]) / 2
+        # first data point at or after each picked peak ...
+        first = np.searchsorted(
+            rt, peaks_df["retention_time"].to_numpy() - time_step / 2, side="left"
+        )
+        # ... but at most one peak per data point: a peak takes the next point after its predecessor
+        k = np.arange(len(first))
+        peak_indices = k + np.maximum.accumulate(first - k) if len(first) else first
+        found = int(np.count_nonzero(peak_indices < len(rt)))
+
+        if found != len(peaks_df["retention_time"]):
             raise AssertionError(
-                f"Error indexing peaks DataFrame: length of indices:{len(peak_indices)} and retention time:{len(peaks_df['retention_time'])}"
+                f"Error indexing peaks DataFrame: length of indices:{found} and retention time:{len(peaks_df['retention_time'])}"
             )
         peaks_df["index"] = peak_indices
         df.append(peaks_df)
@@ -1,14 +1,9 @@
-from icecream import ic
 import logging
-from numpy import ndarray
 import pandas as pd
 from pathlib import Path
 import re
-from scipy import signal
-import matplotlib.pyplot as plt
-import seaborn as sns
-import sys
-from scipy.signal import find_peaks, find_peaks_cwt, peak_prominences
+import scipy
+from . import Filter, Noise, PeakFinder
 
 
 class GC_CSV_Reader:
@@ -123,6 +118,9 @@ class GC_CSV_Reader:
         self, df: pd.DataFrame, x: str = "retention_time", y: str = "intensity"
     ):
         """Plot single DF"""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         sns.relplot(data=df, x=x, y=y, kind="line")
         plt.title(self.file)
         return
@@ -135,6 +133,9 @@ class GC_CSV_Reader:
         y: str = "intensity",
     ):
         """Plots data as lines and peaks as scatter plot"""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         _, ax = plt.subplots()
 
         sns.lineplot(data=df, x=x, y=y, label="GC", ax=ax)
@@ -178,76 +179,46 @@ class GC_CSV_Reader:
 
         return
 
-    def find_peaks(self) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame] | None:
+    def find_peaks(
+        self, min_snr: float = 3.0, cwt: bool = False
+    ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame | None] | None:
         """Finds peak in GC data.
 
+        Args:
+            min_snr: Minimum signal to noise ratio of a peak, see Noise.RollingMadNoise
+            cwt: Also pick peaks with PeakFinder.CwtChromPeakFinder, which is slower
+
         Return:
-            DataFrame of retention_time and count values of peaks.
+            DataFrames of the peaks ('index', 'retention_time', 'intensity', 'prominence'), the properties of
+            scipy.signal.find_peaks and the CWT peaks (None if cwt is False).
         """
         if self.df is None:
             logging.error("Dataframe is None")
             return None
-        peak_indices, props = find_peaks(self.df["intensity"], height=10000)
-
-        prominences, left_bases, right_bases = peak_prominences(
-            self.df["intensity"], peak_indices
+        # peaks are located by position, independent of the '#Point' numbering of the file
+        chrom = self.df.reset_index(drop=True)
+        intensity = chrom["intensity"].to_numpy()
+        height = Noise.RollingMadNoise().estimate(intensity).threshold(min_snr)
+        peak_indices, props = scipy.signal.find_peaks(intensity, height=height)
+
+        peaks = pd.DataFrame(
+            {
+                "index": peak_indices,
+                "retention_time": chrom["retention_time"].to_numpy()[peak_indices],
+                "intensity": intensity[peak_indices],
+            }
         )
+        PeakFinder.add_prominence(chrom, peaks)
 
-        peak_indices_cwt = find_peaks_cwt(self.df["intensity"], widths=10)
-
-        if (
-            peak_indices[-1] > self.df["index"].size
-            or peak_indices_cwt[-1] > self.df["index"].size
-        ):
-            logging.error(f"Last peak at index {peak_indices[-1]} out of bound.")
-            return None
-
-        j = 0
-        peak_series = {
-            "index": [],
-            "retention_time": [],
-            "intensity": [],
-            "prominence": [],
-        }
-        for i in self.df["index"]:
-            try:
-                if i == peak_indices[j]:
-                    peak_series["retention_time"].append(
-                        self.df["retention_time"].iloc[i]
-                    )
-                    peak_series["intensity"].append(self.df["intensity"].iloc[i])
-                    peak_series["prominence"].append(prominences[j])
-                    peak_series["index"].append((i))
-
-                    j += 1
-            except IndexError:
-                break
-
-        k = 0
-        peak_series_cwt = {"index": [], "retention_time": [], "intensity": []}
-        for i in self.df["index"]:
-            try:
-                if i == peak_indices_cwt[k]:
-                    peak_series_cwt["retention_time"].append(
-                        self.df["retention_time"].iloc[i]
-                    )
-                    peak_series_cwt["intensity"].append(self.df["intensity"].iloc[i])
-                    peak_series["index"].append((i))
-
-                    k += 1
-            except IndexError:
-                break
-
-        return (
-            pd.DataFrame(peak_series),
-            pd.DataFrame(props),
-            pd.DataFrame(peak_series_cwt),
-        )
+        peaks_cwt = None
+        if cwt:
+            peaks_cwt = PeakFinder.CwtChromPeakFinder(widths=(10,)).find_peaks(chrom)
+        return peaks, pd.DataFrame(props), peaks_cwt
 
     def set_savgol_df(self, wl: int = 6, poly: int = 2) -> pd.DataFrame | None:
         """Applies Savitzky-Golay-Filter on 'intensity'
         Parameters:
-          wl: window length. Considered data points for filter/smoothing. Must be an odd number.
+          wl: window length. Considered data points for filter/smoothing.
           poly: Highest order of polynom in equation to fit the curve. Should be less than wl.
 
         Return:
@@ -279,21 +250,12 @@ class DF_Savgol:
             raise ValueError("Coulumns not matching")
 
         try:
-            counts_savgol = signal.savgol_filter(df["intensity"].to_numpy(), wl, poly)
+            counts_savgol = Filter.SavgolFilter(wl, poly).apply(df)
         except Exception as e:
             raise ValueError(f"Could not process data: {e}")
 
-        try:
-            df_savgol = pd.DataFrame(
-                {
-                    "index": df["index"],
-                    "retention_time": df["retention_time"],
-                    "intensity": counts_savgol,
-                }
-            )
-        except Exception:
-            raise ValueError(f"Could not process data: {df}")
-
+        # index and retention_time are shared with df, only the intensities are new
+        df_savgol = df[["index", "retention_time"]].assign(intensity=counts_savgol)
         return df_savgol
 
     def get_df(self) -> pd.DataFrame | None:
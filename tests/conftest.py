@@ -0,0 +1,55 @@
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+
+GOLDEN_DIR = pathlib.Path(__file__).parent / "golden"
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--update-golden",
+        action="store_true",
+        help="Rewrite the golden peak tables in tests/golden instead of comparing against them.",
+    )
+
+
+class Golden:
+    """Compares peak tables with the stored golden tables, or rewrites them with --update-golden.
+
+    Integer columns must match exactly, float columns within rtol/atol.
+    """
+
+    def __init__(self, update: bool) -> None:
+        self.update = update
+
+    def check(
+        self, name: str, peaks: pd.DataFrame, rtol: float = 1e-6, atol: float = 1e-6
+    ) -> None:
+        path = GOLDEN_DIR / f"{name}.csv"
+        if self.update:
+            GOLDEN_DIR.mkdir(exist_ok=True)
+            peaks.to_csv(path, index=False, float_format="%.12g")
+            return
+        if not path.is_file():
+            pytest.fail(f"No golden table '{path}', create it with --update-golden")
+        expected = pd.read_csv(path)
+        assert list(peaks.columns) == list(expected.columns)
+        assert len(peaks) == len(expected), f"{name}: number of peaks changed"
+        for c in expected.columns:
+            actual = peaks[c].to_numpy()
+            if pd.api.types.is_integer_dtype(expected[c]):
+                np.testing.assert_array_equal(actual, expected[c], err_msg=c)
+            else:
+                np.testing.assert_allclose(
+                    actual.astype(np.float64),
+                    expected[c].to_numpy(dtype=np.float64),
+                    rtol=rtol,
+                    atol=atol,
+                    err_msg=c,
+                )
+
+
+@pytest.fixture
+def golden(request: pytest.FixtureRequest) -> Golden:
+    return Golden(request.config.getoption("--update-golden"))
@@ -0,0 +1,110 @@
+"""Reference implementations: the original row-by-row versions of the fast paths, kept as test oracles.
+
+Do not optimize these. A fast implementation is correct if it matches its reference here (see test_fast_paths).
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+import scipy
+
+
+def export_df_indices(rt: np.ndarray, peak_rt: np.ndarray) -> list[int]:
+    """PyOpenMsClient.export_df: index of the data point of every picked peak"""
+    chrom_df = pd.DataFrame({"retention_time": rt})
+    chrom_df["index"] = chrom_df.index
+    peaks_df = pd.DataFrame({"retention_time": peak_rt})
+    time_step = (
+        chrom_df["retention_time"].iloc[0] - chrom_df["retention_time"].iloc[2]
+    ) / 2
+    peak_indices = []
+    current_peak = 0
+    last_peak = len(peaks_df["retention_time"])
+    last_chrom_point = len(chrom_df["retention_time"])
+    for i, chrom_rt in enumerate(chrom_df["retention_time"]):
+        if current_peak == last_chrom_point or current_peak == last_peak:
+            break
+        if chrom_rt >= peaks_df["retention_time"].iloc[current_peak] - time_step / 2:
+            peak_indices.append(chrom_df["index"].iloc[i])
+            current_peak += 1
+    if len(peak_indices) != len(peaks_df["retention_time"]):
+        raise AssertionError(
+            f"Error indexing peaks DataFrame: length of indices:{len(peak_indices)} and retention time:{len(peaks_df['retention_time'])}"
+        )
+    return peak_indices
+
+
+def correct_apex(chrom: pd.DataFrame, peak_index: list[int]) -> pd.DataFrame:
+    """PyopenmsChromPeakFinder.find_peaks: move picked peaks to the highest raw data point within +-2"""
+    rt_corr = []
+    index_corr = []
+    intensity_corr = []
+    chrom_len = len(chrom) - 1
+    for i in peak_index:
+        i = int(i)
+        max_intensity = chrom.at[i, "intensity"]
+        max_index = i
+        for j in range(-2, 3):
+            check_idx = max(0, min(chrom_len, i + j))
+            check_intensity = chrom.at[check_idx, "intensity"]
+            if check_intensity > max_intensity:
+                max_intensity = check_intensity
+                max_index = check_idx
+        rt_corr.append(chrom.at[max_index, "retention_time"])
+        index_corr.append(max_index)
+        intensity_corr.append(max_intensity)
+    return pd.DataFrame(
+        {"index": index_corr, "retention_time": rt_corr, "intensity": intensity_corr}
+    )
+
+
+def adjust_neighbor(chrom: pd.DataFrame, peaks: pd.DataFrame, i: int, k: int) -> None:
+    ind = int(peaks.at[i, "index"])
+    neighbor_indx = max(0, min(len(chrom) - 1, ind + k))
+    diff = chrom.at[ind, "intensity"] - chrom.at[neighbor_indx, "intensity"]
+    if diff <= 0.2 * peaks.at[i, "intensity"]:
+        if neighbor_indx == 0 or neighbor_indx == len(chrom) - 1:
+            chrom.at[neighbor_indx, "intensity"] = peaks.at[i, "intensity"] / 2
+        else:
+            next_indx = neighbor_indx + k
+            chrom.at[neighbor_indx, "intensity"] = (
+                chrom.at[neighbor_indx, "intensity"] + chrom.at[next_indx, "intensity"]
+            ) / 2
+
+
+def find_peak_borders(chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+    """PeakFinder.find_peak_borders"""
+    for i in peaks.index:
+        for k in [-1, 1]:
+            adjust_neighbor(chrom, peaks, i, k)
+    widths, width_heights, left, right = scipy.signal.peak_widths(
+        chrom["intensity"], peaks["index"], rel_height=1.0, wlen=11
+    )
+    for i in peaks.index:
+        if widths[i] == 0:
+            logging.error(
+                f"Width with value 0 at retention time: {peaks['retention_time'].iloc[i]}"
+            )
+    left_border = []
+    right_border = []
+    for i in peaks.index:
+        left_border.append(int(np.floor(left[i])))
+        right_border.append(int(np.ceil(right[i])))
+    peaks["width"] = widths
+    peaks["width_height"] = width_heights
+    peaks["left_border"] = left_border
+    peaks["right_border"] = right_border
+    return peaks
+
+
+def trapezoid_areas(chrom: pd.DataFrame, peaks: pd.DataFrame) -> list[float]:
+    """ChromTrapezoidIntegrator.integrate without baseline or skim corrections"""
+    area = []
+    for i in peaks.index:
+        y = []
+        for intensity in chrom["intensity"].iloc[
+            peaks.at[i, "left_border"] : peaks.at[i, "right_border"] + 1
+        ]:
+            y.append(intensity)
+        area.append(scipy.integrate.trapezoid(y))
+    return area
@@ -0,0 +1,66 @@
+"""Synthetic chromatograms for the tests, generated on the fly from a fixed seed."""
+
+import pathlib
+import numpy as np
+import pandas as pd
+
+# (retention time, height, sigma) of the peaks in the reference inputs; 905/912 co-elute
+REFERENCE_PEAKS = (
+    (180.0, 4e5, 2.5),
+    (420.0, 1.2e6, 3.0),
+    (640.0, 8e4, 2.0),
+    (905.0, 6e5, 3.5),
+    (912.0, 3e5, 3.0),
+    (1300.0, 2e6, 4.0),
+    (1650.0, 1.5e5, 3.0),
+)
+
+
+def chromatogram(
+    seed: int = 0,
+    n: int = 8000,
+    rt_range: tuple[float, float] = (60.0, 1800.0),
+    peaks: tuple[tuple[float, float, float], ...] = REFERENCE_PEAKS,
+    noise: float = 500.0,
+    baseline: float = 2000.0,
+    rt_jitter: float = 0.0,
+) -> pd.DataFrame:
+    """Gaussian peaks on a drifting baseline with normal noise.
+
+    Args:
+        rt_jitter: Relative jitter of the sampling interval, > 0 for non-uniform retention time spacing
+
+    Returns:
+        DataFrame with columns 'index', 'retention_time', 'intensity'
+    """
+    rng = np.random.default_rng(seed)
+    step = np.full(n - 1, (rt_range[1] - rt_range[0]) / (n - 1))
+    if rt_jitter > 0:
+        step *= 1 + rng.uniform(-rt_jitter, rt_jitter, n - 1)
+    rt = rt_range[0] + np.concatenate(([0.0], np.cumsum(step)))
+    intensity = baseline * (1 + 0.2 * (rt - rt[0]) / (rt[-1] - rt[0]))
+    intensity = intensity + rng.normal(0, noise, n)
+    for center, height, sigma in peaks:
+        intensity += height * np.exp(-0.5 * ((rt - center) / sigma) ** 2)
+    return pd.DataFrame(
+        {"index": np.arange(n), "retention_time": rt, "intensity": intensity}
+    )
+
+
+def write_csv(chrom: pd.DataFrame, path: pathlib.Path) -> pathlib.Path:
+    chrom[["retention_time", "intensity"]].to_csv(path, index=False)
+    return path
+
+
+def write_mzml(chrom: pd.DataFrame, path: pathlib.Path) -> pathlib.Path:
+    """Writes the chromatogram as the only chromatogram of an mzML file"""
+    import pyopenms as oms
+
+    mschrom = oms.MSChromatogram()
+    mschrom.set_peaks(
+        [chrom["retention_time"].to_numpy(), chrom["intensity"].to_numpy()]
+    )
+    exp = oms.MSExperiment()
+    exp.addChromatogram(mschrom)
+    oms.MzMLFile().store(str(path), exp)
+    return path
@@ -0,0 +1,82 @@
+"""Out-of-core processing in chunks against in-memory processing."""
+
+import dataclasses
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Chunked
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+@pytest.fixture(scope="module")
+def long_run(tmp_path_factory: pytest.TempPathFactory) -> pathlib.Path:
+    """60000 data points with 150 peaks, some co-eluting"""
+    rng = np.random.default_rng(1)
+    n, rt_range = 60000, (60.0, 12060.0)
+    peaks = tuple(
+        zip(
+            np.sort(rng.uniform(70.0, rt_range[1] - 10, 150)).tolist(),
+            rng.uniform(2e4, 2e6, 150).tolist(),
+            rng.uniform(1.0, 4.0, 150).tolist(),
+        )
+    )
+    chrom = synthetic.chromatogram(seed=5, n=n, rt_range=rt_range, peaks=peaks)
+    return synthetic.write_csv(chrom, tmp_path_factory.mktemp("chunked") / "long.csv")
+
+
+def test_plan_chunks() -> None:
+    chunks = Chunked.plan_chunks(10000, 3000, 600, align=501)
+    assert [c.core_start for c in chunks] == [0, 3006, 6012, 9018]
+    assert chunks[-1].core_stop == chunks[-1].stop == 10000
+    for a, b in zip(chunks, chunks[1:]):
+        assert a.core_stop == b.core_start
+        assert b.start == b.core_start - 1002
+    assert all(c.start % 501 == 0 for c in chunks)
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        Batch.PipelineConfig(min_snr=5.0),
+        Batch.PipelineConfig(deconvolver="tangent_skim", noise="none"),
+    ],
+    ids=["default", "tangent_skim"],
+)
+def test_matches_in_memory(
+    long_run: pathlib.Path, config: Batch.PipelineConfig
+) -> None:
+    expected = Batch.process_file(long_run, config)
+    chunked = Batch.process_file(
+        long_run, dataclasses.replace(config, chunk_size=4000, chunk_jobs=2)
+    )
+    pd.testing.assert_frame_equal(chunked.df.peaks, expected.df.peaks)
+    assert chunked.df.qc == pytest.approx(expected.df.qc, nan_ok=True)
+    np.testing.assert_array_equal(
+        chunked.df.chromatogram["intensity"], expected.df.chromatogram["intensity"]
+    )
+
+
+def test_stays_mapped(long_run: pathlib.Path) -> None:
+    config = Batch.PipelineConfig(min_snr=5.0, chunk_size=20000)
+    p = Batch.process_file(long_run, config)
+
+    def mapped(a: np.ndarray) -> bool:
+        while a is not None:
+            if isinstance(a, np.memmap):
+                return True
+            a = a.base
+        return False
+
+    rt = p.df.chromatogram["retention_time"].to_numpy()
+    assert np.shares_memory(rt, p.df.chromatogram_og["retention_time"].to_numpy())
+    assert mapped(rt)
+    assert mapped(p.df.chromatogram["intensity"].to_numpy())
+
+
+def test_overlap_too_small(long_run: pathlib.Path) -> None:
+    config = Batch.PipelineConfig(chunk_size=4000, chunk_overlap=10)
+    with pytest.raises(ValueError, match="chunk_overlap"):
+        Batch.process_file(long_run, config)
@@ -0,0 +1,73 @@
+"""Command line: resuming into an existing output directory and exporting its peak tables."""
+
+import pathlib
+import pandas as pd
+import pytest
+from gcms import Batch, cli
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+@pytest.fixture
+def raw(tmp_path: pathlib.Path) -> pathlib.Path:
+    for seed, night in enumerate(("n1", "n2")):
+        (tmp_path / "raw" / night).mkdir(parents=True)
+        synthetic.write_csv(
+            synthetic.chromatogram(seed=seed, n=2000),
+            tmp_path / "raw" / night / "run0.csv",
+        )
+    return tmp_path / "raw"
+
+
+def outputs(out: pathlib.Path) -> dict[str, int]:
+    return {p.name: p.stat().st_mtime_ns for p in out.iterdir() if p.is_file()}
+
+
+def test_resume_subset_keeps_names(
+    raw: pathlib.Path, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture
+) -> None:
+    out = tmp_path / "out"
+    assert cli.main(["run", str(raw), "--incremental", "-o", str(out)]) == 0
+    before = outputs(out)
+    assert {"n1__run0.peaks.csv", "n2__run0.peaks.csv", "batch_qc.csv"} <= set(before)
+
+    # a subdirectory alone would be named relative to itself; the recorded root is used instead
+    capsys.readouterr()
+    assert cli.main(["run", str(raw / "n1"), "--resume", "-o", str(out)]) == 0
+    assert "1 skipped" in capsys.readouterr().out
+    assert outputs(out) == before
+
+    assert cli.main(["run", str(raw / "n1"), "--incremental", "-o", str(out)]) == 0
+    assert "1 reused" in capsys.readouterr().out
+    assert set(outputs(out)) == set(before)
+
+
+def test_other_input_root_rejected(raw: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    out = tmp_path / "out"
+    assert cli.main(["run", str(raw / "n1"), "-o", str(out)]) == 0
+    assert Batch.ResultStore(out).recorded_input_root() == (True, raw / "n1")
+    # the inputs of n2 are outside the recorded root, and an explicit root must match it
+    assert cli.main(["run", str(raw / "n2"), "-o", str(out)]) == 2
+    assert cli.main(["run", str(raw), "-o", str(out), "--input-root", str(raw)]) == 2
+    assert {p.name for p in out.glob("*.peaks.csv")} == {"run0.peaks.csv"}
+
+
+def test_export(
+    raw: pathlib.Path, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture
+) -> None:
+    out = tmp_path / "out"
+    assert cli.main(["run", str(raw), "-o", str(out)]) == 0
+    assert cli.main(["run", str(raw / "n2"), "--resume", "-o", str(out)]) == 0
+    capsys.readouterr()
+    assert cli.main(["export", str(out), "-o", str(tmp_path / "peaks.csv")]) == 0
+
+    peaks = pd.read_csv(tmp_path / "peaks.csv")
+    tables = {
+        name: pd.read_csv(out / f"{name}.peaks.csv")
+        for name in ("n1__run0", "n2__run0")
+    }
+    assert peaks["run"].value_counts().to_dict() == {
+        name: len(table) for name, table in tables.items()
+    }
+    assert f"{len(peaks)} peaks written" in capsys.readouterr().out
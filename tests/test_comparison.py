@@ -0,0 +1,103 @@
+"""Paired comparison of sample and reference runs."""
+
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Comparison
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+# sample: an extra peak at 1000 s and the peak at 420 s three times higher than in the blank
+SAMPLE_PEAKS = (
+    *(
+        (rt, 3 * height if rt == 420.0 else height, sigma)
+        for rt, height, sigma in synthetic.REFERENCE_PEAKS
+    ),
+    (1000.0, 5e5, 3.0),
+)
+
+
+def shifted(peaks, shift: float):
+    return tuple((rt + shift, height, sigma) for rt, height, sigma in peaks)
+
+
+def test_match_peaks() -> None:
+    sample = pd.DataFrame(
+        {"index": [10, 20, 30, 40], "retention_time": [100.0, 200.0, 300.0, 301.0]}
+    )
+    sample["area"] = [1.0, 5.0, 1.0, 1.0]
+    reference = pd.DataFrame(
+        {"index": [11, 21, 31, 51], "retention_time": [101.5, 200.5, 300.8, 500.0]}
+    )
+    reference["area"] = [1.2, 1.0, 4.0, 1.0]
+    table = Comparison.match_peaks(sample, reference, shift=0.5, rt_tolerance=1.0)
+    assert list(table["status"]) == [
+        "common",
+        "enriched_sample",
+        "enriched_reference",
+        "unique_sample",
+        "unique_reference",
+    ]
+    assert list(table["sample_index"]) == [10, 20, 30, 40, -1]
+    assert list(table["reference_index"]) == [11, 21, 31, -1, 51]
+    assert table["log2_ratio"].iloc[1] == pytest.approx(np.log2(5.0))
+
+
+def test_rolling_correlation() -> None:
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=200)
+    b = a + rng.normal(scale=0.5, size=200) + 1e6
+    r = Comparison.rolling_correlation(a, b, 21)
+    for i in (0, 5, 100, 199):
+        lo, hi = max(i - 10, 0), min(i + 11, 200)
+        assert r[i] == pytest.approx(np.corrcoef(a[lo:hi], b[lo:hi])[0, 1], abs=1e-6)
+
+
+@pytest.mark.parametrize("shift", [0.0, 3.0])
+def test_compare_pairs(tmp_path: pathlib.Path, shift: float) -> None:
+    blanks = [
+        synthetic.write_csv(
+            synthetic.chromatogram(
+                seed=seed, peaks=shifted(synthetic.REFERENCE_PEAKS, shift)
+            ),
+            tmp_path / f"blank{seed}.csv",
+        )
+        for seed in range(2)
+    ]
+    samples = [
+        synthetic.write_csv(
+            synthetic.chromatogram(seed=10 + seed, peaks=SAMPLE_PEAKS),
+            tmp_path / f"sample{seed}.csv",
+        )
+        for seed in range(2)
+    ]
+    pairs = pd.DataFrame(
+        {
+            "sample": [p.name for p in samples] + [samples[0].name],
+            "reference": [p.name for p in blanks] + ["missing.csv"],
+        }
+    )
+    pairs.to_csv(tmp_path / "pairs.csv", index=False)
+    store = Batch.ResultStore(tmp_path / "out")
+    summary = Comparison.compare_pairs(
+        Comparison.read_pairs(tmp_path / "pairs.csv"),
+        Batch.PipelineConfig(min_snr=5.0),
+        store,
+        jobs=2,
+        write_traces=True,
+        align="shift",
+        rt_tolerance=1.5,
+    )
+
+    assert summary["error"].isna().tolist() == [True, True, False]
+    assert summary["shift"].iloc[:2].tolist() == pytest.approx([shift, shift], abs=0.2)
+    assert (summary["unique_sample"].iloc[:2] >= 1).all()
+    peaks = pd.read_csv(store.comparison_path_for(samples[0], blanks[0]))
+    unique = peaks[peaks["status"] == "unique_sample"]
+    assert np.abs(unique["retention_time"] - 1000.0).min() < 1.0
+    enriched = peaks[peaks["status"] == "enriched_sample"]
+    assert np.abs(enriched["retention_time"] - 420.0).min() < 1.0
+    traces = pd.read_csv(store.comparison_path_for(samples[0], blanks[0], "traces"))
+    assert traces["correlation"].max() > 0.99
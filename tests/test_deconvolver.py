@@ -0,0 +1,153 @@
+"""Splitting clusters of co-eluting peaks: perpendicular drop, tangent skim and both in the pipeline."""
+
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Deconvolver, Integrator
+from . import synthetic
+
+
+def trace(*peaks: tuple[float, float, float], n: int = 200) -> pd.DataFrame:
+    """Noise-free sum of gaussians (apex index, height, sigma in points) on a flat baseline of 10"""
+    x = np.arange(n, dtype=np.float64)
+    intensity = np.full(n, 10.0)
+    for apex, height, sigma in peaks:
+        intensity += height * np.exp(-0.5 * ((x - apex) / sigma) ** 2)
+    return pd.DataFrame({"retention_time": x, "intensity": intensity})
+
+
+def peak_table(
+    chrom: pd.DataFrame, borders: list[tuple[int, int, int]]
+) -> pd.DataFrame:
+    """Peaks at the apex indices with the given (apex, left_border, right_border)"""
+    apex, left, right = map(list, zip(*borders))
+    return pd.DataFrame(
+        {
+            "index": apex,
+            "intensity": chrom["intensity"].to_numpy()[apex],
+            "left_border": left,
+            "right_border": right,
+        }
+    )
+
+
+def areas(chrom: pd.DataFrame, peaks: pd.DataFrame) -> np.ndarray:
+    Integrator.ChromTrapezoidIntegrator().integrate(chrom, peaks)
+    return peaks["area"].to_numpy()
+
+
+def test_valley_drop() -> None:
+    chrom = trace((50, 1000, 4), (65, 600, 4), (80, 800, 4), (150, 500, 4))
+    peaks = peak_table(
+        chrom, [(65, 52, 78), (50, 35, 60), (80, 70, 95), (150, 135, 165)]
+    )
+    whole = areas(chrom, peak_table(chrom, [(65, 35, 95)]))[0]
+
+    peaks = Deconvolver.ValleyDropDeconvolver().deconvolve(chrom, peaks)
+    intensity = chrom["intensity"].to_numpy()
+    assert peaks["cluster"].tolist() == [0, 0, 0, 1]
+    # neighbours share only the valley point; the outer borders of the cluster are kept
+    assert peaks["left_border"].tolist() == [
+        50 + np.argmin(intensity[50:66]),
+        35,
+        peaks["right_border"][0],
+        135,
+    ]
+    assert peaks["right_border"][1] == peaks["left_border"][0]
+    assert peaks["right_border"][2] == 95
+    assert peaks["right_border"][3] == 165
+    np.testing.assert_allclose(areas(chrom, peaks)[:3].sum(), whole)
+
+
+@pytest.mark.parametrize("rider_side", [1, -1])
+def test_tangent_skim(rider_side: int) -> None:
+    rider = 60 + rider_side * 20
+    chrom = trace((60, 10000, 5), (rider, 500, 2))
+    borders = [(60, 40, 80), (rider, rider - 8, rider + 8)]
+    whole = areas(
+        chrom, peak_table(chrom, [(60, min(40, rider - 8), max(80, rider + 8))])
+    )[0]
+    dropped = Deconvolver.ValleyDropDeconvolver().deconvolve(
+        chrom, peak_table(chrom, borders)
+    )
+    dropped_area = areas(chrom, dropped)
+
+    skimmed = Deconvolver.TangentSkimDeconvolver(0.1).deconvolve(
+        chrom, peak_table(chrom, borders)
+    )
+    assert skimmed["skim_parent"].tolist() == [-1, 0]
+    assert skimmed["cluster"].tolist() == [0, 0]
+    # the parent keeps the whole cluster, the rider ends where the tangent touches its outer flank
+    assert skimmed["left_border"][0] == min(40, rider - 8)
+    assert skimmed["right_border"][0] == max(80, rider + 8)
+    assert np.isnan(skimmed["baseline_left"][0])
+    rider_area = areas(chrom, skimmed)
+    # nothing is counted twice, and the rider loses the flank of the parent beneath it
+    np.testing.assert_allclose(rider_area.sum(), whole)
+    assert 0 < rider_area[1] < dropped_area[1]
+    true_rider = 500 * 2 * np.sqrt(2 * np.pi)
+    assert 0.6 * true_rider < rider_area[1] < true_rider
+
+
+def test_tangent_skim_ratio() -> None:
+    chrom = trace((60, 10000, 5), (80, 500, 2))
+    borders = [(60, 40, 80), (80, 72, 88)]
+    skimmed = Deconvolver.TangentSkimDeconvolver(0.01).deconvolve(
+        chrom, peak_table(chrom, borders)
+    )
+    dropped = Deconvolver.ValleyDropDeconvolver().deconvolve(
+        chrom, peak_table(chrom, borders)
+    )
+    # above skim_ratio the peaks are split like the valley drop
+    assert skimmed["skim_parent"].tolist() == [-1, -1]
+    assert skimmed["left_border"].tolist() == dropped["left_border"].tolist()
+    assert skimmed["right_border"].tolist() == dropped["right_border"].tolist()
+
+
+def test_rider_of_rider() -> None:
+    chrom = trace((60, 10000, 5), (80, 500, 2), (90, 30, 1.5))
+    borders = [(60, 40, 80), (80, 72, 88), (90, 84, 96)]
+    skimmed = Deconvolver.TangentSkimDeconvolver(0.1).deconvolve(
+        chrom, peak_table(chrom, borders)
+    )
+    # the second rider is split from the first one with a perpendicular drop at their valley
+    valley = 80 + np.argmin(chrom["intensity"].to_numpy()[80:91])
+    assert skimmed["skim_parent"].tolist() == [-1, 0, -1]
+    assert skimmed["left_border"][2] == valley
+    assert skimmed["right_border"][1] <= valley
+    assert skimmed["right_border"][0] == valley
+
+
+def test_empty_and_invalid() -> None:
+    chrom = trace((60, 1000, 5))
+    empty = peak_table(chrom, [(60, 50, 70)]).iloc[:0]
+    for deconvolver in (
+        Deconvolver.ValleyDropDeconvolver(),
+        Deconvolver.TangentSkimDeconvolver(),
+    ):
+        assert "cluster" in deconvolver.deconvolve(chrom, empty.copy()).columns
+        with pytest.raises(ValueError):
+            deconvolver.deconvolve(chrom, empty.drop(columns="left_border"))
+        with pytest.raises(ValueError):
+            deconvolver.deconvolve(chrom.rename(columns={"intensity": "i"}), empty)
+
+
+def test_pipeline_skims_rider(tmp_path: pathlib.Path) -> None:
+    # a narrow peak with a rider at 3 % of its height, 1.3 s later: both share their borders
+    chrom = synthetic.chromatogram(seed=0, peaks=[(1000, 1e6, 0.3), (1001.3, 3e4, 0.3)])
+    path = synthetic.write_csv(chrom, tmp_path / "run.csv")
+
+    def cluster(deconvolver: str) -> pd.DataFrame:
+        p = Batch.process_file(path, Batch.PipelineConfig(deconvolver=deconvolver))
+        peaks = p.df.peaks.reset_index(drop=True)
+        return peaks[peaks["retention_time"].between(995, 1005)]
+
+    dropped, skimmed = cluster("valley_drop"), cluster("tangent_skim")
+    assert len(skimmed) == 2
+    parent, rider = skimmed.index
+    assert skimmed["skim_parent"].tolist() == [-1, parent]
+    assert skimmed["cluster"].nunique() == 1
+    np.testing.assert_allclose(skimmed["area"].sum(), dropped["area"].sum())
+    assert 0 < skimmed["area"][rider] < dropped["area"][rider]
+    assert skimmed["area"][parent] > dropped["area"][parent]
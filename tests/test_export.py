@@ -0,0 +1,125 @@
+"""mzML export of processed runs and streamed peak tables."""
+
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Export, Quantitation
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+@pytest.fixture(scope="module")
+def processed(tmp_path_factory: pytest.TempPathFactory):
+    path = tmp_path_factory.mktemp("export") / "run.csv"
+    synthetic.write_csv(synthetic.chromatogram(seed=2), path)
+    return Batch.process_file(path, Batch.PipelineConfig(min_snr=5.0)).df
+
+
+@pytest.mark.parametrize(
+    "numpress, rtol", [("none", 1e-7), ("linear", 1e-6), ("slof", 5e-4)]
+)
+def test_mzml_round_trip(
+    processed, tmp_path: pathlib.Path, numpress: str, rtol: float
+) -> None:
+    options = Export.MzmlOptions(numpress=numpress, raw=True)
+    path = Export.write_mzml(processed, tmp_path / "run.mzML", options)
+
+    chrom = Export.read_mzml(path)
+    np.testing.assert_allclose(
+        chrom["retention_time"], processed.chromatogram["retention_time"], atol=1e-6
+    )
+    np.testing.assert_allclose(
+        chrom["intensity"], processed.chromatogram["intensity"], rtol=rtol
+    )
+    raw = Export.read_mzml(path, Export.RAW_ID)
+    assert len(raw) == len(processed.chromatogram_og)
+
+    peaks = Export.read_mzml(path, Export.PEAKS_ID)
+    expected = processed.peaks
+    np.testing.assert_allclose(peaks["retention_time"], expected["retention_time"])
+    np.testing.assert_allclose(peaks["area"], expected["area"], rtol=1e-6)
+    np.testing.assert_allclose(peaks["snr"], expected["snr"], rtol=1e-6)
+    rt = processed.chromatogram["retention_time"].to_numpy()
+    np.testing.assert_allclose(
+        peaks["left_border"], rt[expected["left_border"]], rtol=1e-7
+    )
+
+
+def test_batch_writes_mzml(tmp_path: pathlib.Path) -> None:
+    path = synthetic.write_csv(synthetic.chromatogram(seed=4), tmp_path / "run.csv")
+    store = Batch.ResultStore(tmp_path / "out", mzml=Export.MzmlOptions())
+    summary = Batch.run_batch([path], Batch.PipelineConfig(min_snr=5.0), store)
+    assert summary.count("done") == 1
+    peaks = Export.read_mzml(store.mzml_path_for(path), Export.PEAKS_ID)
+    assert len(peaks) == summary.results[0].n_peaks
+
+
+def test_peak_table_writer(tmp_path: pathlib.Path) -> None:
+    out = tmp_path / "results"
+    out.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(5):
+        peaks = pd.DataFrame(
+            {"index": np.arange(i + 1), "area": rng.uniform(size=i + 1)}
+        )
+        if i == 3:
+            peaks["extra"] = 1.0
+        peaks.to_csv(out / f"run{i}.peaks.csv", index=False)
+
+    rows = Export.export_peak_tables(out, tmp_path / "all.csv")
+    combined = pd.read_csv(tmp_path / "all.csv")
+    assert rows == len(combined) == 15
+    assert list(combined.columns) == ["index", "area", "extra", "run"]
+    expected = Quantitation.read_peak_tables(out)[combined.columns]
+    pd.testing.assert_frame_equal(combined, expected)
+
+    # buffered in small pieces with the columns given up front, the file is the same
+    with Export.PeakTableWriter(
+        tmp_path / "small.csv", columns=["index", "area", "extra"], buffer_rows=4
+    ) as writer:
+        for run, peaks in Export.iter_peak_tables(out):
+            writer.write(run, peaks)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "small.csv"), combined)
+
+
+def test_peak_table_writer_new_columns(tmp_path: pathlib.Path) -> None:
+    out = tmp_path / "results"
+    out.mkdir()
+    pd.DataFrame({"index": [1], "area": [1.0]}).to_csv(out / "a.peaks.csv", index=False)
+    pd.DataFrame(
+        {"index": [2], "area": [2.0], "compound": ["hexane"], "match_score": [0.9]}
+    ).to_csv(out / "b.peaks.csv", index=False)
+    Export.export_peak_tables(out, tmp_path / "all.csv")
+    combined = pd.read_csv(tmp_path / "all.csv")
+    assert list(combined.columns) == ["index", "area", "compound", "match_score", "run"]
+    assert combined["compound"].isna().tolist() == [True, False]
+
+    # new columns are added while nothing is written, afterwards they are an error
+    with Export.PeakTableWriter(tmp_path / "buffered.csv") as writer:
+        for run, peaks in Export.iter_peak_tables(out):
+            writer.write(run, peaks)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "buffered.csv"), combined)
+    with pytest.raises(ValueError, match="compound"):
+        with Export.PeakTableWriter(tmp_path / "flushed.csv", buffer_rows=1) as writer:
+            for run, peaks in Export.iter_peak_tables(out):
+                writer.write(run, peaks)
+    assert not (tmp_path / "flushed.csv").exists()
+
+
+def test_peak_table_writer_error(tmp_path: pathlib.Path) -> None:
+    with pytest.raises(RuntimeError):
+        with Export.PeakTableWriter(tmp_path / "all.csv", buffer_rows=1) as writer:
+            writer.write("a", pd.DataFrame({"area": [1.0, 2.0]}))
+            raise RuntimeError("interrupted")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_peak_table_writer_parquet(tmp_path: pathlib.Path) -> None:
+    pytest.importorskip("pyarrow")
+    with Export.PeakTableWriter(tmp_path / "all.parquet", buffer_rows=2) as writer:
+        writer.write("a", pd.DataFrame({"area": [1.0, 2.0]}))
+        writer.write("b", pd.DataFrame({"area": [3.0]}))
+    combined = pd.read_parquet(tmp_path / "all.parquet")
+    assert combined["run"].tolist() == ["a", "a", "b"]
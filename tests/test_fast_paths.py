@@ -0,0 +1,61 @@
+"""The fast implementations against their row-by-row references on the synthetic reference inputs."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Integrator, PeakFinder
+from . import reference, synthetic
+
+oms = pytest.importorskip("pyopenms")
+from gcms.pyopenms_client import PyOpenMsClient as omsc  # noqa: E402
+
+
+def picked(chrom: pd.DataFrame) -> tuple[oms.MSChromatogram, oms.MSChromatogram]:
+    adapter = omsc.Chrom(testdata=False)
+    adapter.import_df(chrom)
+    adapter.find_peaks(signal_to_noise=0.8)
+    return adapter.chrom, adapter.picked_peaks
+
+
+def bordered(chrom: pd.DataFrame) -> pd.DataFrame:
+    """Raw peaks of the default picker, before find_peak_borders"""
+    return PeakFinder.PyopenmsChromPeakFinder().find_peaks(chrom)
+
+
+@pytest.fixture(params=[0.0, 0.3], ids=["uniform", "jitter"])
+def chrom(request: pytest.FixtureRequest) -> pd.DataFrame:
+    return synthetic.chromatogram(seed=7, rt_jitter=request.param)
+
+
+def test_export_df_indices(chrom: pd.DataFrame) -> None:
+    mschrom, peaks = picked(chrom)
+    peak_rt = np.asarray(peaks.get_peaks()[0])
+    expected = reference.export_df_indices(chrom["retention_time"].to_numpy(), peak_rt)
+    actual = omsc.export_df(mschrom, peaks)[1]["index"].to_numpy()
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_find_peaks_apex(chrom: pd.DataFrame) -> None:
+    mschrom, peaks = picked(chrom)
+    index = omsc.export_df(mschrom, peaks)[1]["index"].to_numpy()
+    expected = reference.correct_apex(chrom, index)
+    actual = PeakFinder.PyopenmsChromPeakFinder().find_peaks(chrom)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_find_peak_borders(chrom: pd.DataFrame) -> None:
+    peaks = bordered(chrom)
+    chrom_ref, peaks_ref = chrom.copy(), peaks.copy()
+    expected = reference.find_peak_borders(chrom_ref, peaks_ref)
+    actual = PeakFinder.find_peak_borders(chrom, peaks)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    np.testing.assert_array_equal(chrom["intensity"], chrom_ref["intensity"])
+
+
+def test_trapezoid_areas(chrom: pd.DataFrame) -> None:
+    peaks = PeakFinder.find_peak_borders(chrom, bordered(chrom))
+    expected = reference.trapezoid_areas(chrom, peaks)
+    Integrator.ChromTrapezoidIntegrator().integrate(chrom, peaks)
+    # the fast path subtracts two running sums, which costs a few ulps of the total
+    scale = np.abs(chrom["intensity"]).sum()
+    np.testing.assert_allclose(peaks["area"], expected, rtol=1e-9, atol=1e-12 * scale)
@@ -0,0 +1,91 @@
+"""Min/max decimation of long lines and thumbnail rendering."""
+
+import pathlib
+import numpy as np
+import pytest
+from gcms.plotting import FastPlotting
+from . import synthetic
+
+pytest.importorskip("matplotlib")
+
+
+def bins(n: int, n_bins: int) -> list[slice]:
+    """The bins of decimate_minmax: consecutive runs of ceil(n / n_bins) points, the last one shorter"""
+    size = -(-n // n_bins)
+    return [slice(i, min(i + size, n)) for i in range(0, n, size)]
+
+
+@pytest.mark.parametrize("n, n_bins", [(10000, 300), (10007, 300), (999, 7)])
+def test_keeps_min_and_max_of_every_bin(n: int, n_bins: int) -> None:
+    rng = np.random.default_rng(n)
+    x = np.cumsum(rng.uniform(0.1, 1.0, n))
+    y = rng.normal(size=n).cumsum()
+    dx, dy = FastPlotting.decimate_minmax(x, y, n_bins)
+    assert len(dx) <= 2 * n_bins + 2
+    # a subset of the points, in the original order
+    assert np.all(np.diff(dx) > 0)
+    kept = np.searchsorted(x, dx)
+    np.testing.assert_array_equal(x[kept], dx)
+    np.testing.assert_array_equal(y[kept], dy)
+    for b in bins(n, n_bins):
+        inside = (kept >= b.start) & (kept < b.stop)
+        assert dy[inside].min() == y[b].min()
+        assert dy[inside].max() == y[b].max()
+    assert (dx[0], dx[-1]) == (x[0], x[-1])
+
+
+def test_x_range() -> None:
+    x = np.arange(10000, dtype=np.float64)
+    y = np.sin(x / 50.0) + np.random.default_rng(0).normal(0, 0.1, len(x))
+    dx, dy = FastPlotting.decimate_minmax(x, y, 50, x_range=(2000.5, 4000.5))
+    # one neighbor outside the range on each side, so the line reaches the border
+    assert (dx[0], dx[-1]) == (2000.0, 4001.0)
+    assert dy.max() == y[2000:4002].max()
+    assert dy.min() == y[2000:4002].min()
+    assert len(dx) <= 2 * 50 + 2
+
+    # a range with few points is not decimated
+    dx, dy = FastPlotting.decimate_minmax(x, y, 50, x_range=(100.0, 110.0))
+    np.testing.assert_array_equal(dx, x[99:112])
+    np.testing.assert_array_equal(dy, y[99:112])
+
+
+@pytest.mark.parametrize("n", [0, 1, 50, 102])
+def test_short_input_unchanged(n: int) -> None:
+    x = np.arange(n, dtype=np.float64)
+    y = np.random.default_rng(n).normal(size=n)
+    dx, dy = FastPlotting.decimate_minmax(x, y, 50)
+    np.testing.assert_array_equal(dx, x)
+    np.testing.assert_array_equal(dy, y)
+
+
+def test_decimated_line_follows_zoom() -> None:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    x = np.linspace(0, 1000, 200000)
+    y = np.sin(x)
+    fig = Figure(figsize=(4, 2), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    line = FastPlotting.DecimatedLine(ax, x, y)
+    assert len(line.line.get_xdata()) <= 2 * ax.bbox.width + 2
+    ax.set_xlim(100, 110)
+    shown = line.line.get_xdata()
+    assert shown[0] <= 100 and shown[-1] >= 110
+    assert shown[1] > 100 and shown[-2] < 110
+
+
+def test_render_thumbnails(tmp_path: pathlib.Path) -> None:
+    (tmp_path / "raw" / "n1").mkdir(parents=True)
+    run = synthetic.write_csv(
+        synthetic.chromatogram(seed=0, n=5000), tmp_path / "raw" / "n1" / "run0.csv"
+    )
+    broken = tmp_path / "raw" / "broken.csv"
+    broken.write_text("not,a\nchromatogram,file\n")
+    written = FastPlotting.render_thumbnails(
+        [run, broken], tmp_path / "thumbs", input_root=tmp_path / "raw"
+    )
+    # the broken file is logged and skipped
+    assert written == [tmp_path / "thumbs" / "n1__run0.png"]
+    assert written[0].read_bytes()[:8] == b"\x89PNG\r\n\x1a\n"
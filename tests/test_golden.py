@@ -0,0 +1,111 @@
+"""End-to-end peak tables of the synthetic reference inputs against the golden tables in tests/golden.
+
+After an intended change of results, rewrite the tables with `pytest tests/test_golden.py --update-golden` and
+review the diff.
+"""
+
+import pathlib
+import pandas as pd
+import pytest
+from gcms import Batch
+from . import synthetic
+
+COLUMNS = [
+    "index",
+    "retention_time",
+    "intensity",
+    "width",
+    "left_border",
+    "right_border",
+    "skim_parent",
+    "area",
+    "area_norm",
+]
+
+N = 8000
+STEP = (1800.0 - 60.0) / (N - 1)
+# snr of about 45 and 15 over the noise of the synthetic trace
+KEPT_PEAK = (1400.0, 2e4, 3.0)
+WEAK_PEAK = (1500.0, 8e3, 3.0)
+
+CASES = {
+    "default": ({}, {}),
+    "snr": (
+        {"min_snr": 20.0},
+        {"peaks": synthetic.REFERENCE_PEAKS + (KEPT_PEAK, WEAK_PEAK)},
+    ),
+    "tangent_skim": (
+        # borders reach at most 5 points from the apex: a rider under the default skim_ratio never shares a border
+        # with its parent, so the case skims with a generous ratio
+        {"min_snr": 5.0, "deconvolver": "tangent_skim", "skim_ratio": 0.9},
+        {
+            "peaks": synthetic.REFERENCE_PEAKS
+            + ((1000.0, 1.5e6, 3.0), (1002.0, 6e5, 0.4))
+        },
+    ),
+    "edge_peaks": (
+        {"min_snr": 5.0},
+        {
+            "peaks": ((60.0 + 2 * STEP, 5e5, 3.0),)
+            + synthetic.REFERENCE_PEAKS
+            + ((1800.0 - 2 * STEP, 5e5, 3.0),)
+        },
+    ),
+    "edge_peaks_cwt": (
+        {"peak_finder": "cwt", "min_snr": 5.0},
+        {
+            "peaks": ((60.0 + STEP, 5e5, 3.0),)
+            + synthetic.REFERENCE_PEAKS
+            + ((1800.0 - STEP, 5e5, 3.0),)
+        },
+    ),
+    "nonuniform_rt": ({"min_snr": 5.0}, {"rt_jitter": 0.3}),
+    "cwt": ({"peak_finder": "cwt", "min_snr": 5.0, "cwt_max_points": 2000}, {}),
+}
+
+
+def reaches_path(case: str, table: pd.DataFrame, path: pathlib.Path) -> bool:
+    """Whether a case exercises the code path it is named after, so a golden table can not freeze a no-op"""
+    if case == "snr":
+        unfiltered = peak_table(path, {})
+
+        def near(t: pd.DataFrame, peak: tuple) -> bool:
+            return bool(((t["retention_time"] - peak[0]).abs() < 5.0).any())
+
+        return (
+            near(unfiltered, WEAK_PEAK)
+            and not near(table, WEAK_PEAK)
+            and near(table, KEPT_PEAK)
+        )
+    if case == "tangent_skim":
+        riders = table[table["skim_parent"] >= 0]
+        return len(riders) > 0 and bool((riders["area"] > 0).all())
+    if case.startswith("edge_peaks"):
+        return table["left_border"].min() == 0 and table["right_border"].max() == N - 1
+    return True
+
+
+def peak_table(path: pathlib.Path, config: dict) -> pd.DataFrame:
+    p = Batch.process_file(path, Batch.PipelineConfig(**config))
+    return p.df.peaks[[c for c in COLUMNS if c in p.df.peaks.columns]]
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_csv(case: str, golden, tmp_path: pathlib.Path) -> None:
+    config, signal = CASES[case]
+    path = synthetic.write_csv(
+        synthetic.chromatogram(seed=1, **signal), tmp_path / "run.csv"
+    )
+    table = peak_table(path, config)
+    assert reaches_path(case, table, path)
+    golden.check(f"csv_{case}", table)
+
+
+@pytest.mark.parametrize("case", ["default", "snr"])
+def test_mzml(case: str, golden, tmp_path: pathlib.Path) -> None:
+    pytest.importorskip("pyopenms")
+    config, signal = CASES[case]
+    path = synthetic.write_mzml(
+        synthetic.chromatogram(seed=2, **signal), tmp_path / "run.mzML"
+    )
+    golden.check(f"mzml_{case}", peak_table(path, config))
@@ -0,0 +1,124 @@
+"""Incremental batches: reuse of unchanged runs and partition reports."""
+
+import dataclasses
+import os
+import pathlib
+import pytest
+from gcms import Batch, Incremental, Quantitation
+from . import synthetic
+
+
+@pytest.fixture
+def inputs(tmp_path: pathlib.Path) -> list[pathlib.Path]:
+    files = []
+    for night in ("night1", "night2"):
+        (tmp_path / "raw" / night).mkdir(parents=True)
+        for seed in range(3):
+            chrom = synthetic.chromatogram(seed=seed, n=2000)
+            files.append(
+                synthetic.write_csv(
+                    chrom, tmp_path / "raw" / night / f"{night}_run{seed}.csv"
+                )
+            )
+    return files
+
+
+def statuses(summary: Batch.BatchSummary) -> dict[str, str]:
+    return {r.input_path.name: r.status for r in summary.results}
+
+
+def test_reuse_unchanged(inputs: list[pathlib.Path], tmp_path: pathlib.Path) -> None:
+    store = Batch.ResultStore(tmp_path / "out")
+    config = Batch.PipelineConfig(min_snr=5.0)
+    first = Batch.run_batch(inputs, config, store, incremental=True)
+    assert first.count("done") == len(inputs)
+    reports = {
+        name: store.partition_path_for(name).stat().st_mtime_ns
+        for name in ("night1", "night2")
+    }
+
+    # touched without change, changed, new file
+    os.utime(inputs[0], ns=(0, 10**18))
+    changed = synthetic.chromatogram(seed=9, n=2000)
+    synthetic.write_csv(changed, inputs[4])
+    new = synthetic.write_csv(changed, inputs[0].parent / "night1_run9.csv")
+    second = Batch.run_batch([*inputs, new], config, store, incremental=True)
+
+    assert statuses(second) == {
+        "night1_run0.csv": "reused",
+        "night1_run1.csv": "reused",
+        "night1_run2.csv": "reused",
+        "night2_run0.csv": "reused",
+        "night2_run1.csv": "done",
+        "night2_run2.csv": "reused",
+        "night1_run9.csv": "done",
+    }
+    reused = next(r for r in second.results if r.input_path == inputs[1])
+    done = next(r for r in first.results if r.input_path == inputs[1])
+    assert reused.qc == pytest.approx(done.qc, nan_ok=True)
+    record = store.read_record(inputs[0])
+    assert record.fingerprint.mtime_ns == 10**18
+    assert record.partition == "night1"
+    # both partitions have a processed run, their reports are rewritten
+    for name, mtime in reports.items():
+        assert store.partition_path_for(name).stat().st_mtime_ns >= mtime
+    assert store.partition_runs("night1") == {str(f) for f in [*inputs[:3], new]}
+
+    # removing a run rewrites only its partition
+    before = store.partition_path_for("night1").stat().st_mtime_ns
+    third = Batch.run_batch([*inputs[:5], new], config, store, incremental=True)
+    assert third.count("reused") == 6
+    assert store.partition_runs("night2") == {str(f) for f in inputs[3:5]}
+    assert store.partition_path_for("night1").stat().st_mtime_ns == before
+
+
+def test_config_change_reprocesses(
+    inputs: list[pathlib.Path], tmp_path: pathlib.Path
+) -> None:
+    store = Batch.ResultStore(tmp_path / "out")
+    config = Batch.PipelineConfig(min_snr=5.0)
+    Batch.run_batch(inputs, config, store, incremental=True)
+    changed = dataclasses.replace(config, min_snr=4.0)
+    assert Incremental.pipeline_key(changed) != Incremental.pipeline_key(config)
+    summary = Batch.run_batch(inputs, changed, store, incremental=True)
+    assert summary.count("done") == len(inputs)
+
+
+def test_partitions(tmp_path: pathlib.Path) -> None:
+    files = [tmp_path / "a" / "x.csv", tmp_path / "a" / "b" / "y.csv"]
+    assert Batch.partitions(files) == {files[0]: ".", files[1]: "b"}
+
+
+def test_same_name_in_two_partitions(tmp_path: pathlib.Path) -> None:
+    files = []
+    for seed, night in enumerate(("night1", "night2")):
+        (tmp_path / "raw" / night).mkdir(parents=True)
+        chrom = synthetic.chromatogram(seed=seed, n=2000)
+        files.append(synthetic.write_csv(chrom, tmp_path / "raw" / night / "run01.csv"))
+    config = Batch.PipelineConfig(min_snr=5.0)
+    with pytest.raises(ValueError, match="run01"):
+        Batch.run_batch(files, config, Batch.ResultStore(tmp_path / "flat"))
+
+    store = Batch.ResultStore(tmp_path / "out", input_root=tmp_path / "raw")
+    first = Batch.run_batch(files, config, store, incremental=True)
+    assert first.count("done") == 2
+    assert store.path_for(files[0]).name == "night1__run01.peaks.csv"
+    assert store.path_for(files[1]).name == "night2__run01.peaks.csv"
+    runs = Quantitation.read_peak_tables(store.output_dir)["run"]
+    assert set(runs) == {"night1__run01", "night2__run01"}
+
+    second = Batch.run_batch(files, config, store, resume=True)
+    assert second.count("skipped") == 2
+    third = Batch.run_batch(files, config, store, incremental=True)
+    assert third.count("reused") == 2
+
+
+def test_input_root(tmp_path: pathlib.Path) -> None:
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    f = tmp_path / "a" / "b" / "y.csv"
+    f.touch()
+    assert Batch.input_root([tmp_path / "a", f]) == tmp_path / "a"
+    assert Batch.input_root([f]) == tmp_path / "a" / "b"
+    assert Batch.run_name(f, tmp_path / "a") == "b__y"
+    assert Batch.run_name(f, tmp_path / "c") == "y"
+    assert Batch.run_name(f) == "y"
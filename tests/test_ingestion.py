@@ -0,0 +1,82 @@
+"""Watching a directory: settling of new files, state of the watcher and the event loop."""
+
+import asyncio
+import pathlib
+import time
+import pytest
+from gcms import Batch, Ingestion
+from . import synthetic
+
+
+@pytest.fixture
+def service(tmp_path: pathlib.Path) -> Ingestion.IngestionService:
+    (tmp_path / "in").mkdir()
+    return Ingestion.IngestionService(
+        tmp_path / "in",
+        Batch.PipelineConfig(min_snr=5.0),
+        Batch.ResultStore(tmp_path / "out", input_root=tmp_path / "in"),
+        poll_interval=0.05,
+        settle_time=0.0,
+    )
+
+
+def write_run(directory: pathlib.Path, name: str, seed: int = 1) -> pathlib.Path:
+    return synthetic.write_csv(
+        synthetic.chromatogram(seed=seed, n=2000), directory / name
+    )
+
+
+def test_scan(service: Ingestion.IngestionService) -> None:
+    path = write_run(service.watch_dir, "run01.csv")
+    (service.watch_dir / ".run02.csv.tmp").write_text("partial")
+    # seen once, ready when unchanged at the next scan
+    assert service.scan() == []
+    assert [p for p, _ in service.scan()] == [path]
+    assert service.scan() == []
+
+    # a changed file is processed again
+    write_run(service.watch_dir, "run01.csv", seed=2)
+    assert service.scan() == []
+    assert [p for p, _ in service.scan()] == [path]
+
+    # removed files are forgotten
+    path.unlink()
+    assert service.scan() == []
+    assert service._queued == {} and service._candidates == {}
+
+
+def test_growing_file_is_not_ready(service: Ingestion.IngestionService) -> None:
+    path = service.watch_dir / "run01.csv"
+    path.write_text("retention_time,intensity\n")
+    for i in range(3):
+        with open(path, "a") as f:
+            f.write(f"{i},1\n")
+        assert service.scan() == []
+
+
+def test_run(service: Ingestion.IngestionService) -> None:
+    path = write_run(service.watch_dir, "run01.csv")
+    ticks = []
+
+    async def main() -> None:
+        stop = asyncio.Event()
+        task = asyncio.create_task(service.run(stop))
+        deadline = time.monotonic() + 60
+        while not service.store.exists(path) and time.monotonic() < deadline:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+
+    slow_scan = service.scan
+
+    def scan() -> list:
+        # a slow directory: the event loop must keep running meanwhile
+        time.sleep(0.2)
+        return slow_scan()
+
+    service.scan = scan
+    asyncio.run(main())
+    assert service.stats.done == 1 and service.stats.failed == 0
+    # the loop kept ticking while the scans were sleeping
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15
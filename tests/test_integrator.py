@@ -0,0 +1,61 @@
+"""Peak model integration: empty peak tables and the fit cache."""
+
+import logging
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Integrator
+from . import synthetic
+
+pytest.importorskip("lmfit")
+
+
+def test_empty_peak_table(tmp_path: pathlib.Path) -> None:
+    path = synthetic.write_csv(synthetic.chromatogram(seed=1), tmp_path / "run.csv")
+    p = Batch.process_file(
+        path, Batch.PipelineConfig(integrator="gaussian", min_snr=1e9)
+    )
+    assert len(p.df.peaks) == 0
+    assert {"area", "fit_success"} <= set(p.df.peaks.columns)
+
+
+def test_cache_is_bounded(tmp_path: pathlib.Path) -> None:
+    path = synthetic.write_csv(synthetic.chromatogram(seed=1), tmp_path / "run.csv")
+    p = Batch.process_file(path, Batch.PipelineConfig(min_snr=5.0))
+    chrom, peaks = p.df.chromatogram, p.df.peaks
+
+    unbounded = Integrator.ChromPeakModelIntegrator("gaussian")
+    unbounded.integrate(chrom, peaks)
+    expected = peaks["area"].to_numpy().copy()
+    assert len(unbounded._cache) == len(peaks)
+
+    bounded = Integrator.ChromPeakModelIntegrator("gaussian", max_cached=2)
+    for _ in range(2):
+        bounded.integrate(chrom, peaks)
+        assert len(bounded._cache) == 2
+        np.testing.assert_allclose(peaks["area"].to_numpy(), expected)
+
+
+def test_identical_clusters(caplog: pytest.LogCaptureFixture) -> None:
+    x = np.arange(300, dtype=np.float64)
+    intensity = 10 + sum(1000 * np.exp(-0.5 * ((x - c) / 3) ** 2) for c in (80, 200))
+    chrom = pd.DataFrame({"intensity": intensity})
+    peaks = pd.DataFrame(
+        {
+            "index": [80, 200],
+            "intensity": intensity[[80, 200]],
+            "left_border": [65, 185],
+            "right_border": [95, 215],
+            "width": [24.0, 24.0],
+            "width_height": [10.0, 10.0],
+        }
+    )
+    integrator = Integrator.ChromPeakModelIntegrator("gaussian")
+    with caplog.at_level(logging.WARNING):
+        integrator.integrate(chrom, peaks)
+    # both clusters have the same shape: one fit, written to both
+    assert len(integrator._cache) == 1
+    assert peaks["fit_success"].all()
+    np.testing.assert_allclose(peaks["area"], 1000 * 3 * np.sqrt(2 * np.pi), rtol=1e-3)
+    assert "fit failed" not in caplog.text
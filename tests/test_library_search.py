@@ -0,0 +1,141 @@
+"""Library index and search: self matches, the retention index window, the base peak filter and empty queries."""
+
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import LibrarySearch
+
+BINNING = LibrarySearch.Binning(mz_max=200.0)
+# name, retention index (None for no RI line), mz/intensity pairs
+ENTRIES = [
+    ("Toluene", 1042.0, [(91, 999), (92, 620), (65, 90), (39, 50)]),
+    ("Octane", 800.0, [(43, 999), (57, 350), (85, 300), (114, 80)]),
+    ("Limonene", 1030.0, [(68, 999), (93, 700), (136, 200), (121, 160)]),
+    ("Unknown", None, [(55, 999), (83, 500), (41, 400)]),
+]
+
+
+def write_msp(path: pathlib.Path, entries=ENTRIES) -> pathlib.Path:
+    lines = []
+    for name, ri, peaks in entries:
+        lines.append(f"Name: {name}")
+        if ri is not None:
+            lines.append(f"RI: {ri}")
+        lines.append(f"Num Peaks: {len(peaks)}")
+        lines.extend(f"{mz} {intensity};" for mz, intensity in peaks)
+        lines.append("")
+    path.write_text("\n".join(lines))
+    return path
+
+
+def query(peaks: list[tuple[float, float]]) -> np.ndarray:
+    mz, intensity = np.array(peaks, dtype=np.float64).T
+    return BINNING.bin_many([(mz, intensity)])
+
+
+@pytest.fixture
+def library(tmp_path: pathlib.Path) -> LibrarySearch.SpectralLibrary:
+    return LibrarySearch.load_library(write_msp(tmp_path / "lib.msp"), binning=BINNING)
+
+
+def test_read_msp(tmp_path: pathlib.Path) -> None:
+    entries = LibrarySearch.read_msp(write_msp(tmp_path / "lib.msp"))
+    assert [e.name for e in entries] == [name for name, _, _ in ENTRIES]
+    assert np.isnan(entries[-1].ri)
+    assert entries[0].ri == 1042.0
+    np.testing.assert_array_equal(entries[1].mz, [43, 57, 85, 114])
+
+
+def test_self_match(library: LibrarySearch.SpectralLibrary) -> None:
+    queries = np.vstack([query(peaks) for _, _, peaks in ENTRIES])
+    hits = library.search(queries, top_k=1)
+    assert list(hits["query"]) == list(range(len(ENTRIES)))
+    assert list(hits["name"]) == [name for name, _, _ in ENTRIES]
+    np.testing.assert_allclose(hits["score"], 1.0, rtol=1e-5)
+    # ranked hits: the self match comes first and scores fall off
+    hits = library.search(queries[:1], top_k=3, base_peak_top=None)
+    assert hits["name"].iloc[0] == "Toluene"
+    assert hits["score"].is_monotonic_decreasing
+
+
+def test_ri_window(tmp_path: pathlib.Path) -> None:
+    spectrum = ENTRIES[0][2]
+    entries = [("Early", 1000.0, spectrum), ("Late", 1500.0, spectrum)]
+    library = LibrarySearch.load_library(
+        write_msp(tmp_path / "lib.msp", entries), binning=BINNING
+    )
+    q = np.vstack([query(spectrum)] * 3)
+    hits = library.search(q, ri=np.array([1490.0, 1010.0, 1250.0]), ri_window=30.0)
+    # the third query is outside both windows
+    assert list(hits["query"]) == [0, 1]
+    assert list(hits["name"]) == ["Late", "Early"]
+    np.testing.assert_array_equal(hits["library_ri"], [1500.0, 1000.0])
+    # NaN disables the window of a query
+    hits = library.search(q[:1], ri=np.array([np.nan]), top_k=2)
+    assert sorted(hits["name"]) == ["Early", "Late"]
+
+
+def test_entries_without_ri_match_every_window(
+    library: LibrarySearch.SpectralLibrary,
+) -> None:
+    hits = library.search(query(ENTRIES[3][2]), ri=np.array([3000.0]), top_k=1)
+    assert list(hits["name"]) == ["Unknown"]
+
+
+def test_base_peak_filter(tmp_path: pathlib.Path) -> None:
+    entries = [("Base 91", 1000.0, [(91, 999), (150, 100)])]
+    library = LibrarySearch.load_library(
+        write_msp(tmp_path / "lib.msp", entries), binning=BINNING
+    )
+    # 91 is only the third most intense fragment of the query
+    q = query([(150, 999), (120, 900), (91, 800), (60, 100)])
+    assert library.search(q, base_peak_top=3)["name"].tolist() == ["Base 91"]
+    assert library.search(q, base_peak_top=2).empty
+    assert library.search(q, base_peak_top=None)["name"].tolist() == ["Base 91"]
+
+
+def test_min_score(library: LibrarySearch.SpectralLibrary) -> None:
+    q = query([(91, 999), (92, 620), (43, 999)])
+    assert library.search(q, top_k=1, base_peak_top=None, min_score=0.99).empty
+    assert not library.search(q, top_k=1, base_peak_top=None, min_score=0.5).empty
+
+
+def test_empty_queries(library: LibrarySearch.SpectralLibrary) -> None:
+    hits = library.search(np.zeros((0, BINNING.n_bins), dtype=np.float32))
+    assert hits.empty
+    assert list(hits.columns) == ["query", "rank", "name", "score", "library_ri"]
+    # a query without fragments has no base peak and matches nothing
+    assert library.search(np.zeros((1, BINNING.n_bins), dtype=np.float32)).empty
+
+
+def test_query_shape(library: LibrarySearch.SpectralLibrary) -> None:
+    with pytest.raises(ValueError):
+        library.search(np.zeros((1, 10), dtype=np.float32))
+
+
+def test_identify(library: LibrarySearch.SpectralLibrary) -> None:
+    spectra = [ENTRIES[1][2], ENTRIES[0][2], [(199, 10)]]
+    raw = BINNING.bin_raw(
+        [(np.array(p, float)[:, 0], np.array(p, float)[:, 1]) for p in spectra]
+    )
+    run = LibrarySearch.SpectrumSet(np.array([100.0, 200.0, 300.0]), raw, BINNING)
+    peaks = pd.DataFrame({"retention_time": [99.0, 201.0, 299.0]})
+    peaks = LibrarySearch.identify(peaks, run, library)
+    assert list(peaks["compound"]) == ["Octane", "Toluene", ""]
+    np.testing.assert_allclose(peaks["match_score"], [1.0, 1.0, 0.0], rtol=1e-5)
+    np.testing.assert_array_equal(peaks["library_ri"], [800.0, 1042.0, np.nan])
+
+    empty = LibrarySearch.identify(
+        pd.DataFrame({"retention_time": np.array([], dtype=float)}), run, library
+    )
+    assert empty.empty
+    assert {"compound", "match_score", "library_ri"} <= set(empty.columns)
+
+
+def test_index_rebuilt_on_change(tmp_path: pathlib.Path) -> None:
+    msp = write_msp(tmp_path / "lib.msp")
+    assert len(LibrarySearch.load_library(msp, binning=BINNING)) == len(ENTRIES)
+    write_msp(msp, ENTRIES[:2])
+    assert len(LibrarySearch.load_library(msp, binning=BINNING)) == 2
@@ -0,0 +1,117 @@
+"""Batched polynomial fits, their power basis, splines and the Processor fit helpers, compared with numpy."""
+
+import numpy as np
+import pytest
+import scipy
+from gcms import ModelFit, Processor
+
+
+@pytest.fixture
+def runs() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Three runs of raw retention times padded with NaN to a common length, and weights"""
+    rng = np.random.default_rng(2)
+    x = np.full((3, 40), np.nan)
+    y = np.full((3, 40), np.nan)
+    for i, n in enumerate((40, 31, 12)):
+        x[i, :n] = np.sort(rng.uniform(60 + 200 * i, 1800, n))
+        y[i, :n] = 1e5 + 50 * x[i, :n] - 0.02 * x[i, :n] ** 2 + rng.normal(0, 500, n)
+    weights = rng.uniform(0.5, 2.0, x.shape)
+    return x, y, weights
+
+
+@pytest.mark.parametrize("order", [1, 2, 4])
+@pytest.mark.parametrize("weighted", [False, True])
+def test_batch_matches_polyfit(runs, order: int, weighted: bool) -> None:
+    x, y, weights = runs
+    w = weights if weighted else None
+    batch = ModelFit.fit_polynomial_batch(x, y, order, w)
+    assert len(batch) == 3 and batch.order == order
+    power = batch.to_power_basis()
+    for i in range(len(x)):
+        valid = ~np.isnan(x[i])
+        # np.polyfit weights the residuals, not their squares
+        expected = np.polyfit(
+            x[i, valid],
+            y[i, valid],
+            order,
+            w=None if w is None else np.sqrt(w[i, valid]),
+        )
+        np.testing.assert_allclose(power[i], expected, rtol=1e-6)
+        grid = np.linspace(100, 1700, 9)
+        np.testing.assert_allclose(
+            batch[i].predict(grid), np.polyval(expected, grid), rtol=1e-8
+        )
+        np.testing.assert_allclose(batch.predict(grid)[i], batch[i].predict(grid))
+
+
+def test_zero_weights_ignored(runs) -> None:
+    x, y, _ = runs
+    weights = np.ones_like(x)
+    weights[0, :5] = 0.0
+    y = y.copy()
+    y[0, :5] = 1e12
+    model = ModelFit.fit_polynomial_batch(x, y, 2, weights)[0]
+    expected = np.polyfit(x[0, 5:], y[0, 5:], 2)
+    np.testing.assert_allclose(model.to_power_basis(), expected, rtol=1e-6)
+
+
+def test_degenerate_rows(runs) -> None:
+    x, y, _ = runs
+    x, y = x.copy(), y.copy()
+    # all samples at one x, and only two distinct x for a quadratic
+    x[1, :31] = 500.0
+    x[2, :12] = np.repeat([300.0, 900.0], 6)
+    batch = ModelFit.fit_polynomial_batch(x, y, 2)
+    assert np.isfinite(batch.coef).all()
+    np.testing.assert_allclose(batch[1].predict(500.0), np.nanmean(y[1]))
+    for xi in (300.0, 900.0):
+        np.testing.assert_allclose(
+            batch[2].predict(xi), y[2, :12][x[2, :12] == xi].mean()
+        )
+    # the regular row is unaffected
+    np.testing.assert_allclose(
+        batch.to_power_basis()[0], np.polyfit(x[0], y[0], 2), rtol=1e-6
+    )
+
+
+def test_errors(runs) -> None:
+    x, y, _ = runs
+    with pytest.raises(ValueError):
+        ModelFit.fit_polynomial_batch(x, y[:, :10])
+    with pytest.raises(ValueError):
+        # the third run has only 12 samples
+        ModelFit.fit_polynomial_batch(x, y, order=12)
+
+
+def test_fit_polynomial_single_run(runs) -> None:
+    x, y, _ = runs
+    model = ModelFit.fit_polynomial(x[0], y[0], 3)
+    assert model.coef.shape == (4,)
+    np.testing.assert_allclose(
+        model.to_power_basis(), np.polyfit(x[0], y[0], 3), rtol=1e-6
+    )
+
+
+def test_fit_spline() -> None:
+    x = np.linspace(60, 1800, 500)
+    y = 1e-6 * (x - 900) ** 3 + 0.3 * x
+    spline = ModelFit.fit_spline(x, y, n_knots=6)
+    # a cubic spline reproduces a cubic exactly
+    np.testing.assert_allclose(spline(x), y, rtol=1e-8, atol=1e-6)
+    assert isinstance(spline, scipy.interpolate.BSpline)
+    assert len(spline.t) == 6 + 2 * 4
+
+
+def test_processor_fit_model() -> None:
+    a = np.array([2e-10, -3e-7, 1e-4, 2.0, 500.0])
+    x = np.linspace(60, 1800, 200)
+    y = Processor.func(x, *a)
+    params = Processor.fit_model(x, y)
+    np.testing.assert_allclose(Processor.calc_predict(x, params), y, rtol=1e-8)
+    np.testing.assert_allclose(params, np.polyfit(x, y, 4), rtol=1e-5)
+    assert Processor.calc_predict(1000.0, params) == pytest.approx(
+        Processor.func(1000.0, *a)
+    )
+    np.testing.assert_allclose(
+        Processor.fit_model(x, 3 * x + 1, order=1), [3.0, 1.0], rtol=1e-10
+    )
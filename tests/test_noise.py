@@ -0,0 +1,48 @@
+"""Noise estimation and per-peak signal to noise ratio."""
+
+import pathlib
+import warnings
+import numpy as np
+import pytest
+from gcms import Batch, Filter, Noise
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+@pytest.mark.parametrize(
+    "estimator", [Noise.RollingMadNoise(), Noise.PercentileNoise()]
+)
+def test_white_noise(estimator: Noise.NoiseEstimator) -> None:
+    chrom = synthetic.chromatogram(seed=1, peaks=(), noise=500.0)
+    estimate = estimator.estimate(chrom["intensity"].to_numpy())
+    assert np.median(estimate.noise) == pytest.approx(500.0, rel=0.1)
+    # smoothing correlates neighboring points: the filtered trace looks about half as noisy
+    smoothed = estimator.estimate(Filter.SavgolFilter(5, 2).apply(chrom))
+    assert np.median(smoothed.noise) < 0.6 * np.median(estimate.noise)
+
+
+def test_peaks_snr_on_raw_trace(tmp_path: pathlib.Path) -> None:
+    path = synthetic.write_csv(synthetic.chromatogram(seed=1), tmp_path / "run.csv")
+    peaks = Batch.process_file(path, Batch.PipelineConfig(min_snr=5.0)).df.peaks
+    # no noise peaks pass; the picker merges the co-eluting pair at 905/912
+    reference = np.array([rt for rt, _, _ in synthetic.REFERENCE_PEAKS])
+    distance = np.abs(peaks["retention_time"].to_numpy()[:, None] - reference)
+    assert len(peaks) >= 6 and (distance.min(axis=1) < 10).all()
+    # the blocks of large peaks are noisier, but none is close to the ~250 of the filtered trace
+    assert peaks["noise"].between(400.0, 800.0).all()
+
+
+@pytest.mark.parametrize(
+    "estimator", [Noise.RollingMadNoise(100), Noise.PercentileNoise(100)]
+)
+@pytest.mark.parametrize("n", [1001, 1002, 1000, 1050, 99, 2])
+def test_block_tail(estimator: Noise.NoiseEstimator, n: int) -> None:
+    y = np.random.default_rng(0).normal(2000.0, 500.0, n)
+    with warnings.catch_warnings():
+        # an empty block warns 'All-NaN slice encountered'
+        warnings.simplefilter("error", RuntimeWarning)
+        estimate = estimator.estimate(y)
+    assert np.isfinite(estimate.baseline).all()
+    assert np.isfinite(estimate.noise).all()
+    assert len(estimate.noise) == n
@@ -0,0 +1,116 @@
+"""Group-wise area normalization of combined peak tables, compared with a plain groupby."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Integrator
+
+REFERENCE_RT = 500.0
+RUNS = ["a_IS", "b", "c_IS", "d_IS"]
+
+
+@pytest.fixture
+def peaks() -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    tables = {
+        run: pd.DataFrame(
+            {
+                "retention_time": np.sort(rng.uniform(60, 1800, 12)),
+                "area": rng.uniform(1e3, 1e6, 12),
+            }
+        )
+        for run in RUNS
+    }
+    for table in tables.values():
+        table.loc[5, "retention_time"] = REFERENCE_RT + 2
+    # a tie: two peaks at the same distance from the reference, the first row wins
+    tables["c_IS"].loc[[3, 4], "retention_time"] = [REFERENCE_RT - 1, REFERENCE_RT + 1]
+    # no peak near the reference
+    tables["d_IS"]["retention_time"] = np.linspace(1000, 1800, 12)
+    return Integrator.concat_runs(tables)
+
+
+def expected(
+    peaks: pd.DataFrame, mode: str, rt_tolerance: float | None = None
+) -> np.ndarray:
+    by_run = peaks.groupby("run", sort=False)
+    if mode == "max":
+        return (peaks["area"] / by_run["area"].transform("max")).to_numpy()
+    if mode == "total":
+        return (peaks["area"] / by_run["area"].transform("sum")).to_numpy()
+    distance = (peaks["retention_time"] - REFERENCE_RT).abs()
+    nearest = distance.groupby(peaks["run"]).idxmin()
+    reference = pd.Series(peaks.loc[nearest, "area"].to_numpy(), index=nearest.index)
+    if rt_tolerance is not None:
+        reference[distance[nearest].to_numpy() > rt_tolerance] = np.nan
+    if mode == "internal_standard":
+        reference[~reference.index.str.contains("_IS")] = np.nan
+    return (peaks["area"] / peaks["run"].map(reference)).to_numpy()
+
+
+def norm(peaks: pd.DataFrame, mode: str, **args) -> np.ndarray:
+    Integrator.ChromTrapezoidIntegrator().norm_area(peaks, mode, **args)
+    return peaks["area_norm"].to_numpy()
+
+
+def test_concat_runs(peaks: pd.DataFrame) -> None:
+    assert list(peaks["run"].unique()) == RUNS
+    assert len(peaks) == 12 * len(RUNS)
+    assert Integrator.concat_runs({}).empty
+    renamed = Integrator.concat_runs({"x": peaks.head(2)}, group_by="sample")
+    assert renamed["sample"].tolist() == ["x", "x"]
+
+
+@pytest.mark.parametrize("mode", ["max", "total"])
+def test_area_modes(peaks: pd.DataFrame, mode: str) -> None:
+    np.testing.assert_allclose(norm(peaks, mode), expected(peaks, mode))
+
+
+@pytest.mark.parametrize("mode", ["reference", "internal_standard"])
+@pytest.mark.parametrize("rt_tolerance", [None, 5.0])
+def test_reference_modes(
+    peaks: pd.DataFrame, mode: str, rt_tolerance: float | None
+) -> None:
+    result = norm(peaks, mode, reference_rt=REFERENCE_RT, rt_tolerance=rt_tolerance)
+    np.testing.assert_allclose(result, expected(peaks, mode, rt_tolerance))
+    run = peaks["run"].to_numpy()
+    # the tie goes to the earlier row; the reference peak itself is 1
+    assert result[(run == "c_IS")][3] == 1.0
+    # a run without a peak in tolerance, or without internal standard, is not normalized
+    assert np.isnan(result[run == "d_IS"]).all() == (rt_tolerance is not None)
+    assert np.isnan(result[run == "b"]).all() == (mode == "internal_standard")
+
+
+def test_group_by(peaks: pd.DataFrame) -> None:
+    grouped = peaks.rename(columns={"run": "sample"})
+    np.testing.assert_allclose(
+        norm(grouped, "max", group_by="sample"), expected(peaks, "max")
+    )
+    # rows of the runs interleaved
+    shuffled = peaks.sample(frac=1.0, random_state=0).reset_index(drop=True)
+    np.testing.assert_allclose(
+        norm(shuffled, "reference", reference_rt=REFERENCE_RT),
+        expected(shuffled, "reference"),
+    )
+    # without the column the whole table is one run
+    np.testing.assert_allclose(
+        norm(peaks.drop(columns="run"), "total"),
+        peaks["area"] / peaks["area"].sum(),
+    )
+
+
+def test_missing_reference_logged(
+    peaks: pd.DataFrame, caplog: pytest.LogCaptureFixture
+) -> None:
+    norm(peaks, "reference", reference_rt=REFERENCE_RT, rt_tolerance=5.0)
+    assert "d_IS" in caplog.text
+
+
+def test_errors(peaks: pd.DataFrame) -> None:
+    integrator = Integrator.ChromTrapezoidIntegrator()
+    with pytest.raises(ValueError):
+        integrator.norm_area(peaks, "median")
+    with pytest.raises(ValueError):
+        integrator.norm_area(peaks, "reference")
+    with pytest.raises(ValueError):
+        integrator.norm_area(peaks.drop(columns="area"))
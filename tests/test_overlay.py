@@ -0,0 +1,131 @@
+"""Peak border points and integration polygons for plots."""
+
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Deconvolver, Integrator
+from gcms.plotting import Overlay
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+def border_loop(chrom: pd.DataFrame, peaks: pd.DataFrame) -> pd.DataFrame:
+    """The former per-peak loop of Processor.create_peak_border_df"""
+    border_rt = []
+    border_intensity = []
+    for i in peaks.index:
+        m = chrom.iloc[peaks["left_border"].iloc[i]]
+        n = chrom.iloc[peaks["right_border"].iloc[i]]
+        border_rt.append(m["retention_time"])
+        border_intensity.append(m["intensity"])
+        border_rt.append(n["retention_time"])
+        border_intensity.append(n["intensity"])
+    return pd.DataFrame({"retention_time": border_rt, "intensity": border_intensity})
+
+
+def trace(*peaks: tuple[float, float, float], n: int = 200) -> pd.DataFrame:
+    """Noise-free gaussians (apex index, height, sigma in points) on a baseline of 10; retention time = index"""
+    x = np.arange(n, dtype=np.float64)
+    intensity = np.full(n, 10.0)
+    for apex, height, sigma in peaks:
+        intensity += height * np.exp(-0.5 * ((x - apex) / sigma) ** 2)
+    return pd.DataFrame({"retention_time": x, "intensity": intensity})
+
+
+def shoelace(polygon: np.ndarray) -> float:
+    x, y = polygon[:, 0], polygon[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def test_border_points_like_loop(tmp_path: pathlib.Path) -> None:
+    path = synthetic.write_csv(synthetic.chromatogram(seed=2), tmp_path / "run.csv")
+    p = Batch.process_file(path, Batch.PipelineConfig(deconvolver="valley_drop"))
+    chrom, peaks = p.df.chromatogram, p.df.peaks.reset_index(drop=True)
+    assert len(peaks) > 5
+    expected = border_loop(chrom, peaks)
+    pd.testing.assert_frame_equal(Overlay.border_points(chrom, peaks), expected)
+    pd.testing.assert_frame_equal(p.create_peak_border_df(), expected)
+    assert Overlay.border_points(chrom, peaks.iloc[:0]).empty
+
+
+def test_border_errors() -> None:
+    chrom = trace((50, 1000, 3))
+    with pytest.raises(ValueError):
+        Overlay.border_points(chrom, pd.DataFrame({"left_border": [40]}))
+    with pytest.raises(ValueError):
+        Overlay.peak_polygons(
+            chrom, pd.DataFrame({"left_border": [40], "right_border": [200]})
+        )
+
+
+def test_adjacent_peaks() -> None:
+    chrom = trace((50, 1000, 3), (62, 600, 2), (150, 400, 3))
+    peaks = pd.DataFrame(
+        {
+            "index": [50, 62, 150],
+            "intensity": chrom["intensity"].to_numpy()[[50, 62, 150]],
+            "left_border": [38, 55, 140],
+            "right_border": [60, 70, 160],
+        }
+    )
+    peaks = Deconvolver.ValleyDropDeconvolver().deconvolve(chrom, peaks)
+    polygons = Overlay.peak_polygons(chrom, peaks)
+    left, right = peaks["left_border"].to_numpy(), peaks["right_border"].to_numpy()
+    widest = int((right - left).max()) + 1
+    assert polygons.shape == (3, widest + 2, 2)
+
+    rt, intensity = chrom["retention_time"].to_numpy(), chrom["intensity"].to_numpy()
+    for i, (lo, hi) in enumerate(zip(left, right)):
+        n = hi - lo + 1
+        np.testing.assert_array_equal(polygons[i, :n, 0], rt[lo : hi + 1])
+        np.testing.assert_array_equal(polygons[i, :n, 1], intensity[lo : hi + 1])
+        # narrower peaks repeat their last curve point
+        assert (polygons[i, n:widest] == polygons[i, n - 1]).all()
+        # closed along the zero baseline
+        np.testing.assert_array_equal(polygons[i, -2], [rt[hi], 0.0])
+        np.testing.assert_array_equal(polygons[i, -1], [rt[lo], 0.0])
+    # neighbours meet at the shared valley point
+    np.testing.assert_array_equal(polygons[0, right[0] - left[0]], polygons[1, 0])
+
+    Integrator.ChromTrapezoidIntegrator().integrate(chrom, peaks)
+    areas = [shoelace(polygon) for polygon in polygons]
+    np.testing.assert_allclose(areas, peaks["area"])
+
+
+def test_skimmed_rider() -> None:
+    chrom = trace((60, 10000, 5), (80, 500, 2))
+    peaks = pd.DataFrame(
+        {
+            "index": [60, 80],
+            "intensity": chrom["intensity"].to_numpy()[[60, 80]],
+            "left_border": [40, 72],
+            "right_border": [80, 88],
+        }
+    )
+    peaks = Deconvolver.TangentSkimDeconvolver(0.1).deconvolve(chrom, peaks)
+    assert peaks["skim_parent"].tolist() == [-1, 0]
+    polygons = Overlay.peak_polygons(chrom, peaks)
+
+    rt = chrom["retention_time"].to_numpy()
+    left, right = peaks["left_border"].to_numpy(), peaks["right_border"].to_numpy()
+    # the rider is closed along its tangent, the parent (NaN baseline) along zero
+    np.testing.assert_array_equal(
+        polygons[1, -2], [rt[right[1]], peaks["baseline_right"][1]]
+    )
+    np.testing.assert_array_equal(
+        polygons[1, -1], [rt[left[1]], peaks["baseline_left"][1]]
+    )
+    np.testing.assert_array_equal(polygons[0, -2:, 1], [0.0, 0.0])
+
+    Integrator.ChromTrapezoidIntegrator().integrate(chrom, peaks)
+    # the rider polygon is the area above the tangent; the parent polygon still covers the rider
+    assert shoelace(polygons[1]) == pytest.approx(peaks["area"][1])
+    assert shoelace(polygons[0]) == pytest.approx(peaks["area"][0] + peaks["area"][1])
+
+
+def test_no_peaks() -> None:
+    chrom = trace((50, 1000, 3))
+    empty = pd.DataFrame({"left_border": [], "right_border": []}, dtype=np.int64)
+    assert Overlay.peak_polygons(chrom, empty).shape == (0, 0, 2)
@@ -0,0 +1,38 @@
+"""CWT peak picking on the synthetic reference trace."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Filter, Noise, PeakFinder
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+@pytest.fixture(scope="module")
+def chrom() -> pd.DataFrame:
+    raw = synthetic.chromatogram(seed=1)
+    return raw.assign(intensity=Filter.SavgolFilter(5, 2).apply(raw))
+
+
+@pytest.mark.parametrize("max_points", [None, 2000], ids=["full", "decimated"])
+def test_cwt_finds_reference_peaks(chrom: pd.DataFrame, max_points: int | None) -> None:
+    finder = PeakFinder.CwtChromPeakFinder(
+        max_points=max_points, noise=Noise.RollingMadNoise(), min_snr=5.0
+    )
+    peaks = finder.find_peaks(chrom)
+    # the pair at 905/912 is one apex with a shoulder
+    expected = [rt for rt, _, _ in synthetic.REFERENCE_PEAKS if rt != 912.0]
+    np.testing.assert_allclose(peaks["retention_time"], expected, atol=1.0)
+    assert (peaks["prominence"] > 0).all()
+    intensity = chrom["intensity"].to_numpy()
+    index = peaks["index"].to_numpy()
+    assert (intensity[index] >= intensity[index - 1]).all()
+    assert (intensity[index] >= intensity[index + 1]).all()
+
+
+def test_cwt_snr_settings() -> None:
+    finder = Batch.build_processor(
+        Batch.PipelineConfig(peak_finder="cwt", min_snr=0.0, cwt_ridge_snr=2.0)
+    ).peak_finder
+    assert finder.min_snr == 0.0 and finder.ridge_snr == 2.0
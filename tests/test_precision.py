@@ -0,0 +1,64 @@
+"""Compact precision against double precision on the synthetic reference inputs."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Precision, Transport
+from . import synthetic
+
+
+@pytest.fixture
+def chrom() -> pd.DataFrame:
+    peaks = tuple((rt + 3540.0, h, w) for rt, h, w in synthetic.REFERENCE_PEAKS)
+    return synthetic.chromatogram(seed=3, rt_range=(3600.0, 5400.0), peaks=peaks)
+
+
+def test_compact_chromatogram(chrom: pd.DataFrame) -> None:
+    compact = Precision.compact_chromatogram(chrom, rt_offset=True)
+    assert list(compact.columns) == ["retention_time", "intensity"]
+    assert (compact.dtypes == np.float32).all()
+    assert Precision.memory_usage(compact) * 3 == Precision.memory_usage(chrom)
+    rt = Precision.retention_time(compact)
+    assert rt.dtype == np.float64
+    np.testing.assert_allclose(rt, chrom["retention_time"], rtol=0, atol=1e-3)
+    # converting twice keeps the absolute retention times
+    again = Precision.compact_chromatogram(compact, rt_offset=True)
+    np.testing.assert_array_equal(Precision.retention_time(again), rt)
+
+
+@pytest.mark.parametrize("rt_offset", [False, True])
+def test_pipeline(chrom: pd.DataFrame, tmp_path, rt_offset: bool) -> None:
+    path = synthetic.write_csv(chrom, tmp_path / "run.csv")
+    double = Batch.process_file(path, Batch.PipelineConfig(min_snr=5.0))
+    p = Batch.process_file(
+        path,
+        Batch.PipelineConfig(min_snr=5.0, precision="compact", rt_offset=rt_offset),
+    )
+    assert "index" not in p.df.chromatogram.columns
+    assert p.df.chromatogram["intensity"].dtype == np.float32
+    peaks, expected = p.df.peaks, double.df.peaks
+    for c in Precision.POSITION_COLUMNS:
+        if c in peaks.columns:
+            assert peaks[c].dtype == np.int32
+            np.testing.assert_array_equal(peaks[c], expected[c])
+    np.testing.assert_allclose(
+        peaks["retention_time"], expected["retention_time"], atol=1e-3
+    )
+    np.testing.assert_allclose(peaks["area"], expected["area"], rtol=1e-5)
+
+
+def test_process_traces_keeps_rt_base(chrom: pd.DataFrame) -> None:
+    config = Batch.PipelineConfig(min_snr=5.0, precision="compact", rt_offset=True)
+    single, pooled = (
+        Batch.process_traces([chrom, chrom], config, jobs=jobs) for jobs in (1, 2)
+    )
+    for a, b in zip(single, pooled):
+        pd.testing.assert_frame_equal(a, b)
+    assert single[0]["retention_time"].min() > 3600.0
+
+
+def test_transport_attrs(chrom: pd.DataFrame) -> None:
+    compact = Precision.compact_chromatogram(chrom, rt_offset=True)
+    with Transport.SharedFrameStore() as store:
+        df = Transport.read_frame(store.share(compact))
+    assert df.attrs == compact.attrs
@@ -0,0 +1,47 @@
+"""Versions of a chromatogram: shared columns and read-only data."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Processor
+from . import synthetic
+
+
+@pytest.fixture
+def df() -> Processor.ChromatogramDF:
+    df = Processor.ChromatogramDF()
+    df.init_chromatogram(synthetic.chromatogram(seed=1, n=500))
+    return df
+
+
+def test_derive_shares_columns(df: Processor.ChromatogramDF) -> None:
+    og = df.chromatogram_og
+    filtered = og["intensity"].to_numpy() * 2
+    first = df.derive("double", intensity=filtered)
+    second = df.derive("shift", retention_time=og["retention_time"].to_numpy() + 1)
+
+    assert np.shares_memory(first["retention_time"].to_numpy(), og["retention_time"])
+    assert np.shares_memory(first["intensity"].to_numpy(), filtered)
+    assert np.shares_memory(second["intensity"].to_numpy(), filtered)
+    assert [d.step for d in df.lineage] == ["double", "shift"]
+    # the array passed to derive stays writable for its owner
+    assert filtered.flags.writeable
+
+
+def test_versions_are_not_changed_in_place(df: Processor.ChromatogramDF) -> None:
+    og = df.chromatogram_og.copy(deep=True)
+    first = df.derive("double", intensity=og["intensity"].to_numpy() * 2)
+    before = first.copy(deep=True)
+    second = df.derive("noop")
+    try:
+        second.loc[0, "intensity"] = -1.0
+    except ValueError as e:
+        # without copy-on-write (pandas < 3) the read-only column can not be written
+        assert "read-only" in str(e)
+    pd.testing.assert_frame_equal(first, before)
+    pd.testing.assert_frame_equal(df.chromatogram_og, og)
+
+    # replacing a column of a shallow copy leaves the version unchanged
+    copy = second.copy(deep=False)
+    copy["intensity"] = np.zeros(len(copy))
+    pd.testing.assert_frame_equal(first, before)
@@ -0,0 +1,93 @@
+"""Profiling of pipeline stages per file and across batches."""
+
+import json
+import pathlib
+import time
+import pandas as pd
+import pytest
+from gcms import Batch, Profiling
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+def busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_nested_stages() -> None:
+    profiler = Profiling.SamplingProfiler(interval=0.001)
+    with profiler.stage("outer"):
+        busy(0.05)
+        with profiler.stage("inner"):
+            busy(0.1)
+    profile = profiler.result("run.csv", total=0.2)
+
+    assert list(profile.seconds) == ["outer", "inner", Profiling.OTHER]
+    assert profile.seconds["inner"] == pytest.approx(0.1, abs=0.03)
+    assert profile.seconds["outer"] == pytest.approx(0.05, abs=0.03)
+    assert profile.total == pytest.approx(0.2)
+    # stacks start at the frame that entered the stage
+    inner = {k: v for k, v in profile.stacks.items() if k.startswith("inner;")}
+    assert all(k.split(";")[1].startswith("test_nested_stages") for k in inner)
+    assert sum(inner.values()) == pytest.approx(0.1, abs=0.03)
+    busy_rows = profile.functions[profile.functions["function"].str.startswith("busy")]
+    assert set(busy_rows["stage"]) == {"outer", "inner"}
+
+
+def test_cprofile_processor(tmp_path: pathlib.Path) -> None:
+    path = synthetic.write_csv(synthetic.chromatogram(seed=1), tmp_path / "run.csv")
+    config = Batch.PipelineConfig(min_snr=5.0)
+    profiler = Profiling.CProfileProfiler()
+    p = Batch.process_file(path, config, profiler=profiler)
+    profile = profiler.result(str(path))
+
+    assert list(profile.seconds) == [
+        "read",
+        "filter",
+        "find_peaks",
+        "find_peak_borders",
+        "integrate",
+        "normalize",
+        "qc",
+    ]
+    calls = profile.functions.set_index(["stage", "function"])["calls"]
+    assert calls.filter(like="find_peak_borders (PeakFinder.py").sum() == 1
+    pd.testing.assert_frame_equal(p.df.peaks, Batch.process_file(path, config).df.peaks)
+
+
+def test_batch_profiles(tmp_path: pathlib.Path) -> None:
+    inputs = [
+        synthetic.write_csv(
+            synthetic.chromatogram(seed=s, n=3000), tmp_path / f"run{s}.csv"
+        )
+        for s in range(3)
+    ]
+    store = Batch.ResultStore(tmp_path / "out")
+    summary = Batch.run_batch(
+        inputs, Batch.PipelineConfig(min_snr=5.0), store, profile="sample"
+    )
+    profiles = summary.profiles()
+    assert [p.input_path for p in profiles] == [str(f) for f in inputs]
+
+    stages = pd.read_csv(store.profile_dir / "stages.csv")
+    assert stages["input_path"].tolist() == [str(f) for f in inputs]
+    assert {"read", "find_peaks", "write"} <= set(stages.columns)
+    for line in (store.profile_dir / "profile.collapsed").read_text().splitlines():
+        stack, weight = line.rsplit(" ", 1)
+        assert stack.split(";")[0] in stages.columns and int(weight) > 0
+    speedscope = json.loads((store.profile_dir / "profile.speedscope.json").read_text())
+    assert len(speedscope["profiles"]) == 1 + len(inputs)
+
+    top = Profiling.top_files(profiles, 2)
+    assert len(top) == 2 and top["seconds"].is_monotonic_decreasing
+    assert str(top["input_path"][0]) in Profiling.report(profiles, 2)
+
+
+def test_unknown_mode(tmp_path: pathlib.Path) -> None:
+    with pytest.raises(ValueError, match="profile mode"):
+        Batch.run_batch(
+            [], Batch.PipelineConfig(), Batch.ResultStore(tmp_path), profile="perf"
+        )
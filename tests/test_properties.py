@@ -0,0 +1,139 @@
+"""Property-based tests of the fast paths against their references on edge cases.
+
+Covers peaks at index 0 and at the last index, plateaus (equal neighbors), zero-width peaks and non-uniform
+retention time spacing.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Integrator, PeakFinder
+from . import reference
+
+hypothesis = pytest.importorskip("hypothesis")
+from hypothesis import example, given, settings, strategies as st  # noqa: E402
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+
+@st.composite
+def signals(draw: st.DrawFn, min_size: int = 3, max_size: int = 60) -> np.ndarray:
+    """Intensities; few distinct levels give plateaus and flat stretches"""
+    levels = draw(st.sampled_from([3, 50, 10**6]))
+    values = draw(
+        st.lists(st.integers(0, levels - 1), min_size=min_size, max_size=max_size)
+    )
+    return np.asarray(values, dtype=np.float64) * 1000.0
+
+
+@st.composite
+def retention_times(draw: st.DrawFn, n: int) -> np.ndarray:
+    """Strictly increasing, non-uniformly spaced retention times"""
+    steps = draw(st.lists(st.floats(0.01, 10.0), min_size=n - 1, max_size=n - 1))
+    start = draw(st.floats(0.0, 1000.0))
+    return start + np.concatenate(([0.0], np.cumsum(steps)))
+
+
+@st.composite
+def signals_with_peaks(draw: st.DrawFn) -> tuple[np.ndarray, np.ndarray]:
+    """Intensities and sorted, unique peak positions; the first and last data point are drawn often"""
+    intensity = draw(signals())
+    n = len(intensity)
+    index = draw(
+        st.sets(
+            st.one_of(st.sampled_from([0, n - 1]), st.integers(0, n - 1)),
+            min_size=1,
+            max_size=n,
+        )
+    )
+    return intensity, np.array(sorted(index), dtype=np.intp)
+
+
+def as_chrom(intensity: np.ndarray, rt: np.ndarray | None = None) -> pd.DataFrame:
+    n = len(intensity)
+    rt = np.arange(n, dtype=np.float64) if rt is None else rt
+    return pd.DataFrame(
+        {"index": np.arange(n), "retention_time": rt, "intensity": intensity}
+    )
+
+
+def as_peaks(chrom: pd.DataFrame, index: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "index": index,
+            "retention_time": chrom["retention_time"].to_numpy()[index],
+            "intensity": chrom["intensity"].to_numpy()[index],
+        }
+    )
+
+
+@given(signals_with_peaks())
+@example((np.array([5.0, 5.0, 5.0, 5.0]), np.array([0, 3])))
+@example((np.array([1.0, 9.0, 9.0, 1.0, 9.0]), np.array([0, 2, 4])))
+@settings(deadline=None)
+def test_refine_apex(case: tuple[np.ndarray, np.ndarray]) -> None:
+    intensity, index = case
+    chrom = as_chrom(intensity)
+    expected = reference.correct_apex(chrom, index.tolist())
+    actual = PeakFinder._refine_apex(intensity, index, PeakFinder.APEX_RADIUS)
+    np.testing.assert_array_equal(actual, expected["index"])
+
+
+@given(st.data())
+@settings(deadline=None)
+def test_export_df_indices(data: st.DataObject) -> None:
+    oms = pytest.importorskip("pyopenms")
+    from gcms.pyopenms_client import PyOpenMsClient as omsc
+
+    n = data.draw(st.integers(3, 40))
+    rt = data.draw(retention_times(n))
+    span = (rt[0] - 5.0, rt[-1] + 5.0)
+    peak_rt = np.sort(data.draw(st.lists(st.floats(*span), min_size=1, max_size=n + 2)))
+    mschrom, peaks = oms.MSChromatogram(), oms.MSChromatogram()
+    mschrom.set_peaks([rt, np.ones(n)])
+    peaks.set_peaks([peak_rt, np.ones(len(peak_rt))])
+    try:
+        expected = reference.export_df_indices(rt, peak_rt)
+    except AssertionError:
+        with pytest.raises(AssertionError):
+            omsc.export_df(mschrom, peaks)
+        return
+    actual = omsc.export_df(mschrom, peaks)[1]["index"].to_numpy()
+    np.testing.assert_array_equal(actual, expected)
+
+
+@given(signals_with_peaks())
+@example((np.array([0.0, 7.0, 7.0, 7.0, 0.0]), np.array([2])))
+@example((np.array([4.0, 1.0, 1.0, 1.0, 4.0]), np.array([0, 4])))
+@example((np.full(6, 3.0), np.array([0, 2, 5])))
+@settings(deadline=None)
+def test_find_peak_borders(case: tuple[np.ndarray, np.ndarray]) -> None:
+    intensity, index = case
+    chrom = as_chrom(intensity)
+    peaks = as_peaks(chrom, index)
+    chrom_ref, peaks_ref = chrom.copy(), peaks.copy()
+    expected = reference.find_peak_borders(chrom_ref, peaks_ref)
+    actual = PeakFinder.find_peak_borders(chrom, peaks)
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    np.testing.assert_array_equal(chrom["intensity"], chrom_ref["intensity"])
+    assert (actual["left_border"] >= 0).all()
+    assert (actual["right_border"] <= len(chrom) - 1).all()
+    assert (actual["left_border"] <= actual["index"]).all()
+    assert (actual["index"] <= actual["right_border"]).all()
+
+
+@given(signals_with_peaks(), st.data())
+@settings(deadline=None)
+def test_trapezoid_areas(case: tuple[np.ndarray, np.ndarray], data) -> None:
+    intensity, index = case
+    n = len(intensity)
+    chrom = as_chrom(intensity, data.draw(retention_times(n)))
+    peaks = PeakFinder.find_peak_borders(chrom, as_peaks(chrom, index))
+    expected = reference.trapezoid_areas(chrom, peaks)
+    Integrator.ChromTrapezoidIntegrator().integrate(chrom, peaks)
+
+    scale = np.abs(chrom["intensity"]).sum()
+    np.testing.assert_allclose(peaks["area"], expected, rtol=1e-9, atol=1e-12 * scale)
+    # zero-width peaks have no area
+    assert (peaks.loc[peaks["left_border"] == peaks["right_border"], "area"] == 0).all()
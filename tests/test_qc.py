@@ -0,0 +1,87 @@
+"""QC metrics of runs and the rolling batch reference."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import QC
+
+
+def run(peak_count: float, **metrics: float) -> dict[str, float]:
+    return {
+        "peak_count": peak_count,
+        "total_area": 1e7,
+        "median_width": 9.0,
+        "noise": 500.0,
+        "saturated_points": 0.0,
+        **metrics,
+    }
+
+
+def test_running_stats_window() -> None:
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(20, 3))
+    values[3, 1] = np.nan
+    stats = QC.RunningStats(3)
+    for x in values:
+        stats.add(x)
+    for x in values[:8]:
+        stats.remove(x)
+    np.testing.assert_allclose(stats.mean, np.nanmean(values[8:], axis=0))
+    np.testing.assert_allclose(stats.std, np.nanstd(values[8:], axis=0, ddof=1))
+
+
+def test_replicate_runs_do_not_lock_in() -> None:
+    reference = QC.BatchReference(min_runs=5)
+    for _ in range(5):
+        reference.update(run(7))
+    # identical replicates have no variance: one more peak or a few more area is no outlier
+    assert reference.check(run(8, total_area=1.02e7)) == []
+    assert reference.check(run(12)) == ["peak_count"]
+    assert reference.check(run(7, total_area=2e7)) == ["total_area"]
+    assert reference.check(run(7, saturated_points=1.0)) == []
+    assert reference.check(run(7, saturated_points=50.0)) == ["saturated_points"]
+
+
+def test_min_runs_and_flagged_runs() -> None:
+    reference = QC.BatchReference(window=10, min_runs=3)
+    reference.update(run(7))
+    reference.update(run(8))
+    assert np.isnan(reference.zscores(run(30))["peak_count"])
+    reference.update(run(7))
+    assert reference.check(run(30)) == ["peak_count"]
+    # NaN metrics are never flagged
+    assert "is_rt_drift" not in reference.check(run(7, is_rt_drift=np.nan))
+
+
+def test_window_drops_old_runs() -> None:
+    reference = QC.BatchReference(window=5, min_runs=5)
+    for _ in range(5):
+        reference.update(run(7))
+    for _ in range(5):
+        reference.update(run(20))
+    assert reference.stats.mean[0] == pytest.approx(20.0)
+    assert reference.check(run(20)) == []
+
+
+def test_run_metrics() -> None:
+    chrom = pd.DataFrame({"intensity": [0.0, 5.0, 10.0, 10.0, 5.0, 0.0, 3.0, 0.0]})
+    peaks = pd.DataFrame(
+        {
+            "index": [2, 6],
+            "retention_time": [2.0, 6.0],
+            "area": [30.0, 3.0],
+            "width": [4.0, 2.0],
+            "noise": [1.0, 3.0],
+            "left_border": [0, 5],
+            "right_border": [5, 7],
+        }
+    )
+    metrics = QC.run_metrics(chrom, peaks, reference_rt=6.5, rt_tolerance=1.0)
+    assert metrics == {
+        "peak_count": 2.0,
+        "total_area": 33.0,
+        "median_width": 3.0,
+        "noise": 2.0,
+        "saturated_points": 2.0,
+        "is_rt_drift": -0.5,
+    }
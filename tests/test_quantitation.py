@@ -0,0 +1,186 @@
+"""Target matching, calibration curves and their cache, and quantitation of batches."""
+
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, Quantitation
+
+# area = SLOPE * concentration + INTERCEPT for every compound
+SLOPE = {"A": 1000.0, "B": 250.0}
+INTERCEPT = 50.0
+TARGETS = pd.DataFrame(
+    {"compound": ["A", "B"], "retention_time": [300.0, 600.0], "ri": [1000, 1400]}
+)
+STANDARDS = {"std1": 1.0, "std2": 5.0, "std3": 10.0, "std4": 50.0}
+SAMPLES = {"sample1": {"A": 2.0, "B": 20.0}, "sample2": {"A": 40.0, "B": 0.5}}
+
+
+def run_peaks(run: str, concentrations: dict[str, float], shift: float = 0.0):
+    rows = [
+        # a neighbour of each target inside the window, but farther away
+        (300.0 + shift, 1000, SLOPE["A"] * concentrations["A"] + INTERCEPT),
+        (303.5, 1010, 1.0),
+        (600.0 - shift, 1400, SLOPE["B"] * concentrations["B"] + INTERCEPT),
+        (597.0, 1390, 2.0),
+        (900.0, 1800, 3.0),
+    ]
+    return pd.DataFrame(rows, columns=["retention_time", "ri", "area"]).assign(run=run)
+
+
+def batch_peaks() -> pd.DataFrame:
+    runs = [run_peaks(run, {"A": c, "B": c}) for run, c in STANDARDS.items()]
+    runs += [run_peaks(run, c, shift=0.5) for run, c in SAMPLES.items()]
+    return pd.concat(runs, ignore_index=True)
+
+
+def standards() -> pd.DataFrame:
+    return pd.DataFrame(
+        {"A": list(STANDARDS.values()), "B": list(STANDARDS.values())},
+        index=pd.Index(list(STANDARDS), name="run"),
+    ).rename_axis(columns="compound")
+
+
+def test_read_peak_tables(tmp_path: pathlib.Path) -> None:
+    store = Batch.ResultStore(tmp_path / "out", input_root=tmp_path)
+    store.output_dir.mkdir()
+    for name in ("night1/run01.csv", "night2/run01.csv"):
+        run_peaks("", {"A": 1.0, "B": 1.0}).drop(columns="run").to_csv(
+            store.path_for(tmp_path / name), index=False
+        )
+    (store.output_dir / "qc.csv").write_text("input_path\n")
+    peaks = Quantitation.read_peak_tables(store.output_dir)
+    assert sorted(peaks["run"].unique()) == ["night1__run01", "night2__run01"]
+    assert len(peaks) == 10
+    assert Quantitation.read_peak_tables(tmp_path / "empty").empty
+
+
+def test_match_targets() -> None:
+    areas = Quantitation.match_targets(batch_peaks(), TARGETS, by="retention_time")
+    assert list(areas.index) == sorted([*STANDARDS, *SAMPLES])
+    assert list(areas.columns) == ["A", "B"]
+    # the closest peak wins over its neighbour in the window
+    assert areas.loc["std2", "A"] == SLOPE["A"] * 5.0 + INTERCEPT
+    assert areas.loc["sample2", "B"] == SLOPE["B"] * 0.5 + INTERCEPT
+
+
+def test_match_targets_window() -> None:
+    peaks = batch_peaks()
+    targets = TARGETS.assign(retention_time=[310.0, 600.0], window=[np.nan, 0.1])
+    areas = Quantitation.match_targets(peaks, targets, by="retention_time", window=8.0)
+    # A: only the neighbour at 303.5 is within the default window
+    assert (areas["A"] == 1.0).all()
+    # B: the per-target window excludes the shifted peaks of the samples
+    assert areas.loc[list(SAMPLES), "B"].isna().all()
+    assert areas.loc[list(STANDARDS), "B"].notna().all()
+
+
+def test_match_targets_prefers_ri() -> None:
+    peaks = batch_peaks()
+    # retention times are off, the retention indices are right
+    targets = TARGETS.assign(retention_time=[0.0, 0.0])
+    by_ri = Quantitation.match_targets(peaks, targets, window=2.0)
+    assert by_ri.notna().all().all()
+    assert (
+        Quantitation.match_targets(peaks, targets, by="retention_time", window=2.0)
+        .isna()
+        .all()
+        .all()
+    )
+    with pytest.raises(ValueError):
+        Quantitation.match_targets(peaks.drop(columns="area"), targets)
+
+
+@pytest.mark.parametrize("weighting", Quantitation.WEIGHTINGS)
+def test_linear_curves(weighting: str) -> None:
+    areas = Quantitation.match_targets(batch_peaks(), TARGETS)
+    curves = Quantitation.fit_curves(areas, standards(), weighting=weighting)
+    np.testing.assert_allclose(curves.coef, [[1000.0, 50.0], [250.0, 50.0]])
+    np.testing.assert_allclose(curves.r2, 1.0)
+    conc = curves.quantify(areas)
+    for run, expected in SAMPLES.items():
+        np.testing.assert_allclose(conc.loc[run, ["A", "B"]], list(expected.values()))
+    in_range = curves.in_range(conc)
+    assert in_range.loc["sample1"].tolist() == [True, True]
+    assert in_range.loc["sample2"].tolist() == [True, False]
+
+
+def test_quadratic_curves() -> None:
+    x = np.array([1.0, 2.0, 5.0, 10.0, 20.0])
+    conc = pd.DataFrame({"A": x}, index=[f"s{i}" for i in range(len(x))])
+    areas = pd.DataFrame({"A": 3 * x**2 + 40 * x + 10}, index=conc.index)
+    curves = Quantitation.fit_curves(areas, conc, model="quadratic")
+    np.testing.assert_allclose(curves.coef, [[3.0, 40.0, 10.0]], rtol=1e-6)
+    unknown = pd.DataFrame({"A": [3 * 7.0**2 + 40 * 7.0 + 10]}, index=["u"])
+    np.testing.assert_allclose(curves.quantify(unknown)["A"], [7.0], rtol=1e-6)
+
+
+def test_too_few_standards() -> None:
+    conc = standards().assign(B=[np.nan, np.nan, np.nan, 10.0])
+    areas = Quantitation.match_targets(batch_peaks(), TARGETS)
+    curves = Quantitation.fit_curves(areas, conc)
+    assert np.isnan(curves.coef[1]).all()
+    result = curves.quantify(areas.assign(C=1.0))
+    # no curve for B, and C is not calibrated at all
+    assert result["B"].isna().all()
+    assert result["C"].isna().all()
+    assert result["A"].notna().all()
+
+
+def test_fit_curves_errors() -> None:
+    areas = Quantitation.match_targets(batch_peaks(), TARGETS)
+    with pytest.raises(ValueError):
+        Quantitation.fit_curves(areas, standards(), model="cubic")
+    with pytest.raises(ValueError):
+        Quantitation.fit_curves(areas, standards(), weighting="1/y")
+    with pytest.raises(ValueError):
+        Quantitation.fit_curves(areas.drop(index="std1"), standards())
+
+
+def test_curve_cache(tmp_path: pathlib.Path, monkeypatch) -> None:
+    areas = Quantitation.match_targets(batch_peaks(), TARGETS)
+    cache = Quantitation.CurveCache(tmp_path / "curves")
+    curves = cache.get_or_fit(areas, standards())
+    assert cache.get_or_fit(areas, standards()) is curves
+    # sample areas are not part of the key, standard areas and settings are
+    changed = areas.copy()
+    changed.loc["sample1", "A"] += 1
+    assert cache.get_or_fit(changed, standards()) is curves
+    changed.loc["std1", "A"] += 1
+    assert cache.get_or_fit(changed, standards()) is not curves
+    assert cache.get_or_fit(areas, standards(), weighting="none") is not curves
+    assert len(list((tmp_path / "curves").glob("*.npz"))) == 3
+
+    def fail(*args, **kwargs):
+        raise AssertionError("curves were refitted")
+
+    # a new cache on the same directory loads the curves instead of fitting them
+    monkeypatch.setattr(Quantitation, "fit_curves", fail)
+    loaded = Quantitation.CurveCache(tmp_path / "curves").get_or_fit(areas, standards())
+    pd.testing.assert_frame_equal(loaded.summary(), curves.summary())
+    assert (loaded.model, loaded.weighting) == ("linear", "1/x")
+
+
+def test_quantify_runs(tmp_path: pathlib.Path) -> None:
+    TARGETS.to_csv(tmp_path / "targets.csv", index=False)
+    pd.DataFrame(
+        [(run, compound, c) for run, c in STANDARDS.items() for compound in "AB"],
+        columns=["run", "compound", "concentration"],
+    ).to_csv(tmp_path / "standards.csv", index=False)
+    targets = Quantitation.read_targets(tmp_path / "targets.csv")
+    conc, curves = Quantitation.quantify_runs(
+        batch_peaks(),
+        targets,
+        Quantitation.read_standards(tmp_path / "standards.csv"),
+        by="retention_time",
+    )
+    for run, expected in SAMPLES.items():
+        np.testing.assert_allclose(conc.loc[run, ["A", "B"]], list(expected.values()))
+    for run, c in STANDARDS.items():
+        np.testing.assert_allclose(conc.loc[run], [c, c])
+    assert list(curves.summary().columns) == ["c1", "c0", "conc_min", "conc_max", "r2"]
+
+    (tmp_path / "bad.csv").write_text("name,retention_time\nA,300\n")
+    with pytest.raises(ValueError):
+        Quantitation.read_targets(tmp_path / "bad.csv")
@@ -0,0 +1,86 @@
+"""Retention index calibrations and their cache."""
+
+import dataclasses
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Batch, RetentionIndex
+from . import synthetic
+
+LADDER_RT = (200.0, 400.0, 600.0, 800.0, 1000.0, 1200.0)
+
+
+@pytest.fixture(autouse=True)
+def fresh_process(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Every test starts without the calibrations kept per process, like a new batch"""
+    monkeypatch.setattr(Batch, "_calibrations", {})
+
+
+def test_to_ri() -> None:
+    calibration = RetentionIndex.RiCalibration((8, 9, 10), (100.0, 200.0, 400.0))
+    np.testing.assert_allclose(
+        calibration.to_ri([100.0, 150.0, 300.0, 500.0]), [800, 850, 950, 1050]
+    )
+    kovats = dataclasses.replace(calibration, mode="kovats")
+    assert kovats.to_ri(np.sqrt(100.0 * 200.0)) == pytest.approx(850.0)
+    with pytest.raises(ValueError):
+        RetentionIndex.RiCalibration((9, 8), (100.0, 200.0))
+
+
+def test_detect_ladder() -> None:
+    peaks = pd.DataFrame(
+        {
+            "retention_time": [*LADDER_RT, 700.0],
+            "intensity": [1e5] * len(LADDER_RT) + [1e3],
+        }
+    ).sort_values("retention_time")
+    calibration = RetentionIndex.detect_ladder(peaks, first_carbon=10)
+    assert calibration.carbons == tuple(range(10, 16))
+    assert calibration.retention_times == LADDER_RT
+
+
+def test_cache_follows_ladder_and_settings(tmp_path: pathlib.Path) -> None:
+    ladder = tmp_path / "ladder.csv"
+    pd.DataFrame({"carbon": [8, 9, 10], "retention_time": LADDER_RT[:3]}).to_csv(
+        ladder, index=False
+    )
+    config = Batch.PipelineConfig(ri_ladder=str(ladder), ri_cache_dir=str(tmp_path))
+    first = Batch.load_calibration(config)
+    assert first.mode == "linear"
+    assert RetentionIndex.CalibrationCache(tmp_path).get("default", "default") == first
+
+    # a later batch with another mode
+    Batch._calibrations.clear()
+    kovats = Batch.load_calibration(dataclasses.replace(config, ri_mode="kovats"))
+    assert kovats.mode == "kovats"
+
+    # a later batch after the ladder file changed in place
+    Batch._calibrations.clear()
+    pd.DataFrame({"carbon": [8, 9, 10], "retention_time": LADDER_RT[3:]}).to_csv(
+        ladder, index=False
+    )
+    os.utime(ladder, ns=(0, 10**18))
+    changed = Batch.load_calibration(config)
+    assert changed.retention_times == LADDER_RT[3:]
+
+    # unchanged: read from the cache
+    Batch._calibrations.clear()
+    assert Batch.load_calibration(config) == changed
+
+
+def test_first_carbon_of_ladder_run(tmp_path: pathlib.Path) -> None:
+    chrom = synthetic.chromatogram(
+        seed=1, peaks=tuple((rt, 1e6, 3.0) for rt in LADDER_RT)
+    )
+    run = synthetic.write_csv(chrom, tmp_path / "alkanes.csv")
+    config = Batch.PipelineConfig(
+        min_snr=5.0, ri_ladder=str(run), ri_cache_dir=str(tmp_path / "cache")
+    )
+    assert Batch.load_calibration(config).carbons == tuple(range(8, 14))
+    Batch._calibrations.clear()
+    shifted = dataclasses.replace(config, ri_first_carbon=10)
+    calibration = Batch.load_calibration(shifted)
+    assert calibration.carbons == tuple(range(10, 16))
+    np.testing.assert_allclose(calibration.retention_times, LADDER_RT, atol=0.5)
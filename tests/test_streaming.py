@@ -0,0 +1,101 @@
+"""Streaming processing gives the same trace, peaks, borders and areas as the batch pipeline."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Integrator, PeakFinder, Processor, Streaming
+from . import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore:some peaks have")
+
+N = 3000
+# the last peak is a few points before the end of the run, so it is finished by finish()
+PEAKS = [(100.0, 4e5, 3.0), (700.0, 2e5, 1.5), (710.0, 1e5, 1.5), (1799.0, 3e5, 1.0)]
+
+
+def batch(chrom: pd.DataFrame, height: float) -> tuple[pd.DataFrame, pd.DataFrame]:
+    p = Processor.ChromatogramProcessor()
+    p.df.init_chromatogram(chrom[["retention_time", "intensity"]])
+    p.filter_savgol(5, 2)
+    p.set_peak_finder(PeakFinder.LocalMaxChromPeakFinder(2, height))
+    p.find_peaks(p.df.chromatogram)
+    p.find_peak_borders()
+    p.set_integrator(Integrator.ChromTrapezoidIntegrator())
+    p.integrate_peak_area()
+    return p.df.chromatogram, p.df.peaks
+
+
+def stream(
+    chrom: pd.DataFrame, feed_size: int, height: float, chunk_size: int = 4096
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    processor = Streaming.StreamingChromProcessor(
+        5, 2, order=2, height=height, chunk_size=chunk_size
+    )
+    rt = chrom["retention_time"].to_numpy()
+    intensity = chrom["intensity"].to_numpy()
+    updates = [
+        processor.feed(rt[i : i + feed_size], intensity[i : i + feed_size])
+        for i in range(0, len(rt), feed_size)
+    ]
+    updates.append(processor.finish())
+    return (
+        pd.concat([u.chromatogram for u in updates], ignore_index=True),
+        pd.concat([u.peaks for u in updates], ignore_index=True),
+    )
+
+
+@pytest.mark.parametrize("height", [0.0, 5e4])
+@pytest.mark.parametrize("feed_size", [1, 7, 13, 250, N])
+def test_same_as_batch(feed_size: int, height: float) -> None:
+    chrom = synthetic.chromatogram(seed=3, n=N, peaks=PEAKS)
+    expected_chrom, expected_peaks = batch(chrom, height)
+    streamed_chrom, streamed_peaks = stream(chrom, feed_size, height)
+
+    # every data point is emitted once, in order
+    np.testing.assert_array_equal(streamed_chrom["index"], np.arange(N))
+    np.testing.assert_array_equal(
+        streamed_chrom["retention_time"], expected_chrom["retention_time"]
+    )
+    np.testing.assert_allclose(
+        streamed_chrom["intensity"], expected_chrom["intensity"], rtol=1e-9
+    )
+    assert len(streamed_peaks) == len(expected_peaks)
+    if height > 0:
+        assert len(streamed_peaks) == len(PEAKS)
+        assert streamed_peaks["index"].iloc[-1] >= N - 5
+    pd.testing.assert_frame_equal(
+        streamed_peaks,
+        expected_peaks[Streaming.PEAK_COLUMNS].reset_index(drop=True),
+        check_dtype=False,
+        rtol=1e-9,
+    )
+
+
+def test_large_feeds_in_pieces() -> None:
+    chrom = synthetic.chromatogram(seed=4, n=N, peaks=PEAKS)
+    expected_chrom, expected_peaks = batch(chrom, 5e4)
+    # feeds larger than chunk_size are processed in pieces with a small buffer
+    streamed_chrom, streamed_peaks = stream(chrom, 1000, 5e4, chunk_size=64)
+    np.testing.assert_allclose(
+        streamed_chrom["intensity"], expected_chrom["intensity"], rtol=1e-9
+    )
+    pd.testing.assert_frame_equal(
+        streamed_peaks,
+        expected_peaks[Streaming.PEAK_COLUMNS].reset_index(drop=True),
+        check_dtype=False,
+        rtol=1e-9,
+    )
+
+
+def test_errors() -> None:
+    processor = Streaming.StreamingChromProcessor()
+    with pytest.raises(ValueError):
+        processor.feed(np.arange(3.0), np.arange(4.0))
+    processor.feed(np.arange(3.0), np.arange(3.0))
+    # fewer points than the filter window
+    with pytest.raises(ValueError):
+        processor.finish()
+    processor.feed(np.arange(3.0, 10.0), np.arange(7.0))
+    processor.finish()
+    with pytest.raises(ValueError):
+        processor.feed(np.arange(1.0), np.arange(1.0))
@@ -0,0 +1,45 @@
+"""Shared memory transport of DataFrames between processes."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from gcms import Transport
+from . import synthetic
+
+
+def test_attached_frame_is_not_written() -> None:
+    chrom = synthetic.chromatogram(seed=1, n=500)
+    with Transport.SharedFrameStore() as store:
+        handle = store.share(chrom)
+        with Transport.attach(handle) as df:
+            pd.testing.assert_frame_equal(df, chrom)
+            assert not df["intensity"].to_numpy().flags.writeable
+            try:
+                df.loc[0, "intensity"] = -1.0
+                # copy-on-write (pandas >= 3): the column was copied
+                assert df.at[0, "intensity"] == -1.0
+            except ValueError as e:
+                # pandas < 3: the read-only view can not be written
+                assert "read-only" in str(e)
+            df["retention_time"] = np.zeros(len(df))
+        # the block is unchanged
+        pd.testing.assert_frame_equal(Transport.read_frame(handle), chrom)
+
+
+def test_block_lifetime() -> None:
+    peaks = pd.DataFrame({"index": np.arange(5), "area": np.linspace(1.0, 2.0, 5)})
+    handle = Transport.hand_over(peaks)
+    pd.testing.assert_frame_equal(Transport.collect(handle), peaks)
+    # collect() removed the block
+    with pytest.raises(FileNotFoundError):
+        Transport.attach(handle)
+
+    with Transport.SharedFrameStore() as store:
+        kept, released = store.share(peaks), store.share(peaks)
+        store.release(released)
+        assert len(store) == 1
+        with pytest.raises(FileNotFoundError):
+            Transport.attach(released)
+        pd.testing.assert_frame_equal(Transport.read_frame(kept), peaks)
+    with pytest.raises(FileNotFoundError):
+        Transport.attach(kept)